@@ -3,6 +3,8 @@ import threading
 import asyncio
 import signal
 import re
+import os
+from concurrent.futures import ThreadPoolExecutor
 try:
 
     import colorama
@@ -120,6 +122,10 @@ def main():
 
     async def start_services():
         loop = asyncio.get_running_loop()
+        # Общий пул для asyncio.to_thread: синхронные вызовы SQLite из хендлеров бота.
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4), thread_name_prefix="db")
+        )
         bot_controller.set_loop(loop)
         flask_app.config['EVENT_LOOP'] = loop
         
@@ -1,14 +1,19 @@
 import logging
 import asyncio
 import time
-import uuid
 import re
+import secrets
+import sys
 import html as html_escape
 import hashlib
 import json
+import functools
+import contextlib
 from datetime import datetime, timedelta
 
+import aiohttp
 from aiogram import Bot, Router, F, types
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -16,14 +21,23 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from shop_bot.bot import keyboards
 from shop_bot.bot.callback_safety import fast_callback_answer, catch_callback_errors
+from shop_bot.bot.middlewares import AdminFilter, FsmDataMiddleware
 from shop_bot.data_manager import speedtest_runner
 from shop_bot.data_manager import resource_monitor
 from shop_bot.data_manager import remnawave_repository as rw_repo
 from shop_bot.data_manager.remnawave_repository import (
     get_all_users,
+    get_users_paginated,
+    get_user_by_username,
+    get_users_by_ids,
+    search_users,
     get_setting,
+    get_admin_ids,
+    peek_admin_ids,
+    reload_admin_ids,
     get_user,
     get_keys_for_user,
+    count_keys_for_user,
     create_gift_key,
     get_all_hosts,
     get_all_ssh_targets,
@@ -33,14 +47,15 @@ from shop_bot.data_manager.remnawave_repository import (
     unban_user,
     delete_key_by_email,
     get_admin_stats,
-    get_keys_for_host,
-    is_admin,
+    get_keys_for_host_page,
     get_referral_count,
     get_referral_balance_all,
     get_referrals_for_user,
-    create_promo_code,
-    list_promo_codes,
-    update_promo_code_status,
+    prepare_promo_code_row,
+    insert_promo_code_rows,
+    get_promo_code,
+    list_promo_codes_page,
+    toggle_promo_code_status,
     # hosts
     create_host,
     delete_host,
@@ -58,6 +73,7 @@ from shop_bot.data_manager.database import (
     delete_user_completely,
     create_plan,
     get_plans_for_host,
+    get_plans_version,
     get_plan_by_id,
     update_plan,
     delete_plan,
@@ -89,6 +105,554 @@ def _mask_secret(value: str | None) -> str:
         return "•" * len(v)
     return f"{v[:2]}•••{v[-2:]}"
 
+
+# Ввод в редакторе тарифа проверяем заранее скомпилированными шаблонами,
+# без try/except вокруг int()/float().
+_INT_RE = re.compile(r'\d{1,7}')
+_PRICE_RE = re.compile(r'\d{1,7}(?:[.,]\d{1,2})?')
+_GB_RE = re.compile(r'(\d{1,6})(?:[.,](\d{1,3}))?')
+_GIB = 1 << 30
+# Числовой хвост callback_data вида "admin_ban_user_123"
+_TAIL_ID_RE = re.compile(r'_(\d+)$')
+_SLUG_RE = re.compile(r"[^a-z0-9._-]")
+# Пикеры пользователя (подарок, начисление, списание): один якорный шаблон на
+# "admin_<action>_pick_user_<id>", "..._pick_user_page_<n>" и короткое "admin_<action>_<id>"
+# вместо пары хендлеров на каждый action.
+_USER_PICK_RE = re.compile(r'^admin_(gift|add_balance|deduct_balance)_(?:pick_user_(page_)?)?(\d+)$')
+_USER_PICK_TITLES = {
+    "gift": "🎁 Выдача подарочного ключа\n\nВыберите пользователя:",
+    "add_balance": "➕ Начисление баланса\n\nВыберите пользователя:",
+    "deduct_balance": "➖ Списание баланса\n\nВыберите пользователя:",
+}
+# Десятичная запятая -> точка одним проходом translate.
+_NUM_TRANS = str.maketrans(",", ".")
+# То же, что html.escape(s, quote=True), одним проходом translate — для длинных ссылок подписки.
+_HTML_TRANS = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+# Мастер создания промокода.
+_PROMO_CODE_RE = re.compile(r"[A-Z0-9_-]{3,32}")
+_UNLIMITED_TOKENS = frozenset({'', '0', '∞', 'inf', 'infinity', 'безлимит', 'нет'})
+_SKIP_TOKENS = frozenset({'', 'skip', 'пропустить', 'нет'})
+_DT_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2}))?")
+_PROMO_LIMIT_TOTAL_PREFIX = "admin_promo_limit_total_"
+_PROMO_LIMIT_USER_PREFIX = "admin_promo_limit_user_"
+_PROMO_VALID_FROM_PREFIX = "admin_promo_valid_from_"
+_PROMO_VALID_UNTIL_PREFIX = "admin_promo_valid_until_"
+_VALID_UNTIL_DELTAS = {"plus1d": 1, "plus7d": 7, "plus30d": 30}
+
+
+# callback_data несёт короткий SHA1-префикс имени (лимит Telegram 64 байта).
+# Первые 12 hex-символов укладываются в одно целое, поэтому индекс
+# «дайджест -> имя» держим с int-ключами и пересобираем только при смене списка имён.
+_DIGEST_KEY_HEX = 12
+_DIGEST_INDEXES: dict[str, tuple[tuple[str, ...], dict[int, str]]] = {}
+
+
+def _digest_key(digest: str | None) -> int | None:
+    head = (digest or "").strip()[:_DIGEST_KEY_HEX]
+    if len(head) < _DIGEST_KEY_HEX:
+        return None
+    try:
+        return int(head, 16)
+    except ValueError:
+        return None
+
+
+def _name_digest_key(name) -> int:
+    full = hashlib.sha1(str(name or '').encode('utf-8', 'ignore')).hexdigest()
+    return int(full[:_DIGEST_KEY_HEX], 16)
+
+
+def _lookup_by_digest(kind: str, names, digest: str | None) -> str | None:
+    names_t = tuple(names)
+    cached = _DIGEST_INDEXES.get(kind)
+    if cached is None or cached[0] != names_t:
+        index = {_name_digest_key(n): n for n in names_t}
+        _DIGEST_INDEXES[kind] = (names_t, index)
+    else:
+        index = cached[1]
+
+    key = _digest_key(digest)
+    if key is not None:
+        return index.get(key)
+
+    # Более короткий префикс (старые кнопки) — редкий путь, сравниваем строки.
+    prefix = (digest or "").strip()
+    if not prefix:
+        return None
+    for n in names_t:
+        if hashlib.sha1(str(n or '').encode('utf-8', 'ignore')).hexdigest().startswith(prefix):
+            return n
+    return None
+
+_esc = html_escape.escape
+
+# Сколько хостов/SSH-целей «тест для всех» гоняет одновременно.
+_SPEEDTEST_CONCURRENCY = 4
+
+# Размер блока при скачивании загруженной админом БД.
+_DOWNLOAD_CHUNK = 1 << 20
+
+
+@functools.lru_cache(maxsize=256)
+def _user_mention(user_id: int, username: str | None, full_name: str | None) -> str:
+    """HTML-упоминание пользователя; ключ кэша — все поля, так что смена имени даёт новую строку."""
+    if username:
+        return f"@{username.lstrip('@')}"
+    safe_name = _esc((full_name or "Администратор").strip())
+    return f"<a href='tg://user?id={user_id}'>{safe_name}</a>"
+
+
+_SSH_RESULT_OK_TEMPLATE = (
+    "🏁 Тест скорости (SSH-цель) завершён для <b>{name}</b>\n\n"
+    "<b>SSH:</b> ✅\n"
+    "• ping: {ping} ms\n"
+    "• ↓ {down} Mbps\n"
+    "• ↑ {up} Mbps\n"
+    "• сервер: {srv}"
+)
+_SSH_RESULT_FAIL_TEMPLATE = "🏁 Тест скорости (SSH-цель) завершён для <b>{name}</b>\n❌ {error}"
+
+
+def _format_ssh_result(target_name: str, result: dict) -> str:
+    if not result.get("ok"):
+        return _SSH_RESULT_FAIL_TEMPLATE.format(name=target_name, error=result.get('error') or 'ошибка')
+    return _SSH_RESULT_OK_TEMPLATE.format(
+        name=target_name,
+        ping=_dash_if_none(result.get('ping_ms')),
+        down=_dash_if_none(result.get('download_mbps')),
+        up=_dash_if_none(result.get('upload_mbps')),
+        srv=result.get('server_name') or '—',
+    )
+
+
+def _dash_if_none(value):
+    return '—' if value is None else value
+
+
+async def _admin_notify_ids(initiator_id: int) -> frozenset[int]:
+    """Кому слать уведомления спидтеста: все админы (из TTL-кэша) и инициатор.
+
+    Промах кэша читает БД в потоке, как AdminFilter, а не в event loop.
+    """
+    try:
+        admin_ids = peek_admin_ids()
+        if admin_ids is None:
+            admin_ids = await _db(reload_admin_ids)
+        return admin_ids | {int(initiator_id)}
+    except Exception:
+        return frozenset({int(initiator_id)})
+
+
+async def _safe_send(bot: Bot, chat_id: int, text: str, previous: types.Message | None = None) -> types.Message | None:
+    """Отправка с одним повтором после 429; если есть previous — сначала пробуем отредактировать его.
+
+    Ошибки Telegram API (чат недоступен, бот заблокирован и т.п.) глотаются
+    с записью в лог, прочие исключения пробрасываются.
+    """
+    if previous is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=previous.message_id)
+            return previous
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramAPIError:
+            pass
+    for attempt in range(2):
+        try:
+            return await bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            if attempt:
+                logger.warning(f"Рассылка: чат {chat_id} пропущен из-за лимита Telegram (retry_after={e.retry_after})")
+                return None
+            await asyncio.sleep(e.retry_after)
+        except TelegramAPIError as e:
+            logger.debug(f"Рассылка: не удалось отправить в чат {chat_id}: {e}")
+            return None
+    return None
+
+
+# Ссылки на фоновые задачи _fire, чтобы их не собрал GC до завершения
+_BACKGROUND: set[asyncio.Task] = set()
+# Одновременные запросы к панелям хостов из фоновых выдачи/продления ключей
+_HOST_CALLS = asyncio.Semaphore(8)
+
+
+async def _quiet(coro) -> None:
+    try:
+        await coro
+    except Exception as e:
+        logger.debug(f"Фоновая задача завершилась с ошибкой: {e}")
+
+
+def _fire(coro) -> None:
+    """Фоновая задача: ответ админу её не ждёт, ошибки только в лог."""
+    task = asyncio.create_task(_quiet(coro))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+
+
+# Очередь уведомлений пользователям: один воркер, темп не быстрее лимита
+# Telegram (~30 сообщений в секунду на бота), единая обработка 429
+_NOTIFY_INTERVAL = 1 / 30
+_notify_queue: asyncio.Queue | None = None
+_notify_task: asyncio.Task | None = None
+_notify_next_at = 0.0
+
+
+async def _notify_slot() -> None:
+    global _notify_next_at
+    now = time.monotonic()
+    slot = max(now, _notify_next_at)
+    _notify_next_at = slot + _NOTIFY_INTERVAL
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+async def _notify_worker(queue: asyncio.Queue) -> None:
+    while True:
+        bot, chat_id, text, kwargs = await queue.get()
+        try:
+            for attempt in range(2):
+                await _notify_slot()
+                try:
+                    await bot.send_message(chat_id, text, **kwargs)
+                    break
+                except TelegramRetryAfter as e:
+                    if attempt:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.debug(f"Уведомление в чат {chat_id} не доставлено: {e}")
+        finally:
+            queue.task_done()
+
+
+def _notify(bot: Bot, chat_id: int, text: str, **kwargs) -> None:
+    """Поставить уведомление пользователю в очередь; воркер стартует при первом вызове."""
+    global _notify_queue, _notify_task
+    if _notify_queue is None:
+        _notify_queue = asyncio.Queue()
+        _notify_task = asyncio.create_task(_notify_worker(_notify_queue))
+    _notify_queue.put_nowait((bot, chat_id, text, kwargs))
+
+
+async def _host_task(coro, placeholder: types.Message, error_text: str) -> None:
+    """Фоновая операция с хостом, начатая с заглушки у админа.
+
+    В отличие от _quiet, сбой пишется в лог как ошибка, а заглушка заменяется
+    текстом ошибки — иначе админ навсегда остаётся с «Создаю ключ…».
+    """
+    try:
+        await coro
+    except Exception:
+        logger.exception("Фоновая операция с хостом завершилась с ошибкой")
+        await _safe_send(placeholder.bot, placeholder.chat.id, error_text, previous=placeholder)
+
+
+async def _broadcast(bot: Bot, ids, text: str, exclude=(), replace: dict | None = None) -> dict[int, types.Message]:
+    """Рассылка одного текста нескольким чатам параллельно, ошибки доставки глотаются.
+
+    Возвращает доставленные сообщения по chat_id. Если передан replace
+    (результат предыдущей рассылки), текст всё равно уходит новым сообщением —
+    правка не даёт уведомления, — а старое «запущен» в этом чате удаляется.
+    """
+    replace = replace or {}
+    targets = [chat_id for chat_id in ids if chat_id not in exclude]
+    sent = await asyncio.gather(*(_safe_send(bot, chat_id, text) for chat_id in targets))
+    delivered = {chat_id: msg for chat_id, msg in zip(targets, sent) if msg is not None}
+    await asyncio.gather(*(
+        _quiet(bot.delete_message(chat_id, old.message_id))
+        for chat_id, old in replace.items() if chat_id in delivered
+    ))
+    return delivered
+
+
+def _format_price(price) -> str:
+    if isinstance(price, (int, float)):
+        return f"{price:.2f} RUB"
+    try:
+        return f"{float(price):.2f} RUB"
+    except (TypeError, ValueError):
+        return str(price or '—')
+
+
+_PLAN_DETAIL_TEMPLATE = (
+    "🧾 <b>Тариф</b>\n\n"
+    "ID: <b>#{pid}</b>\n"
+    "Хост: {host_part}\n"
+    "Название: <b>{name}</b>\n"
+    "Срок: <b>{duration}</b>\n"
+    "Цена: <b>{price}</b>\n"
+    "Лимит трафика: <b>{traffic}</b>\n"
+    "Лимит устройств: <b>{devices}</b>\n"
+    "Статус: <b>{status}</b>\n\n"
+    "Выберите действие:"
+)
+
+
+# Запись через database.* меняет версию plans сразу; TTL — страховка на
+# правки БД в обход этого процесса (ручные, другой инстанс).
+_PLANS_CACHE_TTL = 30.0
+
+
+def _plans_cache_key() -> tuple[int, int]:
+    return get_plans_version(), int(time.monotonic() // _PLANS_CACHE_TTL)
+
+
+@functools.lru_cache(maxsize=256)
+def _fetch_plans(host_name: str, version) -> tuple[dict, ...]:
+    """Тарифы хоста для версии таблицы plans; новая версия — новый ключ кэша."""
+    return tuple(get_plans_for_host(host_name) or [])
+
+
+@functools.lru_cache(maxsize=1)
+def _support_url_cached(epoch_minute: int) -> str | None:
+    support = (get_setting("support_bot_username") or get_setting("support_user") or "").strip()
+    if not support:
+        return None
+    if support.startswith("@"):
+        return f"tg://resolve?domain={support[1:]}"
+    if support.startswith("tg://"):
+        return support
+    if support.startswith("http://") or support.startswith("https://"):
+        part = support.split("/")[-1].split("?")[0]
+        return f"tg://resolve?domain={part}" if part else None
+    return f"tg://resolve?domain={support}"
+
+
+def _support_url() -> str | None:
+    """Ссылка на поддержку из настроек; ключ кэша — текущая минута, т.е. TTL до 60 с."""
+    return _support_url_cached(int(time.time() // 60))
+
+
+def _tail_id(data: str | None) -> int | None:
+    """Число в конце callback_data после последнего '_' или None."""
+    m = _TAIL_ID_RE.search(data or "")
+    return int(m.group(1)) if m else None
+
+
+async def _db(fn, *args, **kwargs):
+    """Синхронный вызов БД в пуле потоков, чтобы не блокировать event loop бота."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def _gen_promo_code() -> str:
+    """Случайный 8-символьный код, которого ещё нет в БД (коллизия — редкость)."""
+    code = secrets.token_hex(4).upper()
+    for _ in range(3):
+        if not await _db(get_promo_code, code):
+            break
+        code = secrets.token_hex(4).upper()
+    return code
+
+
+class _PromoWriter:
+    """Склеивает одновременные создания промокодов в одну транзакцию.
+
+    Окна ожидания нет: воркер забирает всё, что накопилось, пока поток БД был
+    занят предыдущей пачкой, так что одиночное создание не задерживается.
+    """
+
+    _MAX_BATCH = 50
+
+    def __init__(self) -> None:
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, kwargs: dict) -> bool:
+        row = prepare_promo_code_row(**kwargs)  # ValueError уходит вызывающему сразу
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((row, fut))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+        return await fut
+
+    async def _drain(self) -> None:
+        while self._pending:
+            batch = self._pending[:self._MAX_BATCH]
+            del self._pending[:self._MAX_BATCH]
+            try:
+                results = await _db(insert_promo_code_rows, [row for row, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), ok in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(ok)
+
+
+_promo_writer = _PromoWriter()
+
+
+@contextlib.asynccontextmanager
+async def _fsm_txn(state: FSMContext):
+    """Данные FSM одним get_data на входе и одним set_data на выходе (если менялись).
+
+    update_data в aiogram — это get + set, так что пара update_data/get_data
+    в одном обработчике стоит трёх обращений к хранилищу.
+    """
+    data = await state.get_data()
+    before = dict(data)
+    yield data
+    if data != before:
+        await state.set_data(data)
+
+
+async def _advance(state: FSMContext, next_state, **data) -> None:
+    """Переход мастера на следующий шаг: состояние и данные FSM пишутся параллельно.
+
+    В хранилище это независимые ключи, поэтому шаг стоит одного ожидания
+    хранилища вместо двух последовательных.
+    """
+    if data:
+        await asyncio.gather(state.set_state(next_state), state.update_data(**data))
+    else:
+        await state.set_state(next_state)
+
+
+# (user_id, callback_data) обработчиков, которые сейчас выполняются
+_INFLIGHT: set[tuple[int, str]] = set()
+
+
+def _singleflight(handler):
+    """Повторное нажатие той же кнопки, пока первое ещё обрабатывается, только отвечает «Уже выполняется»."""
+    @functools.wraps(handler)
+    async def wrapper(callback: types.CallbackQuery, *args, **kwargs):
+        key = (callback.from_user.id, callback.data)
+        if key in _INFLIGHT:
+            await callback.answer("Уже выполняется")
+            return
+        _INFLIGHT.add(key)
+        try:
+            return await handler(callback, *args, **kwargs)
+        finally:
+            _INFLIGHT.discard(key)
+    return wrapper
+
+
+def _user_tag(user_id: int, username: str | None) -> str:
+    """Ссылка на профиль: t.me/@username, если он есть, иначе tg://user?id=."""
+    uname = (username or '').strip().lstrip('@')
+    return f"<a href='https://t.me/{uname}'>@{uname}</a>" if uname else f"<a href='tg://user?id={user_id}'>Профиль</a>"
+
+
+def _fmt_user_card(user_id: int, user: dict, keys_count: int, is_banned: bool) -> str:
+    """Текст карточки пользователя — единственный шаблон для просмотра, поиска, бана и разбана."""
+    return (
+        f"👤 <b>Пользователь {user_id}</b>\n\n"
+        f"Имя пользователя: {_user_tag(user_id, user.get('username'))}\n"
+        f"Всего потратил: {float(user.get('total_spent') or 0):.2f} RUB\n"
+        f"Баланс: {float(user.get('balance') or 0):.2f} RUB\n"
+        f"Забанен: {'да' if is_banned else 'нет'}\n"
+        f"Приглашён: {user.get('referred_by') or '—'}\n"
+        f"Ключей: {keys_count}"
+    )
+
+
+async def _resolve_username_id(bot: Bot, raw: str) -> int | None:
+    """ID по @username: сначала индексированный поиск в БД, get_chat — только если там нет."""
+    uname = raw.lstrip('@')
+    if not uname:
+        return None
+    try:
+        u = await _db(get_user_by_username, uname)
+        if u:
+            return int(u['telegram_id'])
+    except Exception:
+        pass
+    for chat_ref in dict.fromkeys((raw, uname)):
+        try:
+            return int((await bot.get_chat(chat_ref)).id)
+        except Exception:
+            continue
+    return None
+
+
+async def _user_profile_view(user_id: int, user: dict | None = None, *, is_banned: bool | None = None):
+    """Карточка пользователя в админке: (text, markup) или None, если пользователя нет.
+
+    Строка users и число ключей читаются параллельно; уже загруженную строку можно
+    передать в user. ban/unban передают is_banned — новое состояние им известно.
+    """
+    if user is None:
+        user, keys_count = await asyncio.gather(_db(get_user, user_id), _db(count_keys_for_user, user_id))
+        if not user:
+            return None
+    else:
+        keys_count = await _db(count_keys_for_user, user_id)
+    if is_banned is None:
+        is_banned = bool(user.get('is_banned', False))
+    text = _fmt_user_card(user_id, user, keys_count, is_banned)
+    return text, keyboards.create_admin_user_actions_keyboard(user_id, is_banned=is_banned)
+
+
+# Список хостов для пикеров в админке: «назад» и повторные шаги
+# перерисовывают ту же клавиатуру, поэтому держим его недолго.
+_HOSTS_TTL = 60.0
+_hosts_cache: tuple[float, list] | None = None
+_hosts_cache_lock = asyncio.Lock()
+
+
+async def _cached_hosts() -> list:
+    global _hosts_cache
+    cached = _hosts_cache
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    async with _hosts_cache_lock:
+        cached = _hosts_cache
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        hosts = list(await _db(get_all_hosts) or [])
+        _hosts_cache = (time.monotonic() + _HOSTS_TTL, hosts)
+        return hosts
+
+
+def _invalidate_hosts() -> None:
+    global _hosts_cache
+    _hosts_cache = None
+
+
+_PICK_PAGE_SIZE = 10
+
+
+async def _users_pick_markup(page: int, action: str):
+    """Страница пикера пользователей: LIMIT/OFFSET в БД вместо всей таблицы users."""
+    users, total = await _db(get_users_paginated, page + 1, _PICK_PAGE_SIZE)
+    return keyboards.create_admin_users_pick_keyboard(users, total, page=page, page_size=_PICK_PAGE_SIZE, action=action)
+
+
+async def _host_keys_markup(host_name: str, page: int = 0):
+    """Страница ключей хоста: LIMIT/OFFSET в БД вместо всех ключей на каждый клик."""
+    keys, total = await _db(get_keys_for_host_page, host_name, page, _PICK_PAGE_SIZE)
+    return keyboards.create_admin_keys_for_host_keyboard(host_name, keys, total, page=page, page_size=_PICK_PAGE_SIZE)
+
+
+async def _with_answer(callback: types.CallbackQuery, aw):
+    """callback.answer() параллельно с aw (обычно чтением БД); возвращает результат aw."""
+    _, result = await asyncio.gather(callback.answer(), aw)
+    return result
+
+
+async def _edit_if_changed(message: types.Message, text: str, reply_markup=None) -> None:
+    """edit_text без запроса к Bot API, если сообщение уже показывает то же самое.
+
+    Если изменилась только клавиатура — edit_reply_markup вместо полного edit_text.
+    """
+    same_text = message.html_text == text
+    if same_text and message.reply_markup == reply_markup:
+        return
+    try:
+        if same_text:
+            await message.edit_reply_markup(reply_markup=reply_markup)
+        else:
+            await message.edit_text(text, reply_markup=reply_markup, parse_mode='HTML')
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+
 class Broadcast(StatesGroup):
     waiting_for_message = State()
     waiting_for_button_option = State()
@@ -101,21 +665,15 @@ class Broadcast(StatesGroup):
 
 def get_admin_router() -> Router:
     admin_router = Router()
+    admin_router.message.filter(AdminFilter())
+    admin_router.callback_query.filter(AdminFilter())
+    admin_router.message.middleware(FsmDataMiddleware())
+    admin_router.callback_query.middleware(FsmDataMiddleware())
 
 
     def _format_user_mention(u: types.User) -> str:
         try:
-            if u.username:
-                uname = u.username.lstrip('@')
-                return f"@{uname}"
-
-            full_name = (u.full_name or u.first_name or "Администратор").strip()
-
-            try:
-                safe_name = html_escape.escape(full_name)
-            except Exception:
-                safe_name = full_name
-            return f"<a href='tg://user?id={u.id}'>{safe_name}</a>"
+            return _user_mention(u.id, u.username, u.full_name or u.first_name)
         except Exception:
             return str(getattr(u, 'id', '—'))
 
@@ -129,15 +687,8 @@ def get_admin_router() -> Router:
             targets = get_all_ssh_targets() or []
         except Exception:
             targets = []
-        for t in targets:
-            name = t.get('target_name')
-            try:
-                h = hashlib.sha1((name or '').encode('utf-8', 'ignore')).hexdigest()
-            except Exception:
-                h = hashlib.sha1(str(name).encode('utf-8', 'ignore')).hexdigest()
-            if h == digest:
-                return name
-        return None
+        names = [t.get('target_name') for t in targets if t.get('target_name')]
+        return _lookup_by_digest('ssh_targets', names, digest)
 
     async def show_admin_menu(message: types.Message, edit_message: bool = False):
 
@@ -195,13 +746,34 @@ def get_admin_router() -> Router:
         value = (raw or "").strip()
         if not value or value.lower() in {"skip", "нет", "не", "none"}:
             return None
-        for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        m = _DT_RE.fullmatch(value)
+        if m:
+            year, month, day, hour, minute = m.groups()
             try:
-                return datetime.strptime(value, fmt)
-            except Exception:
-                continue
+                return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+            except ValueError:
+                pass
         raise ValueError("Неверный формат даты. Используйте 'ГГГГ-ММ-ДД' или 'ГГГГ-ММ-ДД ЧЧ:ММ'.")
 
+    def _render_promo_summary(data: dict) -> str:
+        """Сводка мастера создания промокода перед подтверждением."""
+        discount_type = data.get('discount_type')
+        total_limit = data.get('usage_limit_total')
+        per_user_limit = data.get('usage_limit_per_user')
+        valid_from = data.get('valid_from')
+        valid_until = data.get('valid_until')
+        return "\n".join((
+            "Проверьте данные промокода:",
+            f"Код: <code>{data.get('promo_code')}</code>",
+            f"Тип скидки: {'процент' if discount_type == 'percent' else 'фиксированная'}",
+            f"Значение: {data.get('discount_value'):.2f}{'%' if discount_type == 'percent' else ' RUB'}",
+            f"Лимит всего: {total_limit if total_limit is not None else 'без ограничений'}",
+            f"Лимит на пользователя: {per_user_limit if per_user_limit is not None else 'без ограничений'}",
+            f"Действует с: {valid_from.isoformat(' ') if valid_from else '—'}",
+            f"Действует до: {valid_until.isoformat(' ') if valid_until else '—'}",
+            f"Описание: {data.get('description') or '—'}",
+        ))
+
     def _format_promo_line(promo: dict) -> str:
         code = promo.get("code") or "—"
         discount_percent = promo.get("discount_percent")
@@ -242,12 +814,12 @@ def get_admin_router() -> Router:
         status_text = ", ".join(status_parts)
         return f"• <code>{code}</code> — скидка: {discount_text} | статус: {status_text}"
 
-    def _build_promo_list_keyboard(codes: list[dict], page: int = 0, page_size: int = 10) -> types.InlineKeyboardMarkup:
+    _PROMO_PAGE_SIZE = 10
+
+    def _build_promo_list_keyboard(page_items: list[dict], page: int, total: int, page_size: int = _PROMO_PAGE_SIZE) -> types.InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
-        total = len(codes)
         start = page * page_size
         end = start + page_size
-        page_items = codes[start:end]
         if not page_items:
             builder.button(text="Промокодов нет", callback_data="noop")
         for promo in page_items:
@@ -270,6 +842,20 @@ def get_admin_router() -> Router:
         builder.adjust(*(rows + tail if rows else tail))
         return builder.as_markup()
 
+    def _promo_list_view(page: int) -> tuple[str, types.InlineKeyboardMarkup, int]:
+        """Текст и клавиатура страницы списка промокодов; из БД читается только эта страница."""
+        page = max(0, page)
+        codes, total = list_promo_codes_page(include_inactive=True, limit=_PROMO_PAGE_SIZE, offset=page * _PROMO_PAGE_SIZE)
+        if not codes and total:
+            # страница опустела (коды удалили) — показываем последнюю
+            page = (total - 1) // _PROMO_PAGE_SIZE
+            codes, total = list_promo_codes_page(include_inactive=True, limit=_PROMO_PAGE_SIZE, offset=page * _PROMO_PAGE_SIZE)
+        if codes:
+            text = "\n".join(["🎟 <b>Доступные промокоды</b>", *map(_format_promo_line, codes)])
+        else:
+            text = "🎟 <b>Доступные промокоды</b>\nПока нет созданных промокодов."
+        return text, _build_promo_list_keyboard(codes, page, total), page
+
     async def show_admin_system_menu(message: types.Message, edit_message: bool = False):
         text = "🖥 <b>Система</b>\n\nВыберите действие:"
         try:
@@ -304,25 +890,16 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_menu")
     async def open_admin_menu_handler(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await show_admin_menu(callback.message, edit_message=True)
     @admin_router.callback_query(F.data == "admin_system_menu")
     async def open_admin_system_menu_handler(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await show_admin_system_menu(callback.message, edit_message=True)
 
 
     @admin_router.callback_query(F.data == "admin_settings_menu")
     async def open_admin_settings_menu_handler(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await show_admin_settings_menu(callback.message, edit_message=True)
 
@@ -503,9 +1080,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def admin_button_constructor_root(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.clear()
         await _btnc_show_menu_types(callback.message, edit=True)
 
@@ -513,9 +1087,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_select_menu_type(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         menu_type = (callback.data or "").split(":", 1)[1]
         await _btnc_show_list(callback.message, menu_type, page=0, edit=True)
 
@@ -523,9 +1094,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_open_list(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         menu_type = parts[1] if len(parts) > 1 else "main_menu"
         try:
@@ -538,9 +1106,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_open_details(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 3:
             return
@@ -555,9 +1120,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_toggle_active(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 3:
             return
@@ -575,9 +1137,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_delete_confirm(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 3:
             return
@@ -599,9 +1158,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_delete_do(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 3:
             return
@@ -624,9 +1180,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_action_menu(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 3:
             return
@@ -649,9 +1202,6 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_edit_field_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         parts = (callback.data or "").split(":")
         if len(parts) < 4:
             return
@@ -679,8 +1229,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(StateFilter(ButtonConstructor.editing_value))
     async def btnc_edit_field_value(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         field = data.get("btnc_field")
         menu_type = data.get("btnc_menu_type")
@@ -734,13 +1282,9 @@ def get_admin_router() -> Router:
     @catch_callback_errors
     @fast_callback_answer
     async def btnc_add_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         menu_type = (callback.data or "").split(":", 1)[1]
         await state.clear()
-        await state.update_data(btnc_menu_type=menu_type, btnc_new={})
-        await state.set_state(ButtonConstructor.adding_button_id)
+        await _advance(state, ButtonConstructor.adding_button_id, btnc_menu_type=menu_type, btnc_new={})
         await callback.message.edit_text(
             "➕ <b>Новая кнопка</b>\n\n"
             f"Меню: <b>{html_escape.escape(_btnc_menu_label(menu_type))}</b>\n\n"
@@ -751,8 +1295,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_button_id))
     async def btnc_add_button_id(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip()
@@ -761,14 +1303,11 @@ def get_admin_router() -> Router:
             return
         new = dict(data.get("btnc_new") or {})
         new["button_id"] = raw
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_text)
+        await _advance(state, ButtonConstructor.adding_text, btnc_new=new)
         await message.answer("Отправьте <b>текст кнопки</b>:", reply_markup=_btnc_cancel_kb(f"btnc_list:{menu_type}:0"))
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_text))
     async def btnc_add_text(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip()
@@ -795,8 +1334,7 @@ def get_admin_router() -> Router:
         action_type = (callback.data or "").split(":", 1)[1]
         new = dict(data.get("btnc_new") or {})
         new["action_type"] = action_type
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_action_value)
+        await _advance(state, ButtonConstructor.adding_action_value, btnc_new=new)
         if action_type == "url":
             prompt = "Отправьте <b>URL</b> (например https://example.com):"
         else:
@@ -805,8 +1343,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_action_value))
     async def btnc_add_action_value(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip()
@@ -821,8 +1357,7 @@ def get_admin_router() -> Router:
         else:
             new["callback_data"] = raw
             new["url"] = None
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_row)
+        await _advance(state, ButtonConstructor.adding_row, btnc_new=new)
 
         # suggest defaults based on existing items
         try:
@@ -839,8 +1374,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_row))
     async def btnc_add_row(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip().lower()
@@ -854,14 +1387,11 @@ def get_admin_router() -> Router:
                 return
         new = dict(data.get("btnc_new") or {})
         new["row_position"] = row
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_col)
+        await _advance(state, ButtonConstructor.adding_col, btnc_new=new)
         await message.answer("Отправьте <b>column_position</b> (целое число, обычно 0 или 1):", reply_markup=_btnc_cancel_kb(f"btnc_list:{menu_type}:0"))
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_col))
     async def btnc_add_col(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip()
@@ -872,8 +1402,7 @@ def get_admin_router() -> Router:
             return
         new = dict(data.get("btnc_new") or {})
         new["column_position"] = col
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_width)
+        await _advance(state, ButtonConstructor.adding_width, btnc_new=new)
         b = InlineKeyboardBuilder()
         b.button(text="1", callback_data="btnc_add_width:1")
         b.button(text="2", callback_data="btnc_add_width:2")
@@ -894,8 +1423,7 @@ def get_admin_router() -> Router:
             w = 1
         new = dict(data.get("btnc_new") or {})
         new["button_width"] = w
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_sort)
+        await _advance(state, ButtonConstructor.adding_sort, btnc_new=new)
         try:
             existing = get_button_configs_admin(menu_type, include_inactive=True) or []
             max_sort = max(int(x.get("sort_order", 0) or 0) for x in existing) if existing else 0
@@ -910,8 +1438,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(StateFilter(ButtonConstructor.adding_sort))
     async def btnc_add_sort(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         menu_type = data.get("btnc_menu_type")
         raw = (message.text or "").strip().lower()
@@ -925,8 +1451,7 @@ def get_admin_router() -> Router:
                 return
         new = dict(data.get("btnc_new") or {})
         new["sort_order"] = sort
-        await state.update_data(btnc_new=new)
-        await state.set_state(ButtonConstructor.adding_active)
+        await _advance(state, ButtonConstructor.adding_active, btnc_new=new)
         b = InlineKeyboardBuilder()
         b.button(text="✅ Активна", callback_data="btnc_add_active:1")
         b.button(text="🔴 Выключена", callback_data="btnc_add_active:0")
@@ -1008,7 +1533,7 @@ def get_admin_router() -> Router:
 
         stars_enabled = _is_true(get_setting('stars_enabled') or 'false')
         try:
-            stars_ratio = float(str(get_setting('stars_per_rub') or '0').replace(',', '.'))
+            stars_ratio = float(str(get_setting('stars_per_rub') or '0').translate(_NUM_TRANS))
         except Exception:
             stars_ratio = 0.0
         stars_active = bool(stars_enabled and stars_ratio > 0)
@@ -1114,7 +1639,7 @@ def get_admin_router() -> Router:
             enabled = _is_true(get_setting('stars_enabled') or 'false')
             flags['stars_enabled'] = enabled
             try:
-                ratio = float(str(get_setting('stars_per_rub') or '0').replace(',', '.'))
+                ratio = float(str(get_setting('stars_per_rub') or '0').translate(_NUM_TRANS))
             except Exception:
                 ratio = 0.0
             active = bool(enabled and ratio > 0)
@@ -1167,9 +1692,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_payments_menu")
     async def admin_payments_menu(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await fast_callback_answer(callback)
         await state.clear()
         await show_admin_payments_menu(callback.message, edit_message=True)
@@ -1177,9 +1699,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(lambda c: isinstance(getattr(c, "data", None), str) and c.data.startswith("admin_payments_open:"))
     async def admin_payments_open(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await fast_callback_answer(callback)
         provider = callback.data.split("admin_payments_open:", 1)[-1].strip()
         await state.clear()
@@ -1189,9 +1708,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(lambda c: isinstance(getattr(c, "data", None), str) and c.data.startswith("admin_payments_toggle:"))
     async def admin_payments_toggle(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await fast_callback_answer(callback)
         what = callback.data.split("admin_payments_toggle:", 1)[-1].strip()
         if what == 'sbp':
@@ -1289,9 +1805,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(lambda c: isinstance(getattr(c, "data", None), str) and c.data.startswith("admin_payments_set:"))
     async def admin_payments_set(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await fast_callback_answer(callback)
         try:
             _, provider, field = callback.data.split(":", 2)
@@ -1315,8 +1828,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPayments.waiting_for_value)
     async def admin_payments_set_value(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         provider = (data.get('payments_provider') or '').strip().lower()
         field = (data.get('payments_field') or '').strip().lower()
@@ -1332,7 +1843,7 @@ def get_admin_router() -> Router:
         # validators
         if (provider, field) == ('stars', 'ratio'):
             try:
-                rr = float(value.replace(',', '.')) if value else 0.0
+                rr = float(value.translate(_NUM_TRANS)) if value else 0.0
             except Exception:
                 await message.answer("❌ Введите число, например 1.0")
                 return
@@ -1356,9 +1867,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_payments_yoomoney_check")
     async def admin_payments_yoomoney_check(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await fast_callback_answer(callback)
         token = (get_setting('yoomoney_api_token') or '').strip()
         if not token:
@@ -1366,7 +1874,6 @@ def get_admin_router() -> Router:
             await show_admin_payment_detail(callback.message, 'yoomoney', edit_message=False)
             return
 
-        import aiohttp
         ok = False
         account = None
         err = None
@@ -1419,7 +1926,7 @@ def get_admin_router() -> Router:
     def _get_float_setting(key: str, default: float = 0.0) -> float:
         raw = str(get_setting(key) or str(default))
         try:
-            raw = raw.replace(",", ".")
+            raw = raw.translate(_NUM_TRANS)
             return float(raw)
         except Exception:
             return float(default)
@@ -1483,9 +1990,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral")
     async def admin_referral_menu_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminReferral.menu)
         await show_admin_referral_menu(callback.message, edit_message=True)
@@ -1493,9 +1997,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_toggle")
     async def admin_referral_toggle(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         current = _get_referral_settings_for_admin()["enabled"]
         rw_repo.update_setting("enable_referrals", "false" if current else "true")
         await callback.answer("Обновлено")
@@ -1505,9 +2006,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_toggle_days_bonus")
     async def admin_referral_toggle_days_bonus(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         current = _get_referral_settings_for_admin()["days_bonus"]
         rw_repo.update_setting("enable_referral_days_bonus", "false" if current else "true")
         await callback.answer("Обновлено")
@@ -1517,9 +2015,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_type")
     async def admin_referral_set_type(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         current_type = _get_referral_settings_for_admin()["reward_type"]
         kb = keyboards.create_admin_referral_type_keyboard(current_type)
         text = (
@@ -1532,9 +2027,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_referral_type:"))
     async def admin_referral_type_chosen(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         try:
             _, value = (callback.data or "").split(":", 1)
         except Exception:
@@ -1553,9 +2045,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_percent")
     async def admin_referral_set_percent(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.set_state(AdminReferral.waiting_for_percent)
         await callback.answer()
         await callback.message.edit_text(
@@ -1568,11 +2057,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminReferral.waiting_for_percent)
     async def admin_referral_percent_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число от 0 до 100.")
             return
@@ -1587,9 +2074,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_fixed_amount")
     async def admin_referral_set_fixed_amount(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.set_state(AdminReferral.waiting_for_fixed_amount)
         await callback.answer()
         await callback.message.edit_text(
@@ -1602,11 +2086,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminReferral.waiting_for_fixed_amount)
     async def admin_referral_fixed_amount_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число (0–100000).")
             return
@@ -1621,9 +2103,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_start_bonus")
     async def admin_referral_set_start_bonus(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.set_state(AdminReferral.waiting_for_start_bonus)
         await callback.answer()
         await callback.message.edit_text(
@@ -1636,11 +2115,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminReferral.waiting_for_start_bonus)
     async def admin_referral_start_bonus_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число (0–100000).")
             return
@@ -1657,9 +2134,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_min_withdrawal")
     async def admin_referral_set_min_withdrawal(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.set_state(AdminReferral.waiting_for_min_withdrawal)
         await callback.answer()
         await callback.message.edit_text(
@@ -1672,11 +2146,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminReferral.waiting_for_min_withdrawal)
     async def admin_referral_min_withdrawal_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число (0–100000).")
             return
@@ -1691,9 +2163,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_referral_set_discount")
     async def admin_referral_set_discount(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await state.set_state(AdminReferral.waiting_for_discount)
         await callback.answer()
         await callback.message.edit_text(
@@ -1706,11 +2175,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminReferral.waiting_for_discount)
     async def admin_referral_discount_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число (0–100).")
             return
@@ -1748,18 +2215,9 @@ def get_admin_router() -> Router:
             hosts = get_all_hosts() or []
         except Exception:
             hosts = []
-        for h in hosts:
-            name = str(h.get('host_name') or '')
-            try:
-                full = hashlib.sha1((name or '').encode('utf-8', 'ignore')).hexdigest()
-            except Exception:
-                full = hashlib.sha1(str(name).encode('utf-8', 'ignore')).hexdigest()
-
-            # We use a short digest in callback_data to fit Telegram's 64-byte limit.
-            # Accept both the full digest (legacy) and the short prefix (current).
-            if full == digest or full.startswith(digest):
-                return name
-        return None
+        # Accept both the full digest (legacy) and the short prefix (current).
+        names = [str(h.get('host_name') or '') for h in hosts]
+        return _lookup_by_digest('hosts', names, digest)
 
 
     def _safe(s: str | None) -> str:
@@ -1831,9 +2289,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_hosts_menu")
     async def admin_hosts_menu(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminHosts.menu)
         await show_admin_hosts_menu(callback.message, edit_message=True)
@@ -1841,9 +2296,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_hosts_add")
     async def admin_hosts_add(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminHosts.waiting_add_name)
@@ -1856,14 +2308,11 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_add_name)
     async def admin_hosts_add_name(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         name = (message.text or '').strip()
         if not name:
             await message.answer("❌ Название не может быть пустым.")
             return
-        await state.update_data(add_host_name=name)
-        await state.set_state(AdminHosts.waiting_add_base_url)
+        await _advance(state, AdminHosts.waiting_add_base_url, add_host_name=name)
         await message.answer(
             "Введите <b>базовый URL Remnawave</b> (например: <code>https://panel.example.com</code>):",
             reply_markup=keyboards.create_admin_hosts_cancel_keyboard("admin_hosts_menu"),
@@ -1873,14 +2322,11 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_add_base_url)
     async def admin_hosts_add_base_url(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         base_url = (message.text or '').strip()
         if not (base_url.startswith("http://") or base_url.startswith("https://")):
             await message.answer("❌ Укажите корректный URL, начинающийся с http:// или https://")
             return
-        await state.update_data(add_base_url=base_url)
-        await state.set_state(AdminHosts.waiting_add_api_token)
+        await _advance(state, AdminHosts.waiting_add_api_token, add_base_url=base_url)
         await message.answer(
             "Введите <b>API Token</b> Remnawave:",
             reply_markup=keyboards.create_admin_hosts_cancel_keyboard("admin_hosts_menu"),
@@ -1890,14 +2336,11 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_add_api_token)
     async def admin_hosts_add_api_token(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         token = (message.text or '').strip()
         if not token:
             await message.answer("❌ API Token не может быть пустым.")
             return
-        await state.update_data(add_api_token=token)
-        await state.set_state(AdminHosts.waiting_add_squad_uuid)
+        await _advance(state, AdminHosts.waiting_add_squad_uuid, add_api_token=token)
         await message.answer(
             "Введите <b>Squad UUID</b> (или отправьте <code>-</code>, чтобы пропустить):",
             reply_markup=keyboards.create_admin_hosts_cancel_keyboard("admin_hosts_menu"),
@@ -1907,8 +2350,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_add_squad_uuid)
     async def admin_hosts_add_squad_uuid(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         squad_uuid = (message.text or '').strip()
         if squad_uuid == '-':
             squad_uuid = ''
@@ -1929,6 +2370,7 @@ def get_admin_router() -> Router:
             )
         except Exception:
             pass
+        _invalidate_hosts()
 
         ok_rmw = False
         try:
@@ -1967,12 +2409,6 @@ def get_admin_router() -> Router:
         поэтому используем строгий regexp по SHA1-дайджесту.
         Также отвечаем на callback максимально быстро.
         """
-        if not is_admin(callback.from_user.id):
-            try:
-                await callback.answer("У вас нет прав.", show_alert=True)
-            except Exception:
-                pass
-            return
 
         data = callback.data or ""
         digest = data.split("admin_hosts_open:", 1)[-1].strip()
@@ -1993,9 +2429,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_delete:"))
     async def admin_hosts_delete(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_delete:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2012,9 +2445,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_delete_confirm:"))
     async def admin_hosts_delete_confirm(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_delete_confirm:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2026,6 +2456,7 @@ def get_admin_router() -> Router:
             delete_host(host_name)
         except Exception:
             pass
+        _invalidate_hosts()
         await state.set_state(AdminHosts.menu)
         await callback.message.edit_text("✅ Хост удалён.", parse_mode="HTML")
         await show_admin_hosts_menu(callback.message, edit_message=False)
@@ -2033,9 +2464,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_rename:"))
     async def admin_hosts_rename(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_rename:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2054,8 +2482,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_rename)
     async def admin_hosts_rename_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         new_name = (message.text or '').strip()
         if not new_name:
             await message.answer("❌ Имя не может быть пустым.")
@@ -2068,6 +2494,7 @@ def get_admin_router() -> Router:
             ok = bool(update_host_name(old_name, new_name))
         except Exception:
             ok = False
+        _invalidate_hosts()
         await state.clear()
         if not ok:
             await message.answer("❌ Не удалось переименовать хост (возможно, имя занято).")
@@ -2079,9 +2506,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_url:"))
     async def admin_hosts_set_url(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_url:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2099,8 +2523,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_url)
     async def admin_hosts_set_url_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         new_url = (message.text or '').strip()
         if not (new_url.startswith("http://") or new_url.startswith("https://")):
             await message.answer("❌ URL должен начинаться с http:// или https://")
@@ -2123,9 +2545,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_sub:"))
     async def admin_hosts_set_sub(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_sub:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2144,8 +2563,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_subscription)
     async def admin_hosts_set_sub_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         value = None if raw == '-' or raw == '' else raw
         data = await state.get_data()
@@ -2165,9 +2582,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_rmw_url:"))
     async def admin_hosts_set_rmw_url(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_rmw_url:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2185,8 +2599,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_rmw_url)
     async def admin_hosts_set_rmw_url_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         value = None if raw == '-' or raw == '' else raw
         if value and not (value.startswith("http://") or value.startswith("https://")):
@@ -2209,9 +2621,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_rmw_token:"))
     async def admin_hosts_set_rmw_token(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_rmw_token:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2230,8 +2639,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_rmw_token)
     async def admin_hosts_set_rmw_token_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         value = None if raw == '-' or raw == '' else raw
         data = await state.get_data()
@@ -2251,9 +2658,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_squad:"))
     async def admin_hosts_set_squad(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_squad:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2271,8 +2675,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_squad)
     async def admin_hosts_set_squad_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         value = None if raw == '-' or raw == '' else raw
         data = await state.get_data()
@@ -2292,9 +2694,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_set_ssh:"))
     async def admin_hosts_set_ssh(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_set_ssh:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2316,8 +2715,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminHosts.waiting_set_ssh)
     async def admin_hosts_set_ssh_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         data = await state.get_data()
         host_name = data.get('host_name')
@@ -2377,9 +2774,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_hosts_to_plans:"))
     async def admin_hosts_to_plans(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         digest = callback.data.split("admin_hosts_to_plans:", 1)[-1]
         host_name = _resolve_host_from_digest(digest)
         if not host_name:
@@ -2387,14 +2781,16 @@ def get_admin_router() -> Router:
             return
         await callback.answer()
         # Reuse plans UI but jump straight into host menu
+        host_name = sys.intern(host_name)
         await state.update_data(plans_host=host_name)
         try:
             await state.set_state(AdminPlans.host_menu)
         except Exception:
             pass
+        text, plans = await _db(_host_menu_payload, host_name)
         await callback.message.edit_text(
-            _format_plans_for_host(host_name),
-            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(get_plans_for_host(host_name) or []),
+            text,
+            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(plans),
             parse_mode='HTML'
         )
 
@@ -2415,7 +2811,7 @@ def get_admin_router() -> Router:
     def _format_trial_value_gb(raw: str | None) -> str:
         s = (raw or "0").strip()
         try:
-            gb = float(s.replace(",", "."))
+            gb = float(s.translate(_NUM_TRANS))
         except Exception:
             gb = 0.0
         if gb <= 0:
@@ -2428,7 +2824,7 @@ def get_admin_router() -> Router:
     def _format_trial_value_int(raw: str | None) -> str:
         s = (raw or "0").strip()
         try:
-            val = int(float(s.replace(",", ".")))
+            val = int(float(s.translate(_NUM_TRANS)))
         except Exception:
             val = 0
         return "без лимита" if val <= 0 else str(val)
@@ -2437,7 +2833,7 @@ def get_admin_router() -> Router:
     def _get_trial_days() -> int:
         raw = (get_setting("trial_duration_days") or "3").strip()
         try:
-            days = int(float(raw.replace(",", ".")))
+            days = int(float(raw.translate(_NUM_TRANS)))
         except Exception:
             days = 3
         if days < 1:
@@ -2482,9 +2878,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_trial")
     async def admin_trial_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminTrial.menu)
@@ -2493,9 +2886,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_trial_toggle")
     async def admin_trial_toggle(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         current = _get_trial_enabled()
         rw_repo.update_setting("trial_enabled", "false" if current else "true")
         await callback.answer("Обновлено")
@@ -2505,9 +2895,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_trial_set_days")
     async def admin_trial_set_days(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminTrial.waiting_for_days)
         await callback.message.edit_text(
@@ -2519,9 +2906,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_trial_set_traffic")
     async def admin_trial_set_traffic(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminTrial.waiting_for_traffic)
         await callback.message.edit_text(
@@ -2534,9 +2918,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_trial_set_devices")
     async def admin_trial_set_devices(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminTrial.waiting_for_devices)
         await callback.message.edit_text(
@@ -2549,11 +2930,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminTrial.waiting_for_days)
     async def admin_trial_days_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            days = int(float(raw.replace(",", ".")))
+            days = int(float(raw.translate(_NUM_TRANS)))
         except Exception:
             await message.answer("❌ Введите целое число дней (1–365).")
             return
@@ -2568,11 +2947,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminTrial.waiting_for_traffic)
     async def admin_trial_traffic_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            gb = float(raw.replace(",", "."))
+            gb = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число (например 1 или 0.5), либо 0.")
             return
@@ -2591,11 +2968,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminTrial.waiting_for_devices)
     async def admin_trial_devices_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            val = int(float(raw.replace(",", ".")))
+            val = int(float(raw.translate(_NUM_TRANS)))
         except Exception:
             await message.answer("❌ Введите целое число, либо 0.")
             return
@@ -2622,7 +2997,7 @@ def get_admin_router() -> Router:
     def _get_inactive_reminder_interval_hours() -> float:
         raw = (get_setting("inactive_usage_reminder_interval_hours") or "8").strip()
         try:
-            val = float(raw.replace(",", "."))
+            val = float(raw.translate(_NUM_TRANS))
         except Exception:
             val = 8.0
         if val < 1:
@@ -2660,9 +3035,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_notifications_menu")
     async def admin_notifications_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminNotifications.menu)
@@ -2671,9 +3043,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_inactive_reminder_toggle")
     async def admin_inactive_reminder_toggle(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         current = _get_inactive_reminder_enabled()
         rw_repo.update_setting("inactive_usage_reminder_enabled", "false" if current else "true")
         await callback.answer("Обновлено")
@@ -2683,9 +3052,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_inactive_reminder_set_interval")
     async def admin_inactive_reminder_set_interval(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminNotifications.waiting_for_interval)
         await callback.message.edit_text(
@@ -2700,11 +3066,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminNotifications.waiting_for_interval)
     async def admin_inactive_reminder_interval_input(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or "").strip()
         try:
-            hours = float(raw.replace(",", "."))
+            hours = float(raw.translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число часов (например 8).")
             return
@@ -2770,11 +3134,11 @@ def get_admin_router() -> Router:
             b = int(b)
             if b <= 0:
                 return "без лимита"
-            gb = b / (1024*1024*1024)
+            whole, rem = divmod(b, _GIB)
+            if not rem:
+                return f"{whole} ГБ"
             # красивое округление
-            if gb.is_integer():
-                return f"{int(gb)} ГБ"
-            return f"{gb:.2f} ГБ".rstrip('0').rstrip('.')
+            return f"{b / _GIB:.2f} ГБ".rstrip('0').rstrip('.')
         except Exception:
             return "—"
 
@@ -2790,23 +3154,31 @@ def get_admin_router() -> Router:
         except Exception:
             return "—"
 
-    def _format_plans_for_host(host_name: str) -> str:
-        plans = get_plans_for_host(host_name) or []
+    def _host_menu_payload(host_name: str) -> tuple[str, tuple[dict, ...]]:
+        """Текст и тарифы меню хоста из одного чтения таблицы plans."""
+        host_name = str(host_name)
+        version = _plans_cache_key()
+        return _render_plans_for_host(host_name, version), _fetch_plans(host_name, version)
+
+    @functools.lru_cache(maxsize=256)
+    def _render_plans_for_host(host_name: str, version) -> str:
+        # (host_name, version) однозначно задают строки; _fetch_plans здесь —
+        # попадание в тот же кэш, второго запроса к БД нет.
+        return _format_plans_for_host(host_name, _fetch_plans(host_name, version))
+
+    def _format_plans_for_host(host_name: str, plans) -> str:
         if not plans:
-            return f"🧾 <b>Тарифы для хоста:</b> <b>{html_escape.escape(host_name)}</b>\n\n❌ Тарифы не настроены."
+            return f"🧾 <b>Тарифы для хоста:</b> <b>{_esc(host_name)}</b>\n\n❌ Тарифы не настроены."
         lines = [
-            f"🧾 <b>Тарифы для хоста:</b> <b>{html_escape.escape(host_name)}</b>",
+            f"🧾 <b>Тарифы для хоста:</b> <b>{_esc(host_name)}</b>",
             "",
         ]
         for p in plans:
             pid = p.get('plan_id')
-            pname = html_escape.escape(str(p.get('plan_name') or '—'))
+            pname = _esc(str(p.get('plan_name') or '—'))
             price = p.get('price')
             duration_txt = _format_plan_duration(p)
-            try:
-                price_txt = f"{float(price):.2f} RUB"
-            except Exception:
-                price_txt = str(price or '—')
+            price_txt = _format_price(price)
             status = "✅" if int(p.get('is_active', 1) or 0) == 1 else "🚫"
             traffic_txt = _format_traffic_gb(p)
             devices_txt = _format_devices(p)
@@ -2816,13 +3188,10 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_plans")
     async def admin_plans_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminPlans.picking_host)
-        hosts = get_all_hosts() or []
+        hosts = await _db(get_all_hosts) or []
         await callback.message.edit_text(
             "🧾 <b>Тарифы</b>\n\nВыберите хост, для которого нужно управлять тарифами:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="plans"),
@@ -2832,9 +3201,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminPlans.picking_host, F.data == "admin_plans_back_to_users")
     async def admin_plans_back_to_admin(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await show_admin_menu(callback.message, edit_message=True)
@@ -2842,509 +3208,431 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminPlans.picking_host, F.data.startswith("admin_plans_pick_host_"))
     async def admin_plans_pick_host(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        host_name = callback.data.split("admin_plans_pick_host_", 1)[-1]
-        await state.update_data(plans_host=host_name)
-        await state.set_state(AdminPlans.host_menu)
+        # Имя хоста интернировано: дальше оно ключ lru-кэшей меню и карточек
+        # и сравнивается с plan['host_name'] при каждом открытии тарифа.
+        host_name = sys.intern(callback.data.split("admin_plans_pick_host_", 1)[-1])
+        await _advance(state, AdminPlans.host_menu, plans_host=host_name)
+        text, plans = await _with_answer(callback, _db(_host_menu_payload, host_name))
         await callback.message.edit_text(
-            _format_plans_for_host(host_name),
-            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(get_plans_for_host(host_name) or []),
+            text,
+            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(plans),
             parse_mode='HTML'
         )
 
 
     def _format_plan_detail(plan: dict, host_name: str | None = None) -> str:
-        pid = plan.get('plan_id')
-        pname = html_escape.escape(str(plan.get('plan_name') or '—'))
-        duration_txt = _format_plan_duration(plan)
-        price = plan.get('price')
-        is_active = int(plan.get('is_active', 1) or 0) == 1
-
-        try:
-            price_txt = f"{float(price):.2f} RUB"
-        except Exception:
-            price_txt = str(price or '—')
-
-        traffic_txt = _format_traffic_gb(plan)
-        devices_txt = _format_devices(plan)
+        return _render_plan_detail(
+            plan.get('plan_id'),
+            str(plan.get('plan_name') or '—'),
+            _format_plan_duration(plan),
+            plan.get('price'),
+            int(plan.get('is_active', 1) or 0) == 1,
+            _format_traffic_gb(plan),
+            _format_devices(plan),
+            host_name,
+        )
+
+    @functools.lru_cache(maxsize=512)
+    def _render_plan_detail(pid, plan_name: str, duration_txt: str, price, is_active: bool,
+                            traffic_txt: str, devices_txt: str, host_name: str | None) -> str:
+        # Ключ кэша — все отображаемые поля, поэтому после правки тарифа
+        # запись просто перестаёт совпадать; отдельная инвалидация не нужна.
+        pname = _esc(plan_name)
+        price_txt = _format_price(price)
 
         status_txt = "✅ Активен" if is_active else "🚫 Скрыт"
-        host_part = f"<b>{html_escape.escape(host_name)}</b>" if host_name else "—"
-
-        return (
-            "🧾 <b>Тариф</b>\n\n"
-            f"ID: <b>#{pid}</b>\n"
-            f"Хост: {host_part}\n"
-            f"Название: <b>{pname}</b>\n"
-            f"Срок: <b>{html_escape.escape(duration_txt)}</b>\n"
-            f"Цена: <b>{html_escape.escape(price_txt)}</b>\n"
-            f"Лимит трафика: <b>{html_escape.escape(traffic_txt)}</b>\n"
-            f"Лимит устройств: <b>{html_escape.escape(devices_txt)}</b>\n"
-            f"Статус: <b>{status_txt}</b>\n\n"
-            "Выберите действие:"
-        )
+        host_part = f"<b>{_esc(host_name)}</b>" if host_name else "—"
+
+        return _PLAN_DETAIL_TEMPLATE.format_map({
+            'pid': pid,
+            'host_part': host_part,
+            'name': pname,
+            'duration': _esc(duration_txt),
+            'price': _esc(price_txt),
+            'traffic': _esc(traffic_txt),
+            'devices': _esc(devices_txt),
+            'status': status_txt,
+        })
 
 
     @admin_router.callback_query(AdminPlans.host_menu, F.data.startswith("admin_plans_open_"))
     async def admin_plans_open_plan(callback: types.CallbackQuery, state: FSMContext):
         """Открыть конкретный тариф из списка тарифов хоста."""
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-
         try:
             plan_id = int(callback.data.split("admin_plans_open_", 1)[-1])
         except Exception:
             await callback.answer("Некорректный тариф.", show_alert=True)
             return
 
-        plan = get_plan_by_id(plan_id)
+        plan, data = await asyncio.gather(_db(get_plan_by_id, plan_id), state.get_data())
         if not plan:
             await callback.answer("Тариф не найден.", show_alert=True)
             return
 
-        data = await state.get_data()
         host_name = data.get('plans_host')
         # safety: if host was changed or stale
         if host_name and str(plan.get('host_name') or '') != str(host_name):
             await callback.answer("Тариф относится к другому хосту.", show_alert=True)
             return
 
-        await callback.answer()
-        await state.update_data(current_plan_id=plan_id)
-        await state.set_state(AdminPlans.plan_menu)
-        await callback.message.edit_text(
-            _format_plan_detail(plan, host_name),
-            reply_markup=keyboards.create_admin_plan_manage_keyboard(plan),
-            parse_mode='HTML'
+        await _advance(state, AdminPlans.plan_menu, current_plan_id=plan_id)
+        await asyncio.gather(
+            callback.answer(),
+            _edit_if_changed(
+                callback.message,
+                _format_plan_detail(plan, host_name),
+                keyboards.create_admin_plan_manage_keyboard(plan),
+            ),
         )
 
 
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_name")
-    async def admin_plan_edit_name(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_name)
-        await callback.message.edit_text(
-            "✏️ <b>Редактирование тарифа</b>\n\nВведите новое <b>название</b> тарифа:",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
-            parse_mode='HTML'
-        )
-
+    # Пока админ набирает новое значение, тариф уже читается из БД в фоне:
+    # user_id -> (plan_id, версия plans на момент запуска, задача get_plan_by_id).
+    # plan_id приходит из callback_data кнопки, так что FSM-хранилище не читается.
+    _plan_prefetch: dict[int, tuple[int, int, asyncio.Task]] = {}
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_months")
-    async def admin_plan_edit_months(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
+    def _prefetch_plan(user_id: int, plan_id: int) -> None:
+        if not plan_id:
             return
-        await callback.answer()
-        # backward compatibility: open duration selector
-        await state.set_state(AdminPlans.edit_duration_type)
-        await callback.message.edit_text(
-            "⏳ <b>Срок тарифа</b>\n\nВыберите, в каких единицах указать срок:",
-            reply_markup=keyboards.create_admin_plan_duration_type_keyboard(),
-            parse_mode='HTML'
-        )
+        stale = _plan_prefetch.pop(user_id, None)
+        if stale:
+            stale[2].cancel()
+        _plan_prefetch[user_id] = (
+            plan_id,
+            get_plans_version(),
+            asyncio.create_task(_db(get_plan_by_id, plan_id)),
+        )
+
+    async def _take_edited_plan(user_id: int, state: FSMContext) -> tuple[int | None, dict | None]:
+        """(plan_id, тариф) для ввода в edit_* — из префетча, иначе из FSM."""
+        entry = _plan_prefetch.pop(user_id, None)
+        if entry:
+            pid, version, task = entry
+            # Тариф успели изменить (например, из веб-панели) — префетч устарел.
+            if version == get_plans_version():
+                try:
+                    return pid, await task
+                except Exception as e:
+                    logger.debug("Plan prefetch failed for %s: %r", pid, e)
+            else:
+                task.cancel()
+            return pid, await _db(get_plan_by_id, pid)
+        # после перезапуска бота префетча нет
+        plan_id = (await state.get_data()).get('current_plan_id')
+        if not plan_id:
+            return None, None
+        return int(plan_id), await _db(get_plan_by_id, int(plan_id))
 
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_price")
-    async def admin_plan_edit_price(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_price)
-        await callback.message.edit_text(
-            "💰 <b>Редактирование тарифа</b>\n\nВведите новую цену (например: 199 или 199.99):",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
-            parse_mode='HTML'
-        )
+    def _plan_edit_entry(target: State, prompt: str):
+        async def handler(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
+            await callback.answer()
+            await state.set_state(target)
+            _prefetch_plan(callback.from_user.id, plan_id)
+            await callback.message.edit_text(
+                prompt,
+                reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(plan_id),
+                parse_mode='HTML'
+            )
+        return handler
 
+    admin_plan_edit_name = _plan_edit_entry(
+        AdminPlans.edit_name,
+        "✏️ <b>Редактирование тарифа</b>\n\nВведите новое <b>название</b> тарифа:",
+    )
+    admin_plan_edit_price = _plan_edit_entry(
+        AdminPlans.edit_price,
+        "💰 <b>Редактирование тарифа</b>\n\nВведите новую цену (например: 199 или 199.99):",
+    )
+    admin_plan_duration_months = _plan_edit_entry(
+        AdminPlans.edit_months,
+        "⏳ <b>Редактирование тарифа</b>\n\nВведите срок тарифа в <b>месяцах</b> (1–120):",
+    )
+    admin_plan_duration_days = _plan_edit_entry(
+        AdminPlans.edit_days,
+        "⏳ <b>Редактирование тарифа</b>\n\nВведите срок тарифа в <b>днях</b> (1–3650):",
+    )
+    admin_plan_edit_traffic = _plan_edit_entry(
+        AdminPlans.edit_traffic,
+        "📶 <b>Лимит трафика</b>\n\nВведите лимит в <b>ГБ</b>.\n0 — без лимита.",
+    )
+    admin_plan_edit_devices = _plan_edit_entry(
+        AdminPlans.edit_devices,
+        "📱 <b>Лимит устройств</b>\n\nВведите целое число.\n0 — без лимита.",
+    )
 
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_duration")
-    async def admin_plan_edit_duration(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
+    async def admin_plan_edit_duration(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
         await callback.answer()
         await state.set_state(AdminPlans.edit_duration_type)
         await callback.message.edit_text(
             "⏳ <b>Срок тарифа</b>\n\nВыберите, в каких единицах указать срок:",
-            reply_markup=keyboards.create_admin_plan_duration_type_keyboard(),
-            parse_mode='HTML'
-        )
-
-
-    @admin_router.callback_query(AdminPlans.edit_duration_type, F.data == "admin_plan_duration_months")
-    async def admin_plan_duration_months(callback: types.CallbackQuery, state: FSMContext):
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_months)
-        await callback.message.edit_text(
-            "⏳ <b>Редактирование тарифа</b>\n\nВведите срок тарифа в <b>месяцах</b> (1–120):",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
-            parse_mode='HTML'
-        )
-
-
-    @admin_router.callback_query(AdminPlans.edit_duration_type, F.data == "admin_plan_duration_days")
-    async def admin_plan_duration_days(callback: types.CallbackQuery, state: FSMContext):
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_days)
-        await callback.message.edit_text(
-            "⏳ <b>Редактирование тарифа</b>\n\nВведите срок тарифа в <b>днях</b> (1–3650):",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
-            parse_mode='HTML'
-        )
-
-
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_traffic")
-    async def admin_plan_edit_traffic(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_traffic)
-        await callback.message.edit_text(
-            "📶 <b>Лимит трафика</b>\n\nВведите лимит в <b>ГБ</b>.\n0 — без лимита.",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
+            reply_markup=keyboards.create_admin_plan_duration_type_keyboard(plan_id),
             parse_mode='HTML'
         )
 
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_edit_devices")
-    async def admin_plan_edit_devices(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        await state.set_state(AdminPlans.edit_devices)
-        await callback.message.edit_text(
-            "📱 <b>Лимит устройств</b>\n\nВведите целое число.\n0 — без лимита.",
-            reply_markup=keyboards.create_admin_plan_edit_flow_keyboard(),
-            parse_mode='HTML'
-        )
-
-
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_toggle_active")
-    async def admin_plan_toggle_active(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
+    async def admin_plan_toggle_active(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
         if not plan_id:
             await callback.answer("Не удалось определить тариф.", show_alert=True)
             return
-        plan = get_plan_by_id(int(plan_id))
+        plan = await _db(get_plan_by_id, plan_id)
         if not plan:
             await callback.answer("Тариф не найден.", show_alert=True)
             return
         is_active = int(plan.get('is_active', 1) or 0) == 1
-        ok = set_plan_active(int(plan_id), not is_active)
-        if not ok:
+        updated = await _db(set_plan_active, plan_id, not is_active)
+        if not updated:
             await callback.answer("Не удалось изменить статус.", show_alert=True)
             return
-        plan = get_plan_by_id(int(plan_id)) or plan
-        await callback.message.edit_text(
-            _format_plan_detail(plan, host_name=host_name),
-            reply_markup=keyboards.create_admin_plan_manage_keyboard(plan),
-            parse_mode='HTML'
+        plan = updated
+        await asyncio.gather(
+            callback.answer(),
+            _edit_if_changed(
+                callback.message,
+                _format_plan_detail(plan, host_name=plan.get('host_name')),
+                keyboards.create_admin_plan_manage_keyboard(plan),
+            ),
         )
 
 
-    @admin_router.callback_query(AdminPlans.plan_menu, F.data == "admin_plan_delete")
-    async def admin_plan_delete_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
+    async def admin_plan_delete_start(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
         await callback.answer()
         await state.set_state(AdminPlans.confirm_delete)
         await callback.message.edit_text(
             "🗑 <b>Удаление тарифа</b>\n\nТочно удалить этот тариф? Действие необратимо.",
-            reply_markup=keyboards.create_admin_plan_delete_confirm_keyboard(),
+            reply_markup=keyboards.create_admin_plan_delete_confirm_keyboard(plan_id),
             parse_mode='HTML'
         )
 
 
-    @admin_router.callback_query(AdminPlans.confirm_delete, F.data == "admin_plan_delete_cancel")
-    async def admin_plan_delete_cancel(callback: types.CallbackQuery, state: FSMContext):
-        # возвращаемся в меню тарифа
-        await admin_plan_back(callback, state)
-
-
-    @admin_router.callback_query(AdminPlans.confirm_delete, F.data == "admin_plan_delete_confirm")
-    async def admin_plan_delete_confirm(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
+    async def admin_plan_delete_confirm(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
+        # Ответ на callback ровно один на каждом пути: иначе алерт об ошибке не дойдёт
         if not plan_id:
             await callback.answer("Не удалось определить тариф.", show_alert=True)
             return
-        try:
-            delete_plan(int(plan_id))
-        except Exception:
-            logger.exception("Failed to delete plan")
-            await callback.answer("Ошибка при удалении тарифа.", show_alert=True)
+        host_name = (await state.get_data()).get('plans_host')
+        if not await _db(delete_plan, plan_id):
+            await callback.answer("Не удалось удалить тариф.", show_alert=True)
             return
 
         await state.set_state(AdminPlans.host_menu)
-        if not host_name:
-            host_name = data.get('plans_host')
 
         if host_name:
-            await callback.message.edit_text(
-                "✅ Тариф удален.\n\n" + _format_plans_for_host(host_name),
-                reply_markup=keyboards.create_admin_plans_host_menu_keyboard(get_plans_for_host(host_name) or []),
+            text, plans = await _db(_host_menu_payload, host_name)
+            edit = callback.message.edit_text(
+                "✅ Тариф удален.\n\n" + text,
+                reply_markup=keyboards.create_admin_plans_host_menu_keyboard(plans),
                 parse_mode='HTML'
             )
         else:
-            await callback.message.edit_text("✅ Тариф удален.", reply_markup=keyboards.create_admin_cancel_keyboard())
+            edit = callback.message.edit_text("✅ Тариф удален.", reply_markup=keyboards.create_admin_cancel_keyboard())
+        await asyncio.gather(callback.answer(), edit)
 
 
-    @admin_router.message(AdminPlans.edit_name)
-    async def admin_plan_edit_name_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        name = (message.text or '').strip()
-        if not name or len(name) < 2 or len(name) > 64:
-            await message.answer("❌ Название должно быть от 2 до 64 символов.", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
-        if not plan_id:
-            await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id))
-        if not plan:
-            await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        ok = update_plan(int(plan_id), name, int(plan.get('months') or 1), float(plan.get('price') or 0))
-        if not ok:
-            await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id)) or plan
-        await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Название обновлено.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
-
-
-    @admin_router.message(AdminPlans.edit_months)
-    async def admin_plan_edit_months_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip()
-        try:
-            months = int(raw)
-        except Exception:
-            await message.answer("❌ Введите целое число (1–120).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        if months <= 0 or months > 120:
-            await message.answer("❌ Некорректный срок. Введите число от 1 до 120.", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
-        if not plan_id:
-            await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id))
+    async def admin_plan_back(callback: types.CallbackQuery, state: FSMContext, plan_id: int):
+        """Вернуться к карточке тарифа из подменю редактирования."""
+        await callback.answer()
+        stale = _plan_prefetch.pop(callback.from_user.id, None)
+        if stale:
+            stale[2].cancel()
+        plan = await _db(get_plan_by_id, plan_id) if plan_id else None
         if not plan:
-            await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        ok = update_plan(int(plan_id), str(plan.get('plan_name') or '—'), months, float(plan.get('price') or 0), duration_days=None)
-        if not ok:
-            await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
+            await callback.message.edit_text("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
             return
-        plan = get_plan_by_id(int(plan_id)) or plan
         await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Срок обновлен.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
-
-
-    @admin_router.message(AdminPlans.edit_price)
-    async def admin_plan_edit_price_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip().replace(",", ".")
-        try:
-            price = float(raw)
-        except Exception:
-            await message.answer("❌ Введите число (например 199 или 199.99).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        if price <= 0 or price > 1000000:
-            await message.answer("❌ Некорректная цена.", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
+        await _edit_if_changed(
+            callback.message,
+            _format_plan_detail(plan, plan.get('host_name')),
+            keyboards.create_admin_plan_manage_keyboard(plan),
+        )
+
+
+    # Все кнопки карточки тарифа идут через один фильтр PlanAction; обработчик
+    # выбирается по (состояние, действие) одним обращением к словарю.
+    _PLAN_ACTIONS = {
+        (AdminPlans.plan_menu.state, "edit_name"): admin_plan_edit_name,
+        (AdminPlans.plan_menu.state, "edit_price"): admin_plan_edit_price,
+        (AdminPlans.plan_menu.state, "duration"): admin_plan_edit_duration,
+        (AdminPlans.plan_menu.state, "edit_traffic"): admin_plan_edit_traffic,
+        (AdminPlans.plan_menu.state, "edit_devices"): admin_plan_edit_devices,
+        (AdminPlans.plan_menu.state, "toggle_active"): admin_plan_toggle_active,
+        (AdminPlans.plan_menu.state, "delete"): admin_plan_delete_start,
+        (AdminPlans.edit_duration_type.state, "months"): admin_plan_duration_months,
+        (AdminPlans.edit_duration_type.state, "days"): admin_plan_duration_days,
+        (AdminPlans.confirm_delete.state, "delete_confirm"): admin_plan_delete_confirm,
+    }
+    for _st in (AdminPlans.edit_duration_type, AdminPlans.confirm_delete, AdminPlans.edit_name,
+                AdminPlans.edit_months, AdminPlans.edit_days, AdminPlans.edit_price,
+                AdminPlans.edit_traffic, AdminPlans.edit_devices):
+        _PLAN_ACTIONS[(_st.state, "back")] = admin_plan_back
+
+    @admin_router.callback_query(keyboards.PlanAction.filter())
+    async def admin_plan_action(callback: types.CallbackQuery, callback_data: keyboards.PlanAction,
+                                state: FSMContext, raw_state: str | None = None):
+        handler = _PLAN_ACTIONS.get((raw_state, callback_data.action))
+        if handler is None:
+            # кнопка из устаревшего сообщения
+            await callback.answer()
+            return
+        plan_id = callback_data.plan_id
         if not plan_id:
-            await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id))
-        if not plan:
-            await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        ok = update_plan(int(plan_id), str(plan.get('plan_name') or '—'), int(plan.get('months') or 1), price)
-        if not ok:
-            await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id)) or plan
-        await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Цена обновлена.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
+            # кнопки без plan_id (например, «Назад» после ошибки ввода)
+            plan_id = int((await state.get_data()).get('current_plan_id') or 0)
+        await handler(callback, state, plan_id)
 
 
+    # Редактирование полей тарифа: разбор ввода отличается, остальное (поиск
+    # тарифа, update_plan, ответ) общее — см. _edit_plan_field.
+    # Парсеры возвращают (значение, текст_ошибки); None — допустимое значение («без лимита»).
 
-    @admin_router.message(AdminPlans.edit_days)
-    async def admin_plan_edit_days_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip()
-        try:
-            days = int(raw)
-        except Exception:
-            await message.answer("❌ Введите целое число (1–3650).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
+    def _parse_plan_name(raw: str):
+        name = raw.strip()
+        if not name or len(name) < 2 or len(name) > 64:
+            return None, "❌ Название должно быть от 2 до 64 символов."
+        return name, None
+
+    def _parse_plan_months(raw: str):
+        m = _INT_RE.fullmatch(raw.strip())
+        if not m:
+            return None, "❌ Введите целое число (1–120)."
+        months = int(m.group())
+        if months <= 0 or months > 120:
+            return None, "❌ Некорректный срок. Введите число от 1 до 120."
+        return months, None
+
+    def _parse_plan_days(raw: str):
+        m = _INT_RE.fullmatch(raw.strip())
+        if not m:
+            return None, "❌ Введите целое число (1–3650)."
+        days = int(m.group())
         if days <= 0 or days > 3650:
-            await message.answer("❌ Некорректный срок. Введите число от 1 до 3650.", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
-        if not plan_id:
-            await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id))
-        if not plan:
-            await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
+            return None, "❌ Некорректный срок. Введите число от 1 до 3650."
+        return days, None
+
+    def _parse_plan_price(raw: str):
+        m = _PRICE_RE.fullmatch(raw.strip())
+        if not m:
+            return None, "❌ Введите число (например 199 или 199.99)."
+        price = float(m.group().translate(_NUM_TRANS))
+        if price <= 0 or price > 1000000:
+            return None, "❌ Некорректная цена."
+        return price, None
+
+    def _parse_plan_traffic(raw: str):
+        m = _GB_RE.fullmatch(raw.strip())
+        if not m:
+            return None, "❌ Введите число (например 10 или 10.5)."
+        whole, frac = m.groups()
+        # Байты считаем в целых числах: 1.1 ГБ через float дало бы 1181116006.4 -> обрезку.
+        limit_bytes = int(whole) * _GIB
+        if frac:
+            limit_bytes += int(frac) * _GIB // 10 ** len(frac)
+        if limit_bytes > 100000 * _GIB:
+            return None, "❌ Некорректное значение (0–100000)."
+        return (limit_bytes or None), None
+
+    def _parse_plan_devices(raw: str):
+        m = _INT_RE.fullmatch(raw.strip())
+        if not m:
+            return None, "❌ Введите целое число (например 1 или 3)."
+        val = int(m.group())
+        if val > 1000:
+            return None, "❌ Некорректное значение (0–1000)."
+        return (None if val <= 0 else val), None
+
+    def _plan_base_fields(plan: dict) -> dict:
+        return {
+            'plan_name': str(plan.get('plan_name') or '—'),
+            'months': plan.get('months'),
+            'price': float(plan.get('price') or 0),
+        }
 
-        ok = update_plan(
-            int(plan_id),
-            str(plan.get('plan_name') or '—'),
-            None,  # months -> NULL, т.к. теперь срок в днях
-            float(plan.get('price') or 0),
-            duration_days=int(days),
-        )
-        if not ok:
-            await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id)) or plan
-        await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Срок обновлен.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
+    _PLAN_EDIT_FIELDS = {
+        'name': {
+            'state': AdminPlans.edit_name,
+            'parse': _parse_plan_name,
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'plan_name': v, 'months': int(plan.get('months') or 1)},
+            'done': "✅ Название обновлено.",
+        },
+        'months': {
+            'state': AdminPlans.edit_months,
+            'parse': _parse_plan_months,
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'months': v, 'duration_days': None},
+            'done': "✅ Срок обновлен.",
+        },
+        'price': {
+            'state': AdminPlans.edit_price,
+            'parse': _parse_plan_price,
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'months': int(plan.get('months') or 1), 'price': v},
+            'done': "✅ Цена обновлена.",
+        },
+        'days': {
+            'state': AdminPlans.edit_days,
+            'parse': _parse_plan_days,
+            # months -> NULL, т.к. теперь срок в днях
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'months': None, 'duration_days': v},
+            'done': "✅ Срок обновлен.",
+        },
+        'traffic': {
+            'state': AdminPlans.edit_traffic,
+            'parse': _parse_plan_traffic,
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'traffic_limit_bytes': v},
+            'done': "✅ Лимит трафика обновлён.",
+        },
+        'devices': {
+            'state': AdminPlans.edit_devices,
+            'parse': _parse_plan_devices,
+            'update': lambda plan, v: {**_plan_base_fields(plan), 'hwid_device_limit': v},
+            'done': "✅ Лимит устройств обновлён.",
+        },
+    }
 
 
-    @admin_router.message(AdminPlans.edit_traffic)
-    async def admin_plan_edit_traffic_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
+    async def _edit_plan_field(message: types.Message, state: FSMContext, spec: dict):
+        value, error = spec['parse'](message.text or '')
+        if error:
+            await message.answer(error, reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
             return
-        raw = (message.text or '').strip().replace(',', '.')
-        try:
-            gb = float(raw)
-        except Exception:
-            await message.answer("❌ Введите число (например 10 или 10.5).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        if gb < 0 or gb > 100000:
-            await message.answer("❌ Некорректное значение (0–100000).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-
-        limit_bytes = None
-        if gb > 0:
-            limit_bytes = int(gb * 1024 * 1024 * 1024)
-
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
+        plan_id, plan = await _take_edited_plan(message.from_user.id, state)
         if not plan_id:
             await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
             return
-        plan = get_plan_by_id(int(plan_id))
         if not plan:
             await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
             return
-
-        ok = update_plan(
-            int(plan_id),
-            str(plan.get('plan_name') or '—'),
-            plan.get('months'),
-            float(plan.get('price') or 0),
-            traffic_limit_bytes=limit_bytes,
-        )
-        if not ok:
+        updated = await _db(update_plan, plan_id, **spec['update'](plan, value))
+        if not updated:
             await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
             return
-        plan = get_plan_by_id(int(plan_id)) or plan
+        plan = updated
         await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Лимит трафика обновлён.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
+        await message.answer(
+            f"{spec['done']}\n\n{_format_plan_detail(plan, host_name=plan.get('host_name'))}",
+            reply_markup=keyboards.create_admin_plan_manage_keyboard(plan),
+            parse_mode='HTML'
+        )
 
 
-    @admin_router.message(AdminPlans.edit_devices)
-    async def admin_plan_edit_devices_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip().replace(',', '.')
-        try:
-            val = int(float(raw))
-        except Exception:
-            await message.answer("❌ Введите целое число (например 1 или 3).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
-        if val < 0 or val > 1000:
-            await message.answer("❌ Некорректное значение (0–1000).", reply_markup=keyboards.create_admin_plan_edit_flow_keyboard())
-            return
+    def _plan_field_handler(field: str):
+        spec = _PLAN_EDIT_FIELDS[field]
 
-        limit = None if val <= 0 else val
+        async def handler(message: types.Message, state: FSMContext):
+            await _edit_plan_field(message, state, spec)
 
-        data = await state.get_data()
-        plan_id = data.get('current_plan_id')
-        host_name = data.get('plans_host')
-        if not plan_id:
-            await message.answer("❌ Не удалось определить тариф.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id))
-        if not plan:
-            await message.answer("❌ Тариф не найден.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
+        handler.__name__ = handler.__qualname__ = f"admin_plan_edit_{field}_received"
+        return handler
 
-        ok = update_plan(
-            int(plan_id),
-            str(plan.get('plan_name') or '—'),
-            plan.get('months'),
-            float(plan.get('price') or 0),
-            hwid_device_limit=limit,
-        )
-        if not ok:
-            await message.answer("❌ Не удалось сохранить изменения.", reply_markup=keyboards.create_admin_cancel_keyboard())
-            return
-        plan = get_plan_by_id(int(plan_id)) or plan
-        await state.set_state(AdminPlans.plan_menu)
-        await message.answer("✅ Лимит устройств обновлён.")
-        await message.answer(_format_plan_detail(plan, host_name=host_name), reply_markup=keyboards.create_admin_plan_manage_keyboard(plan), parse_mode='HTML')
+
+    for _field, _spec in _PLAN_EDIT_FIELDS.items():
+        admin_router.message.register(_plan_field_handler(_field), _spec['state'])
 
 
     @admin_router.callback_query(AdminPlans.host_menu, F.data == "admin_plans_back_to_hosts")
     async def admin_plans_back_to_hosts(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
         await state.set_state(AdminPlans.picking_host)
-        hosts = get_all_hosts() or []
+        hosts = await _with_answer(callback, _db(get_all_hosts)) or []
         await callback.message.edit_text(
             "🧾 <b>Тарифы</b>\n\nВыберите хост, для которого нужно управлять тарифами:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="plans"),
@@ -3354,9 +3642,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminPlans.host_menu, F.data == "admin_plans_add")
     async def admin_plans_add_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         data = await state.get_data()
         host_name = data.get('plans_host')
@@ -3378,12 +3663,8 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminPlans.waiting_for_duration_type, F.data == "admin_plans_duration_months")
     async def admin_plans_new_duration_months(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        await state.update_data(new_plan_duration_unit="months")
-        await state.set_state(AdminPlans.waiting_for_months)
+        await _advance(state, AdminPlans.waiting_for_months, new_plan_duration_unit="months")
         await callback.message.edit_text(
             "⏳ <b>Создание тарифа</b>\n\nВведите срок тарифа в <b>месяцах</b> (1–120):",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3393,12 +3674,8 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminPlans.waiting_for_duration_type, F.data == "admin_plans_duration_days")
     async def admin_plans_new_duration_days(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        await state.update_data(new_plan_duration_unit="days")
-        await state.set_state(AdminPlans.waiting_for_days)
+        await _advance(state, AdminPlans.waiting_for_days, new_plan_duration_unit="days")
         await callback.message.edit_text(
             "⏳ <b>Создание тарифа</b>\n\nВведите срок тарифа в <b>днях</b> (1–3650):",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3407,15 +3684,11 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(StateFilter(AdminPlans), F.data == "admin_plans_back_to_host_menu")
     async def admin_plans_back_to_host_menu(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
         data = await state.get_data()
         host_name = data.get('plans_host')
         if not host_name:
             await state.set_state(AdminPlans.picking_host)
-            hosts = get_all_hosts() or []
+            hosts = await _with_answer(callback, _db(get_all_hosts)) or []
             await callback.message.edit_text(
                 "🧾 <b>Тарифы</b>\n\nВыберите хост, для которого нужно управлять тарифами:",
                 reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="plans"),
@@ -3424,17 +3697,12 @@ def get_admin_router() -> Router:
             return
 
         await state.set_state(AdminPlans.host_menu)
-        await callback.message.edit_text(
-            _format_plans_for_host(host_name),
-            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(get_plans_for_host(host_name) or []),
-            parse_mode='HTML'
-        )
+        text, plans = await _with_answer(callback, _db(_host_menu_payload, host_name))
+        await _edit_if_changed(callback.message, text, keyboards.create_admin_plans_host_menu_keyboard(plans))
 
 
     @admin_router.message(AdminPlans.waiting_for_plan_name)
     async def admin_plans_plan_name_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         plan_name = (message.text or '').strip()
         if not plan_name:
             await message.answer(
@@ -3448,8 +3716,7 @@ def get_admin_router() -> Router:
                 reply_markup=keyboards.create_admin_plans_flow_keyboard()
             )
             return
-        await state.update_data(new_plan_name=plan_name)
-        await state.set_state(AdminPlans.waiting_for_duration_type)
+        await _advance(state, AdminPlans.waiting_for_duration_type, new_plan_name=plan_name)
         await message.answer(
             "⏳ <b>Создание тарифа</b>\n\nВыберите, в чём указывать срок тарифа:",
             reply_markup=keyboards.create_admin_plans_duration_type_keyboard(),
@@ -3459,8 +3726,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPlans.waiting_for_months)
     async def admin_plans_months_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         try:
             months = int(raw)
@@ -3477,8 +3742,7 @@ def get_admin_router() -> Router:
             )
             return
         # Для тарифов в месяцах тоже собираем лимиты (ГБ/устройства) как и для тарифов в днях.
-        await state.update_data(new_plan_months=months, new_plan_days=None)
-        await state.set_state(AdminPlans.waiting_for_traffic)
+        await _advance(state, AdminPlans.waiting_for_traffic, new_plan_months=months, new_plan_days=None)
         await message.answer(
             "📶 Теперь введите <b>лимит трафика</b> в ГБ.\n0 — без лимита.",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3489,8 +3753,6 @@ def get_admin_router() -> Router:
     
     @admin_router.message(AdminPlans.waiting_for_days)
     async def admin_plan_add_days_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         try:
             days = int(raw)
@@ -3501,8 +3763,7 @@ def get_admin_router() -> Router:
             await message.answer("❌ Некорректный срок. Введите число от 1 до 3650.", reply_markup=keyboards.create_admin_plans_flow_keyboard())
             return
 
-        await state.update_data(new_plan_days=days, new_plan_months=None)
-        await state.set_state(AdminPlans.waiting_for_traffic)
+        await _advance(state, AdminPlans.waiting_for_traffic, new_plan_days=days, new_plan_months=None)
         await message.answer(
             "📶 Теперь введите <b>лимит трафика</b> в ГБ.\n0 — без лимита.",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3512,24 +3773,12 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPlans.waiting_for_traffic)
     async def admin_plan_add_traffic_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip().replace(',', '.')
-        try:
-            gb = float(raw)
-        except Exception:
-            await message.answer("❌ Введите число (например 10 или 10.5).", reply_markup=keyboards.create_admin_plans_flow_keyboard())
-            return
-        if gb < 0 or gb > 100000:
-            await message.answer("❌ Некорректное значение (0–100000).", reply_markup=keyboards.create_admin_plans_flow_keyboard())
+        limit_bytes, error = _parse_plan_traffic(message.text or '')
+        if error:
+            await message.answer(error, reply_markup=keyboards.create_admin_plans_flow_keyboard())
             return
 
-        limit_bytes = None
-        if gb > 0:
-            limit_bytes = int(gb * 1024 * 1024 * 1024)
-
-        await state.update_data(new_plan_traffic_limit_bytes=limit_bytes)
-        await state.set_state(AdminPlans.waiting_for_devices)
+        await _advance(state, AdminPlans.waiting_for_devices, new_plan_traffic_limit_bytes=limit_bytes)
         await message.answer(
             "📱 Теперь введите <b>лимит устройств</b> (HWID).\n0 — без лимита.",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3539,9 +3788,7 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPlans.waiting_for_devices)
     async def admin_plan_add_devices_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip().replace(',', '.')
+        raw = (message.text or '').strip().translate(_NUM_TRANS)
         try:
             val = int(float(raw))
         except Exception:
@@ -3552,8 +3799,7 @@ def get_admin_router() -> Router:
             return
         limit = None if val <= 0 else val
 
-        await state.update_data(new_plan_hwid_device_limit=limit)
-        await state.set_state(AdminPlans.waiting_for_price)
+        await _advance(state, AdminPlans.waiting_for_price, new_plan_hwid_device_limit=limit)
         await message.answer(
             "💰 Теперь введите цену тарифа (например: 199 или 199.99):",
             reply_markup=keyboards.create_admin_plans_flow_keyboard(),
@@ -3562,9 +3808,7 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPlans.waiting_for_price)
     async def admin_plans_price_received(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        raw = (message.text or '').strip().replace(",", ".")
+        raw = (message.text or '').strip().translate(_NUM_TRANS)
         try:
             price = float(raw)
         except Exception:
@@ -3574,50 +3818,46 @@ def get_admin_router() -> Router:
             await message.answer("❌ Некорректная цена.", reply_markup=keyboards.create_admin_plans_flow_keyboard())
             return
 
-        data = await state.get_data()
-        host_name = data.get('plans_host')
-        plan_name = data.get('new_plan_name')
-        months = data.get('new_plan_months')
-        days = data.get('new_plan_days')
-        traffic_limit_bytes = data.get('new_plan_traffic_limit_bytes')
-        hwid_device_limit = data.get('new_plan_hwid_device_limit')
-
-        if not host_name or not plan_name or ((months is None or int(months) <= 0) and (days is None or int(days) <= 0)):
-            await message.answer(
-                "❌ Не удалось собрать данные тарифа (хост/название/срок). Начните заново.",
-                reply_markup=keyboards.create_admin_cancel_keyboard()
-            )
-            await state.clear()
-            return
+        async with _fsm_txn(state) as data:
+            host_name = data.get('plans_host')
+            plan_name = data.get('new_plan_name')
+            months = data.get('new_plan_months')
+            days = data.get('new_plan_days')
+            traffic_limit_bytes = data.get('new_plan_traffic_limit_bytes')
+            hwid_device_limit = data.get('new_plan_hwid_device_limit')
+
+            if not host_name or not plan_name or ((months is None or int(months) <= 0) and (days is None or int(days) <= 0)):
+                await message.answer(
+                    "❌ Не удалось собрать данные тарифа (хост/название/срок). Начните заново.",
+                    reply_markup=keyboards.create_admin_cancel_keyboard()
+                )
+                await state.clear()
+                return
 
-        try:
-            create_plan(
-                host_name=str(host_name),
-                plan_name=str(plan_name),
-                months=int(months) if months is not None else None,
-                duration_days=int(days) if days is not None else None,
-                price=float(price),
-                traffic_limit_bytes=traffic_limit_bytes,
-                hwid_device_limit=hwid_device_limit,
-            )
-        except Exception as e:
-            logger.error(f"Admin plans: failed to create plan for host '{host_name}': {e}")
-            await message.answer(f"❌ Не удалось создать тариф: {e}", reply_markup=keyboards.create_admin_plans_flow_keyboard())
-            return
+            try:
+                await _db(
+                    create_plan,
+                    host_name=str(host_name),
+                    plan_name=str(plan_name),
+                    months=int(months) if months is not None else None,
+                    duration_days=int(days) if days is not None else None,
+                    price=float(price),
+                    traffic_limit_bytes=traffic_limit_bytes,
+                    hwid_device_limit=hwid_device_limit,
+                )
+            except Exception as e:
+                logger.error(f"Admin plans: failed to create plan for host '{host_name}': {e}")
+                await message.answer(f"❌ Не удалось создать тариф: {e}", reply_markup=keyboards.create_admin_plans_flow_keyboard())
+                return
 
-        # Return to host menu with refreshed list
-        await state.update_data(
-            new_plan_name=None,
-            new_plan_months=None,
-            new_plan_days=None,
-            new_plan_traffic_limit_bytes=None,
-            new_plan_hwid_device_limit=None,
-        )
+            # Return to host menu with refreshed list; меню хоста нужен только plans_host
+            data.clear()
+            data['plans_host'] = host_name
         await state.set_state(AdminPlans.host_menu)
-        await message.answer("✅ Тариф добавлен.")
+        text, plans = await _db(_host_menu_payload, host_name)
         await message.answer(
-            _format_plans_for_host(host_name),
-            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(get_plans_for_host(host_name) or []),
+            "✅ Тариф добавлен.\n\n" + text,
+            reply_markup=keyboards.create_admin_plans_host_menu_keyboard(plans),
             parse_mode='HTML'
         )
 
@@ -3635,18 +3875,12 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_promo_menu")
     async def admin_promo_menu_handler(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await show_admin_promo_menu(callback.message, edit_message=True)
 
     @admin_router.callback_query(F.data == "admin_promo_create")
     async def admin_promo_create_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminPromoCreate.waiting_for_code)
@@ -3660,13 +3894,8 @@ def get_admin_router() -> Router:
         F.data == "admin_promo_code_auto"
     )
     async def admin_promo_code_auto(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        code = uuid.uuid4().hex[:8].upper()
-        await state.update_data(promo_code=code)
-        await state.set_state(AdminPromoCreate.waiting_for_discount_type)
+        code = await _with_answer(callback, _gen_promo_code())
+        await _advance(state, AdminPromoCreate.waiting_for_discount_type, promo_code=code)
         try:
             await callback.message.edit_text(
                 f"Код: <code>{code}</code>\n\nВыберите тип скидки:",
@@ -3685,9 +3914,6 @@ def get_admin_router() -> Router:
         F.data == "admin_promo_code_custom"
     )
     async def admin_promo_code_custom(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await callback.message.edit_text(
             "Введите желаемый код (только латиница/цифры) или напишите <b>авто</b> для генерации:",
@@ -3697,18 +3923,15 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_code)
     async def admin_promo_create_code(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         if not raw:
             await message.answer("❌ Введите код или напишите 'авто'.")
             return
-        code = uuid.uuid4().hex[:8].upper() if raw.lower() == 'авто' or raw.lower() == 'auto' else raw.strip().upper()
-        if not re.fullmatch(r"[A-Z0-9_-]{3,32}", code):
+        code = await _gen_promo_code() if raw.lower() in ('авто', 'auto') else raw.upper()
+        if not _PROMO_CODE_RE.fullmatch(code):
             await message.answer("❌ Код должен состоять из латиницы/цифр и быть длиной 3-32 символа.")
             return
-        await state.update_data(promo_code=code)
-        await state.set_state(AdminPromoCreate.waiting_for_discount_type)
+        await _advance(state, AdminPromoCreate.waiting_for_discount_type, promo_code=code)
         await message.answer(
             "Выберите тип скидки:",
             reply_markup=keyboards.create_admin_promo_discount_keyboard()
@@ -3719,23 +3942,15 @@ def get_admin_router() -> Router:
         F.data.in_({"admin_promo_discount_percent", "admin_promo_discount_amount"})
     )
     async def admin_promo_set_discount_type(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         discount_type = 'percent' if callback.data.endswith('percent') else 'amount'
-        await state.update_data(discount_type=discount_type)
-        await state.set_state(AdminPromoCreate.waiting_for_discount_value)
+        await _advance(state, AdminPromoCreate.waiting_for_discount_value, discount_type=discount_type)
         prompt = "Введите процент скидки (например, 10.5):" if discount_type == 'percent' else "Введите размер скидки в RUB (например, 150):"
         await callback.message.edit_text(prompt, reply_markup=keyboards.create_admin_cancel_keyboard())
 
     @admin_router.message(AdminPromoCreate.waiting_for_discount_value)
     async def admin_promo_set_discount_value(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        data = await state.get_data()
-        discount_type = data.get('discount_type')
-        raw = (message.text or '').strip().replace(',', '.')
+        raw = (message.text or '').strip().translate(_NUM_TRANS)
         try:
             value = float(raw)
         except Exception:
@@ -3744,10 +3959,11 @@ def get_admin_router() -> Router:
         if value <= 0:
             await message.answer("❌ Значение должно быть положительным.")
             return
-        if discount_type == 'percent' and value >= 100:
-            await message.answer("❌ Процент скидки должен быть меньше 100.")
-            return
-        await state.update_data(discount_value=value)
+        async with _fsm_txn(state) as data:
+            if data.get('discount_type') == 'percent' and value >= 100:
+                await message.answer("❌ Процент скидки должен быть меньше 100.")
+                return
+            data['discount_value'] = value
         await state.set_state(AdminPromoCreate.waiting_for_total_limit)
         await message.answer(
             "Введите общий лимит активаций или выберите на кнопках:",
@@ -3756,11 +3972,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_total_limit)
     async def admin_promo_set_total_limit(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip().lower()
         limit_total: int | None
-        if raw in {'0', '∞', 'inf', 'infinity', 'безлимит', 'нет'} or not raw:
+        if raw in _UNLIMITED_TOKENS:
             limit_total = None
         else:
             try:
@@ -3770,8 +3984,7 @@ def get_admin_router() -> Router:
                 return
             if limit_total <= 0:
                 limit_total = None
-        await state.update_data(usage_limit_total=limit_total)
-        await state.set_state(AdminPromoCreate.waiting_for_per_user_limit)
+        await _advance(state, AdminPromoCreate.waiting_for_per_user_limit, usage_limit_total=limit_total)
         await message.answer(
             "Введите лимит на пользователя или выберите на кнопках:",
             reply_markup=keyboards.create_admin_promo_limit_keyboard("user")
@@ -3779,14 +3992,11 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(
         AdminPromoCreate.waiting_for_total_limit,
-        F.data.startswith("admin_promo_limit_total_")
+        F.data.startswith(_PROMO_LIMIT_TOTAL_PREFIX)
     )
     async def admin_promo_total_limit_buttons(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
-        tail = callback.data.replace("admin_promo_limit_total_", "", 1)
+        tail = callback.data[len(_PROMO_LIMIT_TOTAL_PREFIX):]
         if tail == "custom":
             await callback.message.edit_text(
                 "Введите общий лимит активаций (целое число) или 0/∞ для безлимита:",
@@ -3794,8 +4004,7 @@ def get_admin_router() -> Router:
             )
             return
         limit_total = None if tail == "inf" else int(tail)
-        await state.update_data(usage_limit_total=limit_total)
-        await state.set_state(AdminPromoCreate.waiting_for_per_user_limit)
+        await _advance(state, AdminPromoCreate.waiting_for_per_user_limit, usage_limit_total=limit_total)
         await callback.message.edit_text(
             "Введите лимит на пользователя или выберите на кнопках:",
             reply_markup=keyboards.create_admin_promo_limit_keyboard("user")
@@ -3803,14 +4012,11 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(
         AdminPromoCreate.waiting_for_per_user_limit,
-        F.data.startswith("admin_promo_limit_user_")
+        F.data.startswith(_PROMO_LIMIT_USER_PREFIX)
     )
     async def admin_promo_user_limit_buttons(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
-        tail = callback.data.replace("admin_promo_limit_user_", "", 1)
+        tail = callback.data[len(_PROMO_LIMIT_USER_PREFIX):]
         if tail == "custom":
             await callback.message.edit_text(
                 "Введите лимит на пользователя (целое число) или 0/∞ для безлимита:",
@@ -3818,8 +4024,7 @@ def get_admin_router() -> Router:
             )
             return
         limit_user = None if tail == "inf" else int(tail)
-        await state.update_data(usage_limit_per_user=limit_user)
-        await state.set_state(AdminPromoCreate.waiting_for_valid_from)
+        await _advance(state, AdminPromoCreate.waiting_for_valid_from, usage_limit_per_user=limit_user)
         await callback.message.edit_text(
             "Укажите дату начала действия или выберите на кнопках:",
             reply_markup=keyboards.create_admin_promo_valid_from_keyboard()
@@ -3827,11 +4032,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_per_user_limit)
     async def admin_promo_set_per_user_limit(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip().lower()
         limit_user: int | None
-        if raw in {'0', '∞', 'inf', 'infinity', 'безлимит', 'нет'} or not raw:
+        if raw in _UNLIMITED_TOKENS:
             limit_user = None
         else:
             try:
@@ -3841,8 +4044,7 @@ def get_admin_router() -> Router:
                 return
             if limit_user <= 0:
                 limit_user = None
-        await state.update_data(usage_limit_per_user=limit_user)
-        await state.set_state(AdminPromoCreate.waiting_for_valid_from)
+        await _advance(state, AdminPromoCreate.waiting_for_valid_from, usage_limit_per_user=limit_user)
         await message.answer(
             "Укажите дату начала действия (ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ). Напишите 'skip', чтобы пропустить:",
             reply_markup=keyboards.create_admin_cancel_keyboard()
@@ -3850,16 +4052,13 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_valid_from)
     async def admin_promo_set_valid_from(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         try:
             valid_from = _parse_datetime_input(raw)
         except ValueError as e:
             await message.answer(f"❌ {e}")
             return
-        await state.update_data(valid_from=valid_from)
-        await state.set_state(AdminPromoCreate.waiting_for_valid_until)
+        await _advance(state, AdminPromoCreate.waiting_for_valid_until, valid_from=valid_from)
         await message.answer(
             "Укажите дату окончания действия или выберите на кнопках:",
             reply_markup=keyboards.create_admin_promo_valid_until_keyboard()
@@ -3876,27 +4075,23 @@ def get_admin_router() -> Router:
         })
     )
     async def admin_promo_valid_from_buttons(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
-        now = datetime.now()
-        if callback.data.endswith("custom"):
+        tail = callback.data[len(_PROMO_VALID_FROM_PREFIX):]
+        if tail == "custom":
             await callback.message.edit_text(
                 "Укажите дату начала (ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ):",
                 reply_markup=keyboards.create_admin_cancel_keyboard()
             )
             return
-        if callback.data.endswith("skip"):
-            valid_from = None
-        elif callback.data.endswith("today"):
-            valid_from = datetime(now.year, now.month, now.day)
-        elif callback.data.endswith("tomorrow"):
-            valid_from = datetime(now.year, now.month, now.day) + timedelta(days=1)
-        else:
-            valid_from = now
-        await state.update_data(valid_from=valid_from)
-        await state.set_state(AdminPromoCreate.waiting_for_valid_until)
+        now = datetime.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        valid_from = {
+            "now": now,
+            "today": today,
+            "tomorrow": today + timedelta(days=1),
+            "skip": None,
+        }.get(tail, now)
+        await _advance(state, AdminPromoCreate.waiting_for_valid_until, valid_from=valid_from)
         await callback.message.edit_text(
             "Укажите дату окончания действия или выберите на кнопках:",
             reply_markup=keyboards.create_admin_promo_valid_until_keyboard()
@@ -3904,20 +4099,18 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_valid_until)
     async def admin_promo_set_valid_until(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         try:
             valid_until = _parse_datetime_input(raw)
         except ValueError as e:
             await message.answer(f"❌ {e}")
             return
-        data = await state.get_data()
-        valid_from = data.get('valid_from')
-        if valid_from and valid_until and valid_until <= valid_from:
-            await message.answer("❌ Дата окончания должна быть позже даты начала.")
-            return
-        await state.update_data(valid_until=valid_until)
+        async with _fsm_txn(state) as data:
+            valid_from = data.get('valid_from')
+            if valid_from and valid_until and valid_until <= valid_from:
+                await message.answer("❌ Дата окончания должна быть позже даты начала.")
+                return
+            data['valid_until'] = valid_until
         await state.set_state(AdminPromoCreate.waiting_for_description)
         await message.answer(
             "Добавьте описание/комментарий или пропустите:",
@@ -3935,28 +4128,21 @@ def get_admin_router() -> Router:
         })
     )
     async def admin_promo_valid_until_buttons(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
-        if callback.data.endswith("custom"):
+        tail = callback.data[len(_PROMO_VALID_UNTIL_PREFIX):]
+        if tail == "custom":
             await callback.message.edit_text(
                 "Укажите дату окончания (ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ):",
                 reply_markup=keyboards.create_admin_cancel_keyboard()
             )
             return
-        if callback.data.endswith("skip"):
-            valid_until = None
+        days = _VALID_UNTIL_DELTAS.get(tail)
+        if days is None:
+            await state.update_data(valid_until=None)
         else:
-            data = await state.get_data()
-            base = data.get('valid_from') or datetime.now()
-            if callback.data.endswith("plus1d"):
-                valid_until = base + timedelta(days=1)
-            elif callback.data.endswith("plus7d"):
-                valid_until = base + timedelta(days=7)
-            else:
-                valid_until = base + timedelta(days=30)
-        await state.update_data(valid_until=valid_until)
+            async with _fsm_txn(state) as data:
+                base = data.get('valid_from') or datetime.now()
+                data['valid_until'] = base + timedelta(days=days)
         await state.set_state(AdminPromoCreate.waiting_for_description)
         await callback.message.edit_text(
             "Добавьте описание/комментарий или пропустите:",
@@ -3965,46 +4151,22 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminPromoCreate.waiting_for_description)
     async def admin_promo_description(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         desc = (message.text or '').strip()
-        description = None if not desc or desc.lower() in {'skip', 'пропустить', 'нет'} else desc
-        await state.update_data(description=description)
-        data = await state.get_data()
-        code = data.get('promo_code')
-        discount_type = data.get('discount_type')
-        discount_value = data.get('discount_value')
-        total_limit = data.get('usage_limit_total')
-        per_user_limit = data.get('usage_limit_per_user')
-        valid_from = data.get('valid_from')
-        valid_until = data.get('valid_until')
-        summary_lines = [
-            "Проверьте данные промокода:",
-            f"Код: <code>{code}</code>",
-            f"Тип скидки: {'процент' if discount_type == 'percent' else 'фиксированная'}",
-            f"Значение: {discount_value:.2f}{'%' if discount_type == 'percent' else ' RUB'}",
-            f"Лимит всего: {total_limit if total_limit is not None else 'без ограничений'}",
-            f"Лимит на пользователя: {per_user_limit if per_user_limit is not None else 'без ограничений'}",
-            f"Действует с: {valid_from.isoformat(' ') if valid_from else '—'}",
-            f"Действует до: {valid_until.isoformat(' ') if valid_until else '—'}",
-            f"Описание: {description or '—'}",
-        ]
-        summary_text = "\n".join(summary_lines)
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ Создать", callback_data="admin_promo_confirm")
-        builder.button(text="❌ Отмена", callback_data="admin_cancel")
-        builder.adjust(1, 1)
+        description = None if desc.lower() in _SKIP_TOKENS else desc
+        async with _fsm_txn(state) as data:
+            data['description'] = description
         await state.set_state(AdminPromoCreate.confirming)
-        await message.answer(summary_text, reply_markup=builder.as_markup(), parse_mode='HTML')
+        await message.answer(
+            _render_promo_summary(data),
+            reply_markup=keyboards.create_admin_promo_confirm_keyboard(),
+            parse_mode='HTML'
+        )
 
     @admin_router.callback_query(
         AdminPromoCreate.waiting_for_description,
         F.data.in_({"admin_promo_desc_skip", "admin_promo_desc_custom"})
     )
     async def admin_promo_desc_buttons(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
         if callback.data.endswith("custom"):
             await callback.message.edit_text(
@@ -4013,41 +4175,19 @@ def get_admin_router() -> Router:
             )
             return
 
-        await state.update_data(description=None)
-        data = await state.get_data()
-        code = data.get('promo_code')
-        discount_type = data.get('discount_type')
-        discount_value = data.get('discount_value')
-        total_limit = data.get('usage_limit_total')
-        per_user_limit = data.get('usage_limit_per_user')
-        valid_from = data.get('valid_from')
-        valid_until = data.get('valid_until')
-        summary_lines = [
-            "Проверьте данные промокода:",
-            f"Код: <code>{code}</code>",
-            f"Тип скидки: {'процент' if discount_type == 'percent' else 'фиксированная'}",
-            f"Значение: {discount_value:.2f}{'%' if discount_type == 'percent' else ' RUB'}",
-            f"Лимит всего: {total_limit if total_limit is not None else 'без ограничений'}",
-            f"Лимит на пользователя: {per_user_limit if per_user_limit is not None else 'без ограничений'}",
-            f"Действует с: {valid_from.isoformat(' ') if valid_from else '—'}",
-            f"Действует до: {valid_until.isoformat(' ') if valid_until else '—'}",
-            f"Описание: —",
-        ]
-        summary_text = "\n".join(summary_lines)
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ Создать", callback_data="admin_promo_confirm")
-        builder.button(text="❌ Отмена", callback_data="admin_cancel")
-        builder.adjust(1, 1)
+        async with _fsm_txn(state) as data:
+            data['description'] = None
         await state.set_state(AdminPromoCreate.confirming)
-        await callback.message.edit_text(summary_text, reply_markup=builder.as_markup(), parse_mode='HTML')
+        await callback.message.edit_text(
+            _render_promo_summary(data),
+            reply_markup=keyboards.create_admin_promo_confirm_keyboard(),
+            parse_mode='HTML'
+        )
 
-    @admin_router.callback_query(AdminPromoCreate.confirming, F.data == "admin_promo_confirm")
-    async def admin_promo_confirm(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
+    @admin_router.callback_query(AdminPromoCreate.confirming, F.data == "admin_promo_confirm", flags={"fsm_data": True})
+    async def admin_promo_confirm(callback: types.CallbackQuery, state: FSMContext, fsm_data: dict):
         await callback.answer()
-        data = await state.get_data()
+        data = fsm_data
         code = data.get('promo_code')
         discount_type = data.get('discount_type')
         discount_value = data.get('discount_value')
@@ -4068,7 +4208,7 @@ def get_admin_router() -> Router:
             'description': description,
         }
         try:
-            ok = create_promo_code(**kwargs)
+            ok = await _promo_writer.submit(kwargs)
         except ValueError as e:
             await callback.message.edit_text(f"❌ Не удалось создать промокод: {e}", reply_markup=keyboards.create_admin_promo_menu_keyboard())
             await state.clear()
@@ -4089,139 +4229,57 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_promo_list")
     async def admin_promo_list(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.update_data(promo_page=0)
-        codes = list_promo_codes(include_inactive=True) or []
-        text_lines = ["🎟 <b>Доступные промокоды</b>"]
-        if not codes:
-            text_lines.append("Пока нет созданных промокодов.")
-        else:
-            for promo in codes[:10]:
-                text_lines.append(_format_promo_line(promo))
-        await callback.message.edit_text(
-            "\n".join(text_lines),
-            reply_markup=_build_promo_list_keyboard(codes, page=0),
-            parse_mode='HTML'
-        )
+        text, markup, _ = await _db(_promo_list_view, 0)
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
 
     @admin_router.callback_query(F.data.startswith("admin_promo_page_"))
     async def admin_promo_change_page(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
         await callback.answer()
-        try:
-            page = int(callback.data.split('_')[-1])
-        except Exception:
-            page = 0
-        codes = list_promo_codes(include_inactive=True) or []
+        page = _tail_id(callback.data) or 0
+        text, markup, page = await _db(_promo_list_view, page)
         await state.update_data(promo_page=page)
-        text_lines = ["🎟 <b>Доступные промокоды</b>"]
-        if not codes:
-            text_lines.append("Пока нет созданных промокодов.")
-        else:
-            start = page * 10
-            for promo in codes[start:start + 10]:
-                text_lines.append(_format_promo_line(promo))
-        await callback.message.edit_text(
-            "\n".join(text_lines),
-            reply_markup=_build_promo_list_keyboard(codes, page=page),
-            parse_mode='HTML'
-        )
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
 
-    @admin_router.callback_query(F.data.startswith("admin_promo_toggle_"))
-    async def admin_promo_toggle(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.")
-            return
+    @admin_router.callback_query(F.data.startswith("admin_promo_toggle_"), flags={"fsm_data": True})
+    @_singleflight
+    async def admin_promo_toggle(callback: types.CallbackQuery, state: FSMContext, fsm_data: dict):
         code = callback.data.split("admin_promo_toggle_")[-1]
-        codes = list_promo_codes(include_inactive=True) or []
-        target = next((p for p in codes if (p.get('code') or '').upper() == code.upper()), None)
-        if not target:
+        if not await _db(toggle_promo_code_status, code):
             await callback.answer("Промокод не найден", show_alert=True)
             return
-        new_status = not bool(target.get('is_active'))
-        update_promo_code_status(code, is_active=new_status)
-        await callback.answer("Статус обновлён")
-        page = (await state.get_data()).get('promo_page', 0)
-        codes = list_promo_codes(include_inactive=True) or []
-        text_lines = ["🎟 <b>Доступные промокоды</b>"]
-        if not codes:
-            text_lines.append("Пока нет созданных промокодов.")
-        else:
-            start = page * 10
-            for promo in codes[start:start + 10]:
-                text_lines.append(_format_promo_line(promo))
-        await callback.message.edit_text(
-            "\n".join(text_lines),
-            reply_markup=_build_promo_list_keyboard(codes, page=page),
-            parse_mode='HTML'
+        _, (text, markup, _) = await asyncio.gather(
+            callback.answer("Статус обновлён"),
+            _db(_promo_list_view, fsm_data.get('promo_page', 0)),
         )
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
 
 
-    @admin_router.callback_query(F.data == "admin_speedtest")
-    async def admin_speedtest_entry(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-
-        targets = get_all_ssh_targets() or []
-        try:
-            await callback.message.edit_text(
-                "🔌 <b>SSH цели для Speedtest</b>\nВыберите цель:",
-                reply_markup=keyboards.create_admin_ssh_targets_keyboard(targets)
-            )
-        except Exception:
-            await callback.message.answer(
-                "🔌 <b>SSH цели для Speedtest</b>\nВыберите цель:",
-                reply_markup=keyboards.create_admin_ssh_targets_keyboard(targets)
-            )
-
+    _SSH_TARGETS_TEXT = "🔌 <b>SSH цели для Speedtest</b>\nВыберите цель:"
 
-    @admin_router.callback_query(F.data == "admin_speedtest_ssh_targets")
-    async def admin_speedtest_ssh_targets(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        targets = get_all_ssh_targets() or []
+    @admin_router.callback_query(F.data.in_({"admin_speedtest", "admin_speedtest_ssh_targets"}))
+    async def admin_speedtest_entry(callback: types.CallbackQuery):
+        targets = await _with_answer(callback, _db(get_all_ssh_targets))
+        markup = keyboards.create_admin_ssh_targets_keyboard(targets or [])
         try:
-            await callback.message.edit_text(
-                "🔌 <b>SSH цели для Speedtest</b>\nВыберите цель:",
-                reply_markup=keyboards.create_admin_ssh_targets_keyboard(targets)
-            )
+            # Повторное нажатие на тот же экран не должно уходить в Bot API
+            await _edit_if_changed(callback.message, _SSH_TARGETS_TEXT, markup)
         except Exception:
-            await callback.message.answer(
-                "🔌 <b>SSH цели для Speedtest</b>\nВыберите цель:",
-                reply_markup=keyboards.create_admin_ssh_targets_keyboard(targets)
-            )
+            await callback.message.answer(_SSH_TARGETS_TEXT, reply_markup=markup)
 
 
-    @admin_router.callback_query(F.data.startswith("admin_speedtest_pick_host_"))
+    @_singleflight
     async def admin_speedtest_run(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         host_name = callback.data.replace("admin_speedtest_pick_host_", "", 1)
 
 
-        try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
-            admin_ids = list({*(get_admin_ids() or []), int(callback.from_user.id)})
-        except Exception:
-            admin_ids = [int(callback.from_user.id)]
+        admin_ids = await _admin_notify_ids(callback.from_user.id)
         initiator = _format_user_mention(callback.from_user)
         start_text = f"🚀 Запущен тест скорости для хоста: <b>{host_name}</b>\n(инициатор: {initiator})"
-        for aid in admin_ids:
-            try:
-                await callback.bot.send_message(aid, start_text)
-            except Exception:
-                pass
+        # Уведомление админов не задерживает запуск теста — дожидаемся его только перед итоговой рассылкой
+        started = asyncio.create_task(_broadcast(callback.bot, admin_ids, start_text))
 
 
         try:
@@ -4280,68 +4338,29 @@ def get_admin_router() -> Router:
             await callback.message.answer(text_res)
 
 
-        for aid in admin_ids:
-            if wait_msg and aid == callback.from_user.id:
-                continue
-            try:
-                await callback.bot.send_message(aid, text_res)
-            except Exception:
-                pass
-
-
-    @admin_router.callback_query(F.data.startswith("stt:"))
-    async def admin_speedtest_run_target_hashed(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        target_name = _resolve_target_from_hash(callback.data)
-        if not target_name:
-            await callback.message.answer("❌ Цель не найдена")
-            return
+        await _broadcast(callback.bot, admin_ids, text_res, exclude=(callback.from_user.id,) if wait_msg else (), replace=await started)
 
 
-        logger.info(f"Bot/Admin: запуск спидтеста для SSH-цели '{target_name}' (инициатор id={callback.from_user.id})")
-        try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
-            admin_ids = list({*(get_admin_ids() or []), int(callback.from_user.id)})
-        except Exception:
-            admin_ids = [int(callback.from_user.id)]
+    async def _run_ssh_target(callback: types.CallbackQuery, target_name: str, *, legacy: bool = False) -> None:
+        """Спидтест SSH-цели с уведомлением админов; общий для stt:<hash> и legacy-кнопок."""
+        kind = " (legacy)" if legacy else ""
+        logger.info(f"Bot/Admin: запуск спидтеста{kind} для SSH-цели '{target_name}' (инициатор id={callback.from_user.id})")
+        admin_ids = await _admin_notify_ids(callback.from_user.id)
         initiator = _format_user_mention(callback.from_user)
         start_text = f"🚀 Запущен тест скорости (SSH-цель): <b>{target_name}</b>\n(инициатор: {initiator})"
-        for aid in admin_ids:
-            try:
-                await callback.bot.send_message(aid, start_text)
-            except Exception:
-                pass
-
+        started = asyncio.create_task(_broadcast(callback.bot, admin_ids, start_text))
 
         try:
             wait_msg = await callback.message.answer(f"⏳ Выполняю тест скорости для SSH-цели <b>{target_name}</b>…")
         except Exception:
             wait_msg = None
 
-
         try:
             result = await speedtest_runner.run_and_store_ssh_speedtest_for_target(target_name)
         except Exception as e:
             result = {"ok": False, "error": str(e)}
 
-        if not result.get("ok"):
-            text_res = f"🏁 Тест скорости (SSH-цель) завершён для <b>{target_name}</b>\n❌ {result.get('error') or 'ошибка'}"
-        else:
-            ping = result.get('ping_ms')
-            down = result.get('download_mbps')
-            up = result.get('upload_mbps')
-            srv = result.get('server_name') or '—'
-            text_res = (
-                f"🏁 Тест скорости (SSH-цель) завершён для <b>{target_name}</b>\n\n"
-                f"<b>SSH:</b> ✅\n"
-                f"• ping: {ping if ping is not None else '—'} ms\n"
-                f"• ↓ {down if down is not None else '—'} Mbps\n"
-                f"• ↑ {up if up is not None else '—'} Mbps\n"
-                f"• сервер: {srv}"
-            )
+        text_res = _format_ssh_result(target_name, result)
 
         if wait_msg:
             try:
@@ -4351,195 +4370,100 @@ def get_admin_router() -> Router:
         else:
             await callback.message.answer(text_res)
 
-        for aid in admin_ids:
-            if wait_msg and aid == callback.from_user.id:
-                continue
-            try:
-                await callback.bot.send_message(aid, text_res)
-            except Exception:
-                pass
+        await _broadcast(callback.bot, admin_ids, text_res, exclude=(callback.from_user.id,) if wait_msg else (), replace=await started)
 
 
-    @admin_router.callback_query(F.data.startswith("admin_speedtest_pick_target_"))
-    async def admin_speedtest_run_target(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
+    @_singleflight
+    async def admin_speedtest_run_target_hashed(callback: types.CallbackQuery):
         await callback.answer()
-        target_name = callback.data.replace("admin_speedtest_pick_target_", "", 1)
-
-
-        logger.info(f"Bot/Admin: запуск спидтеста (legacy) для SSH-цели '{target_name}' (инициатор id={callback.from_user.id})")
-        try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
-            admin_ids = list({*(get_admin_ids() or []), int(callback.from_user.id)})
-        except Exception:
-            admin_ids = [int(callback.from_user.id)]
-        initiator = _format_user_mention(callback.from_user)
-        start_text = f"🚀 Запущен тест скорости (SSH-цель): <b>{target_name}</b>\n(инициатор: {initiator})"
-        for aid in admin_ids:
-            try:
-                await callback.bot.send_message(aid, start_text)
-            except Exception:
-                pass
-
-
-        try:
-            wait_msg = await callback.message.answer(f"⏳ Выполняю тест скорости для SSH-цели <b>{target_name}</b>…")
-        except Exception:
-            wait_msg = None
-
-
-        try:
-            result = await speedtest_runner.run_and_store_ssh_speedtest_for_target(target_name)
-        except Exception as e:
-            result = {"ok": False, "error": str(e)}
-
-
-        if not result.get("ok"):
-            text_res = f"🏁 Тест скорости (SSH-цель) завершён для <b>{target_name}</b>\n❌ {result.get('error') or 'ошибка'}"
-        else:
-            ping = result.get('ping_ms')
-            down = result.get('download_mbps')
-            up = result.get('upload_mbps')
-            srv = result.get('server_name') or '—'
-            text_res = (
-                f"🏁 Тест скорости (SSH-цель) завершён для <b>{target_name}</b>\n\n"
-                f"<b>SSH:</b> ✅\n"
-                f"• ping: {ping if ping is not None else '—'} ms\n"
-                f"• ↓ {down if down is not None else '—'} Mbps\n"
-                f"• ↑ {up if up is not None else '—'} Mbps\n"
-                f"• сервер: {srv}"
-            )
-
-
-        if wait_msg:
-            try:
-                await wait_msg.edit_text(text_res)
-            except Exception:
-                await callback.message.answer(text_res)
-        else:
-            await callback.message.answer(text_res)
+        target_name = _resolve_target_from_hash(callback.data)
+        if not target_name:
+            await callback.message.answer("❌ Цель не найдена")
+            return
+        await _run_ssh_target(callback, target_name)
 
 
-        for aid in admin_ids:
-            if wait_msg and aid == callback.from_user.id:
-                continue
-            try:
-                await callback.bot.send_message(aid, text_res)
-            except Exception:
-                pass
+    @_singleflight
+    async def admin_speedtest_run_target(callback: types.CallbackQuery):
+        await callback.answer()
+        target_name = callback.data.replace("admin_speedtest_pick_target_", "", 1)
+        await _run_ssh_target(callback, target_name, legacy=True)
 
 
     @admin_router.callback_query(F.data == "admin_speedtest_back_to_users")
     async def admin_speedtest_back(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await show_admin_menu(callback.message, edit_message=True)
 
 
     @admin_router.callback_query(F.data == "admin_speedtest_run_all")
+    @_singleflight
     async def admin_speedtest_run_all(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
 
-        try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
-            admin_ids = list({*(get_admin_ids() or []), int(callback.from_user.id)})
-        except Exception:
-            admin_ids = [int(callback.from_user.id)]
+        admin_ids = await _admin_notify_ids(callback.from_user.id)
         initiator = _format_user_mention(callback.from_user)
         start_text = f"🚀 Запущен тест скорости для всех хостов\n(инициатор: {initiator})"
-        for aid in admin_ids:
-            try:
-                await callback.bot.send_message(aid, start_text)
-            except Exception:
-                pass
+        started = asyncio.create_task(_broadcast(callback.bot, admin_ids, start_text))
 
         hosts = get_all_hosts() or []
-        summary_lines = []
-        for h in hosts:
-            name = h.get('host_name')
-            try:
-                res = await speedtest_runner.run_both_for_host(name)
-                ok = res.get('ok')
-                det = res.get('details') or {}
-                dm = det.get('ssh', {}).get('download_mbps') or det.get('net', {}).get('download_mbps')
-                um = det.get('ssh', {}).get('upload_mbps') or det.get('net', {}).get('upload_mbps')
-                summary_lines.append(f"• {name}: {'✅' if ok else '❌'} ↓ {dm or '—'} ↑ {um or '—'}")
-            except Exception as e:
-                summary_lines.append(f"• {name}: ❌ {e}")
+        sem = asyncio.Semaphore(_SPEEDTEST_CONCURRENCY)
+
+        async def _one(name: str) -> str:
+            async with sem:
+                try:
+                    res = await speedtest_runner.run_both_for_host(name)
+                except Exception as e:
+                    return f"• {name}: ❌ {e}"
+            ok = res.get('ok')
+            det = res.get('details') or {}
+            dm = (det.get('ssh') or {}).get('download_mbps') or (det.get('net') or {}).get('download_mbps')
+            um = (det.get('ssh') or {}).get('upload_mbps') or (det.get('net') or {}).get('upload_mbps')
+            return f"• {name}: {'✅' if ok else '❌'} ↓ {dm or '—'} ↑ {um or '—'}"
+
+        summary_lines = await asyncio.gather(*(_one(h.get('host_name')) for h in hosts))
         text = "🏁 Тест для всех завершён:\n" + "\n".join(summary_lines)
         await callback.message.answer(text)
-        for aid in admin_ids:
-
-            if aid == callback.from_user.id or aid == callback.message.chat.id:
-                continue
-            try:
-                await callback.bot.send_message(aid, text)
-            except Exception:
-                pass
+        await _broadcast(callback.bot, admin_ids, text, exclude=(callback.from_user.id, callback.message.chat.id), replace=await started)
 
 
     @admin_router.callback_query(F.data == "admin_speedtest_run_all_targets")
+    @_singleflight
     async def admin_speedtest_run_all_targets(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
 
-        try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
-            admin_ids = list({*(get_admin_ids() or []), int(callback.from_user.id)})
-        except Exception:
-            admin_ids = [int(callback.from_user.id)]
+        admin_ids = await _admin_notify_ids(callback.from_user.id)
         initiator = _format_user_mention(callback.from_user)
         start_text = f"🚀 Запущен тест скорости для всех SSH-целей\n(инициатор: {initiator})"
         logger.info(f"Bot/Admin: запуск спидтеста ДЛЯ ВСЕХ SSH-целей (инициатор id={callback.from_user.id})")
-        for aid in admin_ids:
-            try:
-                await callback.bot.send_message(aid, start_text)
-            except Exception:
-                pass
+        started = asyncio.create_task(_broadcast(callback.bot, admin_ids, start_text))
 
         targets = get_all_ssh_targets() or []
-        summary_lines = []
-        ok_total = 0
-        for t in targets:
-            name = (t.get('target_name') or '').strip()
-            if not name:
-                continue
-            try:
-                res = await speedtest_runner.run_and_store_ssh_speedtest_for_target(name)
-                ok = bool(res.get('ok'))
-                dm = res.get('download_mbps')
-                um = res.get('upload_mbps')
-                summary_lines.append(f"• {name}: {'✅' if ok else '❌'} ↓ {dm or '—'} ↑ {um or '—'}")
-                if ok:
-                    ok_total += 1
-            except Exception as e:
-                summary_lines.append(f"• {name}: ❌ {e}")
+        sem = asyncio.Semaphore(_SPEEDTEST_CONCURRENCY)
+
+        async def _one(name: str) -> tuple[str, bool]:
+            async with sem:
+                try:
+                    res = await speedtest_runner.run_and_store_ssh_speedtest_for_target(name)
+                except Exception as e:
+                    return f"• {name}: ❌ {e}", False
+            ok = bool(res.get('ok'))
+            dm = res.get('download_mbps')
+            um = res.get('upload_mbps')
+            return f"• {name}: {'✅' if ok else '❌'} ↓ {dm or '—'} ↑ {um or '—'}", ok
+
+        names = [name for name in ((t.get('target_name') or '').strip() for t in targets) if name]
+        results = await asyncio.gather(*(_one(name) for name in names))
+        summary_lines = [line for line, _ in results]
+        ok_total = sum(1 for _, ok in results if ok)
         text = "🏁 SSH-цели: тест для всех завершён:\n" + ("\n".join(summary_lines) if summary_lines else "(нет целей)")
         logger.info(f"Bot/Admin: завершён спидтест ДЛЯ ВСЕХ SSH-целей: ок={ok_total}, всего={len(targets)}")
         await callback.message.answer(text)
-        for aid in admin_ids:
-            if aid == callback.from_user.id or aid == callback.message.chat.id:
-                continue
-            try:
-                await callback.bot.send_message(aid, text)
-            except Exception:
-                pass
+        await _broadcast(callback.bot, admin_ids, text, exclude=(callback.from_user.id, callback.message.chat.id), replace=await started)
 
 
     @admin_router.callback_query(F.data == "admin_backup_db")
     async def admin_backup_db(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         try:
             wait = await callback.message.answer("⏳ Создаю бэкап базы данных…")
@@ -4572,9 +4496,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_restore_db")
     async def admin_restore_db_prompt(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminRestoreDB.waiting_file)
         kb = InlineKeyboardBuilder()
@@ -4592,8 +4513,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminRestoreDB.waiting_file)
     async def admin_restore_db_receive(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         doc = message.document
         if not doc:
             await message.answer("❌ Пришлите файл .zip или .db")
@@ -4606,32 +4525,29 @@ def get_admin_router() -> Router:
             ts = datetime.now().strftime('%Y%m%d-%H%M%S')
             dest = backup_manager.BACKUPS_DIR / f"uploaded-{ts}-{filename}"
             dest.parent.mkdir(parents=True, exist_ok=True)
-            await message.bot.download(doc, destination=dest)
+            # Путь в destination: aiogram пишет файл на диск по частям, не держа его в памяти целиком
+            await message.bot.download(doc, destination=dest, chunk_size=_DOWNLOAD_CHUNK)
         except Exception as e:
             await message.answer(f"❌ Не удалось скачать файл: {e}")
             return
-        ok = backup_manager.restore_from_file(dest)
+        ok = await _db(backup_manager.restore_from_file, dest)
         await state.clear()
         if ok:
+            _invalidate_hosts()
             await message.answer("✅ Восстановление выполнено успешно.\nБот и панель продолжают работу с новой БД.")
         else:
             await message.answer("❌ Восстановление не удалось. Проверьте файл и повторите.")
 
 
-    @admin_router.callback_query(F.data.startswith("admin_speedtest_autoinstall_"))
     async def admin_speedtest_autoinstall(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         host_name = callback.data.replace("admin_speedtest_autoinstall_", "", 1)
         try:
             wait = await callback.message.answer(f"🛠 Пытаюсь установить speedtest на <b>{host_name}</b>…")
         except Exception:
             wait = None
-        from shop_bot.data_manager.speedtest_runner import auto_install_speedtest_on_host
         try:
-            res = await auto_install_speedtest_on_host(host_name)
+            res = await speedtest_runner.auto_install_speedtest_on_host(host_name)
         except Exception as e:
             res = {"ok": False, "log": f"Ошибка: {e}"}
         text = ("✅ Автоустановка завершена успешно" if res.get("ok") else "❌ Автоустановка завершилась с ошибкой")
@@ -4643,21 +4559,16 @@ def get_admin_router() -> Router:
                 await callback.message.answer(text)
 
 
-    @admin_router.callback_query(F.data.startswith("admin_speedtest_autoinstall_target_"))
     async def admin_speedtest_autoinstall_target(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         target_name = callback.data.replace("admin_speedtest_autoinstall_target_", "", 1)
         try:
             wait = await callback.message.answer(f"🛠 Пытаюсь установить speedtest на SSH-цели <b>{target_name}</b>…")
         except Exception:
             wait = None
-        from shop_bot.data_manager.speedtest_runner import auto_install_speedtest_on_target
         logger.info(f"Bot/Admin: автоустановка speedtest на SSH-цели '{target_name}' (инициатор id={callback.from_user.id})")
         try:
-            res = await auto_install_speedtest_on_target(target_name)
+            res = await speedtest_runner.auto_install_speedtest_on_target(target_name)
         except Exception as e:
             res = {"ok": False, "log": f"Ошибка: {e}"}
         text = ("✅ Автоустановка завершена успешно" if res.get("ok") else "❌ Автоустановка завершилась с ошибкой")
@@ -4675,11 +4586,7 @@ def get_admin_router() -> Router:
             await callback.message.answer(text)
 
 
-    @admin_router.callback_query(F.data.startswith("stti:"))
     async def admin_speedtest_autoinstall_target_hashed(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         target_name = _resolve_target_from_hash(callback.data)
         if not target_name:
@@ -4689,9 +4596,8 @@ def get_admin_router() -> Router:
             wait = await callback.message.answer(f"🛠 Пытаюсь установить speedtest на SSH-цели <b>{target_name}</b>…")
         except Exception:
             wait = None
-        from shop_bot.data_manager.speedtest_runner import auto_install_speedtest_on_target
         try:
-            res = await auto_install_speedtest_on_target(target_name)
+            res = await speedtest_runner.auto_install_speedtest_on_target(target_name)
         except Exception as e:
             res = {"ok": False, "log": f"Ошибка: {e}"}
         text = ("✅ Автоустановка завершена успешно" if res.get("ok") else "❌ Автоустановка завершилась с ошибкой")
@@ -4706,16 +4612,31 @@ def get_admin_router() -> Router:
 
 
 
-    
+    # Префиксные callback'и спидтеста: один хендлер с одним регулярным выражением
+    # вместо шести фильтров startswith подряд. Альтернативы отсортированы по длине,
+    # чтобы admin_speedtest_autoinstall_target_ не перехватывался admin_speedtest_autoinstall_.
+    _SPEEDTEST_PREFIX_HANDLERS = {
+        "admin_speedtest_pick_host_": admin_speedtest_run,
+        "stt:": admin_speedtest_run_target_hashed,
+        "admin_speedtest_pick_target_": admin_speedtest_run_target,
+        "admin_speedtest_autoinstall_target_": admin_speedtest_autoinstall_target,
+        "admin_speedtest_autoinstall_": admin_speedtest_autoinstall,
+        "stti:": admin_speedtest_autoinstall_target_hashed,
+    }
+    _SPEEDTEST_PREFIX_RE = re.compile("|".join(
+        re.escape(p) for p in sorted(_SPEEDTEST_PREFIX_HANDLERS, key=len, reverse=True)
+    ))
+
+    @admin_router.callback_query(F.data.regexp(_SPEEDTEST_PREFIX_RE).as_("prefix"))
+    async def admin_speedtest_prefixed(callback: types.CallbackQuery, prefix: re.Match):
+        await _SPEEDTEST_PREFIX_HANDLERS[prefix.group()](callback)
+
 
     class AdminUserSearch(StatesGroup):
         waiting_for_query = State()
 
     @admin_router.callback_query(F.data.startswith("admin_users"))
     async def admin_users_handler(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
 
         # Обработка кнопки поиска пользователя
@@ -4730,13 +4651,10 @@ def get_admin_router() -> Router:
 
         # Открытие списка пользователей / переключение страниц
         await state.clear()
-        users = get_all_users()
         page = 0
         if callback.data.startswith("admin_users_page_"):
-            try:
-                page = int(callback.data.split("_")[-1])
-            except Exception:
-                page = 0
+            page = _tail_id(callback.data) or 0
+        users = await _db(get_all_users)
         await callback.message.edit_text(
             "👥 <b>Пользователи</b>",
             reply_markup=keyboards.create_admin_users_keyboard(users, page=page)
@@ -4745,43 +4663,22 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminUserSearch.waiting_for_query)
     async def admin_users_search_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-
         raw = (message.text or "").strip()
         if not raw:
             await message.answer("Введите ID пользователя или его @username, либо нажмите Отмена.")
             return
 
-        users = get_all_users() or []
         matches: list[dict] = []
 
-        # Поиск по числовому ID
+        # Поиск по числовому ID — точечный запрос, без выборки всех пользователей
         if raw.isdigit():
-            try:
-                target_id = int(raw)
-            except Exception:
-                target_id = None
-            else:
-                if target_id is not None:
-                    user = get_user(target_id)
-                    if user:
-                        matches = [user]
-
-        # Поиск по username
-        if not matches and not raw.isdigit():
-            uname = raw.lstrip("@").lower()
-            for u in users:
-                uname_u = (u.get("username") or "").lstrip("@").lower()
-                if uname_u and (uname_u == uname or uname in uname_u):
-                    matches.append(u)
-
-        # Дополнительный поиск по части ID
-        if not matches and not raw.isdigit():
-            for u in users:
-                uid = str(u.get("telegram_id") or u.get("user_id") or u.get("id") or "")
-                if uid and raw in uid:
-                    matches.append(u)
+            user = await _db(get_user, int(raw))
+            if user:
+                matches = [user]
+        else:
+            # Точное совпадение username (по индексу), затем по части username или ID — всё в SQL
+            user = await _db(get_user_by_username, raw)
+            matches = [user] if user else await _db(search_users, raw)
 
         if not matches:
             await message.answer("❌ Пользователь не найден. Отправьте другой ID/username или нажмите Отмена.")
@@ -4793,35 +4690,8 @@ def get_admin_router() -> Router:
         if len(matches) == 1:
             u = matches[0]
             user_id = int(u.get("telegram_id") or u.get("user_id") or u.get("id"))
-            user = get_user(user_id) or u
-
-            if user.get("username"):
-                uname = user.get("username").lstrip("@")
-                user_tag = f"<a href='https://t.me/{uname}'>@{uname}</a>"
-            else:
-                user_tag = f"<a href='tg://user?id={user_id}'>Профиль</a>"
-
-            is_banned = user.get("is_banned", False)
-            total_spent = user.get("total_spent", 0)
-            balance = user.get("balance", 0)
-            referred_by = user.get("referred_by")
-            keys = get_keys_for_user(user_id)
-            keys_count = len(keys)
-
-            text = (
-                f"👤 <b>Пользователь {user_id}</b>\n\n"
-                f"Имя пользователя: {user_tag}\n"
-                f"Всего потратил: {float(total_spent):.2f} RUB\n"
-                f"Баланс: {float(balance):.2f} RUB\n"
-                f"Забанен: {'да' if is_banned else 'нет'}\n"
-                f"Приглашён: {referred_by if referred_by else '—'}\n"
-                f"Ключей: {keys_count}"
-            )
-
-            await message.answer(
-                text,
-                reply_markup=keyboards.create_admin_user_actions_keyboard(user_id, is_banned=is_banned)
-            )
+            text, markup = await _user_profile_view(user_id, u)
+            await message.answer(text, reply_markup=markup)
         else:
             # Если найдено несколько пользователей — показываем список с кнопками
             await message.answer(
@@ -4831,132 +4701,49 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_view_user_"))
     async def admin_view_user_handler(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
-        user = get_user(user_id)
-        if not user:
+        view = await _user_profile_view(user_id)
+        if view is None:
             await callback.message.answer("❌ Пользователь не найден")
             return
-
-        username = user.get('username') or '—'
-
-        if user.get('username'):
-            uname = user.get('username').lstrip('@')
-            user_tag = f"<a href='https://t.me/{uname}'>@{uname}</a>"
-        else:
-            user_tag = f"<a href='tg://user?id={user_id}'>Профиль</a>"
-        is_banned = user.get('is_banned', False)
-        total_spent = user.get('total_spent', 0)
-        balance = user.get('balance', 0)
-        referred_by = user.get('referred_by')
-        keys = get_keys_for_user(user_id)
-        keys_count = len(keys)
-        text = (
-            f"👤 <b>Пользователь {user_id}</b>\n\n"
-            f"Имя пользователя: {user_tag}\n"
-            f"Всего потратил: {float(total_spent):.2f} RUB\n"
-            f"Баланс: {float(balance):.2f} RUB\n"
-            f"Забанен: {'да' if is_banned else 'нет'}\n"
-            f"Приглашён: {referred_by if referred_by else '—'}\n"
-            f"Ключей: {keys_count}"
-        )
-        await callback.message.edit_text(
-            text,
-            reply_markup=keyboards.create_admin_user_actions_keyboard(user_id, is_banned=is_banned)
-        )
+        text, markup = view
+        await callback.message.edit_text(text, reply_markup=markup)
 
 
     @admin_router.callback_query(F.data.startswith("admin_ban_user_"))
     async def admin_ban_user(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
         try:
-            ban_user(user_id)
+            await _db(ban_user, user_id)
             await callback.message.answer(f"🚫 Пользователь {user_id} забанен")
-            try:
-
-                from shop_bot.data_manager.remnawave_repository import get_setting as _get_setting
-                support = (_get_setting("support_bot_username") or _get_setting("support_user") or "").strip()
-                kb = InlineKeyboardBuilder()
-                url = None
-                if support:
-                    if support.startswith("@"):
-                        url = f"tg://resolve?domain={support[1:]}"
-                    elif support.startswith("tg://"):
-                        url = support
-                    elif support.startswith("http://") or support.startswith("https://"):
-                        try:
-                            part = support.split("/")[-1].split("?")[0]
-                            if part:
-                                url = f"tg://resolve?domain={part}"
-                        except Exception:
-                            url = support
-                    else:
-                        url = f"tg://resolve?domain={support}"
-                if url:
-                    kb.button(text="🆘 Написать в поддержку", url=url)
-                else:
-                    kb.button(text="🆘 Поддержка", callback_data="show_help")
-                await callback.bot.send_message(
-                    user_id,
-                    "🚫 Ваш аккаунт заблокирован администратором. Если это ошибка — напишите в поддержку.",
-                    reply_markup=kb.as_markup()
-                )
-            except Exception:
-                pass
+            _notify(
+                callback.bot,
+                user_id,
+                "🚫 Ваш аккаунт заблокирован администратором. Если это ошибка — напишите в поддержку.",
+                reply_markup=keyboards.create_ban_notice_keyboard(_support_url()),
+            )
         except Exception as e:
             await callback.message.answer(f"❌ Не удалось забанить пользователя: {e}")
             return
 
-        user = get_user(user_id) or {}
-        username = user.get('username') or '—'
-        if user.get('username'):
-            uname = user.get('username').lstrip('@')
-            user_tag = f"<a href='https://t.me/{uname}'>@{uname}</a>"
-        else:
-            user_tag = f"<a href='tg://user?id={user_id}'>Профиль</a>"
-        total_spent = user.get('total_spent', 0)
-        balance = user.get('balance', 0)
-        referred_by = user.get('referred_by')
-        keys = get_keys_for_user(user_id)
-        keys_count = len(keys)
-        text = (
-            f"👤 <b>Пользователь {user_id}</b>\n\n"
-            f"Имя пользователя: {user_tag}\n"
-            f"Всего потратил: {float(total_spent):.2f} RUB\n"
-            f"Баланс: {float(balance):.2f} RUB\n"
-            f"Забанен: да\n"
-            f"Приглашён: {referred_by if referred_by else '—'}\n"
-            f"Ключей: {keys_count}"
-        )
-        try:
-            await callback.message.edit_text(
-                text,
-                reply_markup=keyboards.create_admin_user_actions_keyboard(user_id, is_banned=True)
-            )
-        except Exception:
-            pass
+        view = await _user_profile_view(user_id, is_banned=True)
+        if view is not None:
+            try:
+                await _edit_if_changed(callback.message, *view)
+            except TelegramAPIError:
+                pass
 
 
     @admin_router.callback_query(F.data == "admin_admins_menu")
     async def admin_admins_menu_entry(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await callback.message.edit_text(
             "👮 <b>Управление администраторами</b>",
@@ -4965,117 +4752,67 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_view_admins")
     async def admin_view_admins(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids
             ids = list(get_admin_ids() or [])
         except Exception:
             ids = []
+
+        def _admin_line(aid, u) -> str:
+            return f"• ID: {aid} — {_user_tag(aid, u.get('username'))}"
+
         if not ids:
             text = "📋 Список администраторов пуст."
         else:
-            lines = []
-            for aid in ids:
-                try:
-                    u = get_user(int(aid)) or {}
-                except Exception:
-                    u = {}
-                uname = (u.get('username') or '').strip()
-                if uname:
-                    uname_clean = uname.lstrip('@')
-                    tag = f"<a href='https://t.me/{uname_clean}'>@{uname_clean}</a>"
-                else:
-                    tag = f"<a href='tg://user?id={aid}'>Профиль</a>"
-                lines.append(f"• ID: {aid} — {tag}")
-            text = "📋 <b>Администраторы</b>:\n" + "\n".join(lines)
+            # Профили всех админов — одним запросом WHERE telegram_id IN (...)
+            users = await _db(get_users_by_ids, ids)
+            text = "\n".join(["📋 <b>Администраторы</b>:", *(_admin_line(aid, users.get(int(aid), {})) for aid in ids)])
 
-        kb = InlineKeyboardBuilder()
-        kb.button(text="⬅️ Назад", callback_data="admin_admins_menu")
-        kb.button(text="⬅️ В админ-меню", callback_data="admin_menu")
-        kb.adjust(1, 1)
+        kb = keyboards.create_admin_view_admins_keyboard()
         try:
-            await callback.message.edit_text(text, reply_markup=kb.as_markup())
+            await callback.message.edit_text(text, reply_markup=kb)
         except Exception:
-            await callback.message.answer(text, reply_markup=kb.as_markup())
+            await callback.message.answer(text, reply_markup=kb)
 
     @admin_router.callback_query(F.data.startswith("admin_unban_user_"))
     async def admin_unban_user(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
         try:
-            unban_user(user_id)
+            await _db(unban_user, user_id)
             await callback.message.answer(f"✅ Пользователь {user_id} разбанен")
-            try:
-
-                kb = InlineKeyboardBuilder()
-                kb.row(keyboards.get_main_menu_button())
-                await callback.bot.send_message(
-                    user_id,
-                    "✅ Доступ к аккаунту восстановлен администратором.",
-                    reply_markup=kb.as_markup()
-                )
-            except Exception:
-                pass
-        except Exception as e:
-            await callback.message.answer(f"❌ Не удалось разбанить пользователя: {e}")
-            return
-
-        user = get_user(user_id) or {}
-        username = user.get('username') or '—'
-
-        if user.get('username'):
-            uname = user.get('username').lstrip('@')
-            user_tag = f"<a href='https://t.me/{uname}'>@{uname}</a>"
-        else:
-            user_tag = f"<a href='tg://user?id={user_id}'>Профиль</a>"
-        total_spent = user.get('total_spent', 0)
-        balance = user.get('balance', 0)
-        referred_by = user.get('referred_by')
-        keys = get_keys_for_user(user_id)
-        keys_count = len(keys)
-        text = (
-            f"👤 <b>Пользователь {user_id}</b>\n\n"
-            f"Имя пользователя: {user_tag}\n"
-            f"Всего потратил: {float(total_spent):.2f} RUB\n"
-            f"Баланс: {float(balance):.2f} RUB\n"
-            f"Забанен: нет\n"
-            f"Приглашён: {referred_by if referred_by else '—'}\n"
-            f"Ключей: {keys_count}"
-        )
-        try:
-            await callback.message.edit_text(
-                text,
-                reply_markup=keyboards.create_admin_user_actions_keyboard(user_id, is_banned=False)
-            )
-        except Exception:
-            pass
+            _notify(
+                callback.bot,
+                user_id,
+                "✅ Доступ к аккаунту восстановлен администратором.",
+                reply_markup=keyboards.create_unban_notice_keyboard(),
+            )
+        except Exception as e:
+            await callback.message.answer(f"❌ Не удалось разбанить пользователя: {e}")
+            return
+
+        view = await _user_profile_view(user_id, is_banned=False)
+        if view is not None:
+            try:
+                await _edit_if_changed(callback.message, *view)
+            except TelegramAPIError:
+                pass
 
 
 
     @admin_router.callback_query(F.data.startswith("admin_delete_user_"))
     async def admin_delete_user(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
 
         try:
-            success = delete_user_completely(user_id)
+            success = await _db(delete_user_completely, user_id)
         except Exception:
             logger.exception("Failed to delete user %s completely", user_id)
             success = False
@@ -5087,16 +4824,12 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_user_keys_"))
     async def admin_user_keys(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
-        keys = get_keys_for_user(user_id)
+        keys = await _db(get_keys_for_user, user_id)
         await callback.message.edit_text(
             f"🔑 Ключи пользователя {user_id}:",
             reply_markup=keyboards.create_admin_user_keys_keyboard(user_id, keys)
@@ -5104,64 +4837,61 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_user_referrals_"))
     async def admin_user_referrals(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
-        inviter = get_user(user_id)
+        def _ref_earned() -> float:
+            try:
+                return float(get_referral_balance_all(user_id) or 0)
+            except Exception:
+                return 0.0
+
+        inviter, refs, total_ref_earned = await asyncio.gather(
+            _db(get_user, user_id),
+            _db(get_referrals_for_user, user_id),
+            _db(_ref_earned),
+        )
         if not inviter:
             await callback.message.answer("❌ Пользователь не найден")
             return
-        refs = get_referrals_for_user(user_id) or []
+        refs = refs or []
         ref_count = len(refs)
-        try:
-            total_ref_earned = float(get_referral_balance_all(user_id) or 0)
-        except Exception:
-            total_ref_earned = 0.0
 
         max_items = 30
-        lines = []
-        for r in refs[:max_items]:
-            rid = r.get('telegram_id')
-            uname = r.get('username') or '—'
-            rdate = r.get('registration_date') or '—'
-            spent = float(r.get('total_spent') or 0)
-            lines.append(f"• @{uname} (ID: {rid}) — рег: {rdate}, потратил: {spent:.2f} RUB")
-        more_suffix = "\n… и ещё {}".format(ref_count - max_items) if ref_count > max_items else ""
+
+        def _ref_line(r: dict) -> str:
+            g = r.get
+            return (
+                f"• @{g('username') or '—'} (ID: {g('telegram_id')}) — "
+                f"рег: {g('registration_date') or '—'}, потратил: {float(g('total_spent') or 0):.2f} RUB"
+            )
+
+        body = "\n".join(map(_ref_line, refs[:max_items]))
+        more_suffix = f"\n… и ещё {ref_count - max_items}" if ref_count > max_items else ""
         text = (
             f"🤝 <b>Рефералы пользователя {user_id}</b>\n\n"
             f"Всего приглашено: {ref_count}\n"
             f"Заработано по рефералке (всего): {total_ref_earned:.2f} RUB\n\n"
-            + ("\n".join(lines) if lines else "Пока нет рефералов")
+            + (body or "Пока нет рефералов")
             + more_suffix
         )
 
-        kb = InlineKeyboardBuilder()
-        kb.button(text="⬅️ К пользователю", callback_data=f"admin_view_user_{user_id}")
-        kb.button(text="⬅️ В админ-меню", callback_data="admin_menu")
-        kb.adjust(1, 1)
+        kb = keyboards.create_admin_user_referrals_keyboard(user_id)
         try:
-            await callback.message.edit_text(text, reply_markup=kb.as_markup())
+            await callback.message.edit_text(text, reply_markup=kb)
         except Exception:
-            await callback.message.answer(text, reply_markup=kb.as_markup())
+            await callback.message.answer(text, reply_markup=kb)
 
     @admin_router.callback_query(F.data.startswith("admin_edit_key_"))
     async def admin_edit_key(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             await callback.message.answer("❌ Ключ не найден")
             return
@@ -5187,17 +4917,13 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.regexp(r"^admin_key_delete_\d+$"))
     async def admin_key_delete_prompt(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         logger.info(f"Получен запрос на удаление ключа: data='{callback.data}' от {callback.from_user.id}")
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             await callback.message.answer("❌ Ключ не найден")
             return
@@ -5221,17 +4947,12 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_key_extend_"))
     async def admin_key_extend_prompt(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
-        await state.update_data(extend_key_id=key_id)
-        await state.set_state(AdminExtendSingleKey.waiting_days)
+        await _advance(state, AdminExtendSingleKey.waiting_days, extend_key_id=key_id)
         await callback.message.edit_text(
             f"Укажите, на сколько дней продлить ключ #{key_id} (число):",
             reply_markup=keyboards.create_admin_cancel_keyboard()
@@ -5239,8 +4960,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminExtendSingleKey.waiting_days)
     async def admin_key_extend_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         key_id = int(data.get("extend_key_id", 0))
         if not key_id:
@@ -5255,7 +4974,7 @@ def get_admin_router() -> Router:
         if days <= 0:
             await message.answer("❌ Дней должно быть положительное число")
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             await message.answer("❌ Ключ не найден")
             await state.clear()
@@ -5276,16 +4995,17 @@ def get_admin_router() -> Router:
             await message.answer("❌ Не удалось продлить ключ на сервере")
             return
 
-        if not rw_repo.update_key(
+        new_key = await _db(
+            rw_repo.update_key,
             key_id,
             remnawave_user_uuid=resp['client_uuid'],
             expire_at_ms=int(resp['expiry_timestamp_ms']),
-        ):
+        )
+        if not new_key:
             await message.answer("❌ Не удалось обновить информацию о ключе.")
             return
         await state.clear()
 
-        new_key = rw_repo.get_key_by_id(key_id)
         text = (
             f"🔑 <b>Ключ #{key_id}</b>\n"
             f"Хост: {new_key.get('host_name') or '—'}\n"
@@ -5293,7 +5013,7 @@ def get_admin_router() -> Router:
             f"Истекает: {new_key.get('expiry_date') or '—'}\n"
         )
         await message.answer(f"✅ Ключ продлён на {days} дн.")
-        await message.answer(text, reply_markup=keyboards.create_admin_key_actions_keyboard(key_id, int(new_key.get('user_id')) if new_key and new_key.get('user_id') else None))
+        await message.answer(text, reply_markup=keyboards.create_admin_key_actions_keyboard(key_id, int(new_key.get('user_id')) if new_key.get('user_id') else None))
 
 
     class AdminAddAdmin(StatesGroup):
@@ -5301,9 +5021,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_add_admin")
     async def admin_add_admin_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminAddAdmin.waiting_for_input)
         await callback.message.edit_text(
@@ -5314,8 +5031,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminAddAdmin.waiting_for_input)
     async def admin_add_admin_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         target_id: int | None = None
 
@@ -5326,44 +5041,16 @@ def get_admin_router() -> Router:
                 target_id = None
 
         if target_id is None and raw.startswith('@'):
-            uname = raw.lstrip('@')
-
-            try:
-                chat = await message.bot.get_chat(raw)
-                target_id = int(chat.id)
-            except Exception:
-                target_id = None
-
-            if target_id is None:
-                try:
-                    chat = await message.bot.get_chat(uname)
-                    target_id = int(chat.id)
-                except Exception:
-                    target_id = None
-
-            if target_id is None:
-                try:
-                    users = get_all_users() or []
-                    uname_low = uname.lower()
-                    for u in users:
-                        u_un = (u.get('username') or '').lstrip('@').lower()
-                        if u_un and u_un == uname_low:
-                            target_id = int(u.get('telegram_id') or u.get('user_id') or u.get('id'))
-                            break
-                except Exception:
-                    target_id = None
+            target_id = await _resolve_username_id(message.bot, raw)
         if target_id is None:
             await message.answer("❌ Не удалось распознать ID/username. Отправьте корректное значение или нажмите Отмена.")
             return
 
         try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids, update_setting
-            ids = set(get_admin_ids())
-            ids.add(int(target_id))
-
-            ids_str = ",".join(str(i) for i in sorted(ids))
-            update_setting("admin_telegram_ids", ids_str)
-            await message.answer(f"✅ Пользователь {target_id} добавлен в администраторы.")
+            if await _db(rw_repo.add_admin_id, target_id):
+                await message.answer(f"✅ Пользователь {target_id} добавлен в администраторы.")
+            else:
+                await message.answer(f"ℹ️ Пользователь {target_id} уже является администратором.")
         except Exception as e:
             await message.answer(f"❌ Ошибка при сохранении: {e}")
         await state.clear()
@@ -5379,9 +5066,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_remove_admin")
     async def admin_remove_admin_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminRemoveAdmin.waiting_for_input)
         await callback.message.edit_text(
@@ -5392,8 +5076,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminRemoveAdmin.waiting_for_input)
     async def admin_remove_admin_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         raw = (message.text or '').strip()
         target_id: int | None = None
 
@@ -5404,39 +5086,13 @@ def get_admin_router() -> Router:
                 target_id = None
 
         if target_id is None:
-            uname = raw.lstrip('@')
-
-            try:
-                chat = await message.bot.get_chat(raw)
-                target_id = int(chat.id)
-            except Exception:
-                target_id = None
-
-            if target_id is None and uname:
-                try:
-                    chat = await message.bot.get_chat(uname)
-                    target_id = int(chat.id)
-                except Exception:
-                    target_id = None
-
-            if target_id is None and uname:
-                try:
-                    users = get_all_users() or []
-                    uname_low = uname.lower()
-                    for u in users:
-                        u_un = (u.get('username') or '').lstrip('@').lower()
-                        if u_un and u_un == uname_low:
-                            target_id = int(u.get('telegram_id') or u.get('user_id') or u.get('id'))
-                            break
-                except Exception:
-                    target_id = None
+            target_id = await _resolve_username_id(message.bot, raw)
         if target_id is None:
             await message.answer("❌ Не удалось распознать ID/username. Отправьте корректное значение или нажмите Отмена.")
             return
 
         try:
-            from shop_bot.data_manager.remnawave_repository import get_admin_ids, update_setting
-            ids = set(get_admin_ids())
+            ids = set(await _db(get_admin_ids))
             if target_id not in ids:
                 await message.answer(f"ℹ️ Пользователь {target_id} не является администратором.")
                 await state.clear()
@@ -5448,10 +5104,14 @@ def get_admin_router() -> Router:
             if len(ids) <= 1:
                 await message.answer("❌ Нельзя снять последнего администратора.")
                 return
-            ids.discard(int(target_id))
-            ids_str = ",".join(str(i) for i in sorted(ids))
-            update_setting("admin_telegram_ids", ids_str)
-            await message.answer(f"✅ Пользователь {target_id} снят с администраторов.")
+            if await _db(rw_repo.remove_admin_id, target_id):
+                await message.answer(f"✅ Пользователь {target_id} снят с администраторов.")
+            else:
+                # В списке админов, но не в bot_admins — это основной админ из admin_telegram_id
+                await message.answer(
+                    f"❌ Пользователь {target_id} — основной администратор (admin_telegram_id). "
+                    "Его можно сменить только в настройках панели."
+                )
         except Exception as e:
             await message.answer(f"❌ Ошибка при сохранении: {e}")
         await state.clear()
@@ -5464,19 +5124,15 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_key_delete_cancel_"))
     async def admin_key_delete_cancel(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         try:
             await callback.answer("Отменено")
         except Exception:
             pass
         logger.info(f"Получена отмена удаления ключа: data='{callback.data}' от {callback.from_user.id}")
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             return
         text = (
@@ -5500,21 +5156,17 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_key_delete_confirm_"))
     async def admin_key_delete_confirm(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         try:
             await callback.answer("Удаляю…")
         except Exception:
             pass
         logger.info(f"Получено подтверждение удаления ключа: data='{callback.data}' от {callback.from_user.id}")
-        try:
-            key_id = int(callback.data.split('_')[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
         try:
-            key = rw_repo.get_key_by_id(key_id)
+            key = await _db(rw_repo.get_key_by_id, key_id)
         except Exception as e:
             logger.error(f"БД get_key_by_id не удался для #{key_id}: {e}")
             key = None
@@ -5529,22 +5181,29 @@ def get_admin_router() -> Router:
             return
         host = key.get('host_name')
         email = key.get('key_email')
-        ok_host = True
-        if host and email:
+
+        async def _delete_on_host() -> bool:
+            if not (host and email):
+                return True
             try:
-                ok_host = await delete_client_on_host(host, email)
+                return await delete_client_on_host(host, email)
             except Exception as e:
-                ok_host = False
                 logger.error(f"Не удалось удалить клиента на хосте '{host}' для ключа #{key_id}: {e}")
-        ok_db = False
-        try:
-            ok_db = delete_key_by_email(email)
-        except Exception as e:
-            logger.error(f"Не удалось удалить ключ в БД для email '{email}': {e}")
+                return False
+
+        def _delete_in_db() -> bool:
+            try:
+                return delete_key_by_email(email)
+            except Exception as e:
+                logger.error(f"Не удалось удалить ключ в БД для email '{email}': {e}")
+                return False
+
+        # Удаление на хосте (HTTP) и в БД независимы — ждём только самое долгое
+        ok_host, ok_db = await asyncio.gather(_delete_on_host(), _db(_delete_in_db))
         if ok_db:
             await callback.message.answer("✅ Ключ удалён" + (" (с хоста тоже)" if ok_host else " (но удалить на хосте не удалось)"))
 
-            keys = get_keys_for_user(user_id)
+            keys = await _db(get_keys_for_user, user_id)
             try:
                 await callback.message.edit_text(
                     f"🔑 Ключи пользователя {user_id}:",
@@ -5557,14 +5216,12 @@ def get_admin_router() -> Router:
                     reply_markup=keyboards.create_admin_user_keys_keyboard(user_id, keys)
                 )
 
-            try:
-                await callback.bot.send_message(
-                    user_id,
-                    "ℹ️ Администратор удалил один из ваших ключей. Если это ошибка — напишите в поддержку.",
-                    reply_markup=keyboards.create_support_keyboard()
-                )
-            except Exception:
-                pass
+            _notify(
+                callback.bot,
+                user_id,
+                "ℹ️ Администратор удалил один из ваших ключей. Если это ошибка — напишите в поддержку.",
+                reply_markup=keyboards.create_support_keyboard(),
+            )
         else:
             await callback.message.answer("❌ Не удалось удалить ключ из базы данных")
 
@@ -5573,17 +5230,12 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_key_edit_email_"))
     async def admin_key_edit_email_start(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
-        await state.update_data(edit_key_id=key_id)
-        await state.set_state(AdminEditKeyEmail.waiting_for_email)
+        await _advance(state, AdminEditKeyEmail.waiting_for_email, edit_key_id=key_id)
         await callback.message.edit_text(
             f"Введите новый email для ключа #{key_id}",
             reply_markup=keyboards.create_admin_cancel_keyboard()
@@ -5591,15 +5243,13 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminEditKeyEmail.waiting_for_email)
     async def admin_key_edit_email_commit(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         data = await state.get_data()
         key_id = int(data.get('edit_key_id'))
         new_email = (message.text or '').strip()
         if not new_email:
             await message.answer("❌ Введите корректный email")
             return
-        ok = update_key_email(key_id, new_email)
+        ok = await _db(update_key_email, key_id, new_email)
         if ok:
             await message.answer("✅ Email обновлён")
         else:
@@ -5616,68 +5266,34 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_gift_key")
     async def admin_gift_key_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        users = get_all_users()
         await state.clear()
         await state.set_state(AdminGiftKey.picking_user)
         await callback.message.edit_text(
-            "🎁 Выдача подарочного ключа\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=0, action="gift")
+            _USER_PICK_TITLES["gift"],
+            reply_markup=await _users_pick_markup(0, "gift")
         )
 
 
     @admin_router.callback_query(F.data.startswith("admin_gift_key_"))
     async def admin_gift_key_for_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
+        user_id = _tail_id(callback.data)
+        if user_id is None:
             await callback.message.answer("❌ Неверный формат user_id")
             return
         await state.clear()
         await state.update_data(target_user_id=user_id)
-        hosts = get_all_hosts()
+        hosts = await _cached_hosts()
         await state.set_state(AdminGiftKey.picking_host)
         await callback.message.edit_text(
             f"👤 Пользователь {user_id}. Выберите сервер:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="gift")
         )
 
-    @admin_router.callback_query(AdminGiftKey.picking_user, F.data.startswith("admin_gift_pick_user_page_"))
-    async def admin_gift_pick_user_page(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            page = int(callback.data.split("_")[-1])
-        except Exception:
-            page = 0
-        users = get_all_users()
-        await callback.message.edit_text(
-            "🎁 Выдача подарочного ключа\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=page, action="gift")
-        )
-
-    @admin_router.callback_query(AdminGiftKey.picking_user, F.data.startswith("admin_gift_pick_user_"))
-    async def admin_gift_pick_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
-            await callback.message.answer("❌ Неверный формат user_id")
-            return
+    async def _gift_user_picked(callback: types.CallbackQuery, state: FSMContext, user_id: int):
         await state.update_data(target_user_id=user_id)
-        hosts = get_all_hosts()
+        hosts = await _cached_hosts()
         await state.set_state(AdminGiftKey.picking_host)
         await callback.message.edit_text(
             f"👤 Пользователь {user_id}. Выберите сервер:",
@@ -5686,26 +5302,18 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminGiftKey.picking_host, F.data == "admin_gift_back_to_users")
     async def admin_gift_back_to_users(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        users = get_all_users()
         await state.set_state(AdminGiftKey.picking_user)
         await callback.message.edit_text(
-            "🎁 Выдача подарочного ключа\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=0, action="gift")
+            _USER_PICK_TITLES["gift"],
+            reply_markup=await _users_pick_markup(0, "gift")
         )
 
     @admin_router.callback_query(AdminGiftKey.picking_host, F.data.startswith("admin_gift_pick_host_"))
     async def admin_gift_pick_host(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         host_name = callback.data.split("admin_gift_pick_host_")[-1]
-        await state.update_data(host_name=host_name)
-        await state.set_state(AdminGiftKey.picking_days)
+        await _advance(state, AdminGiftKey.picking_days, host_name=host_name)
         await callback.message.edit_text(
             f"🌍 Сервер: {host_name}. Введите срок действия ключа в днях (целое число):",
             reply_markup=keyboards.create_admin_cancel_keyboard()
@@ -5713,23 +5321,18 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminGiftKey.picking_days, F.data == "admin_gift_back_to_hosts")
     async def admin_gift_back_to_hosts(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         data = await state.get_data()
         user_id = int(data.get('target_user_id'))
-        hosts = get_all_hosts()
+        hosts = await _cached_hosts()
         await state.set_state(AdminGiftKey.picking_host)
         await callback.message.edit_text(
             f"👤 Пользователь {user_id}. Выберите сервер:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="gift")
         )
-    @admin_router.message(AdminGiftKey.picking_days)
-    async def admin_gift_pick_days(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        data = await state.get_data()
+    @admin_router.message(AdminGiftKey.picking_days, flags={"fsm_data": True})
+    async def admin_gift_pick_days(message: types.Message, state: FSMContext, fsm_data: dict):
+        data = fsm_data
         user_id = int(data.get('target_user_id'))
         host_name = data.get('host_name')
         try:
@@ -5741,47 +5344,53 @@ def get_admin_router() -> Router:
             await message.answer("❌ Срок должен быть положительным")
             return
 
-        user = get_user(user_id) or {}
+        user = await _db(get_user, user_id) or {}
         username = (user.get('username') or f'user{user_id}').lower()
-        username_slug = re.sub(r"[^a-z0-9._-]", "_", username).strip("_")[:16] or f"user{user_id}"
+        username_slug = _SLUG_RE.sub("_", username).strip("_")[:16] or f"user{user_id}"
         base_local = f"gift_{username_slug}"
-        candidate_local = base_local
-        attempt = 1
-        while True:
-            candidate_email = f"{candidate_local}@bot.local"
-            existing = rw_repo.get_key_by_email(candidate_email)
-            if not existing:
-                break
-            attempt += 1
-            candidate_local = f"{base_local}-{attempt}"
-            if attempt > 100:
-                candidate_local = f"{base_local}-{int(time.time())}"
-                candidate_email = f"{candidate_local}@bot.local"
-                break
-        generated_email = candidate_email
-
-
-        try:
-            host_resp = await create_or_update_key_on_host(host_name, generated_email, days_to_add=days)
+        # Занятые gift_<slug>[-N]@bot.local — одним запросом, а не get_key_by_email на каждый N
+        taken = await _db(rw_repo.get_key_emails_with_prefix, base_local)
+        candidates = (f"{local}@bot.local" for local in (base_local, *(f"{base_local}-{n}" for n in range(2, 101))))
+        generated_email = next(
+            (email for email in candidates if email not in taken),
+            f"{base_local}-{int(time.time())}@bot.local",
+        )
+
+        # Запрос к панели может идти секунды — отвечаем сразу, остальное в фоне
+        await state.clear()
+        placeholder = await message.answer("🎁 Создаю ключ на сервере…")
+        _fire(_host_task(
+            _issue_gift_key(message, placeholder, user_id, user, host_name, days, generated_email),
+            placeholder,
+            f"❌ Ошибка при выдаче ключа {generated_email}. Проверьте панель Remnawave, подробности в логе.",
+        ))
+
+    async def _issue_gift_key(message: types.Message, placeholder: types.Message, user_id: int, user: dict,
+                              host_name: str, days: int, generated_email: str):
+        try:
+            async with _HOST_CALLS:
+                host_resp = await create_or_update_key_on_host(host_name, generated_email, days_to_add=days)
         except Exception as e:
             host_resp = None
             logging.error(f"Gift flow: failed to create client on host '{host_name}' for user {user_id}: {e}")
 
         if not host_resp or not host_resp.get("client_uuid") or not host_resp.get("expiry_timestamp_ms"):
-            await message.answer("❌ Не удалось выдать ключ на сервере. Проверьте настройки хоста и доступность панели Remnawave.")
-            await state.clear()
+            await placeholder.edit_text("❌ Не удалось выдать ключ на сервере. Проверьте настройки хоста и доступность панели Remnawave.")
             await show_admin_menu(message)
             return
 
-        client_uuid = host_resp["client_uuid"]
-        expiry_ms = int(host_resp["expiry_timestamp_ms"])
         connection_link = host_resp.get("connection_string")
 
-        key_id = rw_repo.record_key_from_payload(
-            user_id=user_id,
-            payload=host_resp,
-            host_name=host_name,
-        )
+        try:
+            key_id = await _db(
+                rw_repo.record_key_from_payload,
+                user_id=user_id,
+                payload=host_resp,
+                host_name=host_name,
+            )
+        except Exception:
+            logger.exception(f"Gift flow: key {generated_email} created on host '{host_name}' but not saved")
+            key_id = None
         if key_id:
             username_readable = (user.get('username') or '').strip()
             user_part = f"{user_id} (@{username_readable})" if username_readable else f"{user_id}"
@@ -5789,22 +5398,20 @@ def get_admin_router() -> Router:
                 f"✅ 🎁 Подарочный ключ #{key_id} выдан пользователю {user_part} (сервер: {host_name}, {days} дн.)\n"
                 f"Email: {generated_email}"
             )
-            await message.answer(text_admin)
-            try:
-                notify_text = (
-                    f"🎁 Администратор выдал вам подарочный ключ #{key_id}\n"
-                    f"Сервер: {host_name}\n"
-                    f"Срок: {days} дн.\n"
-                )
-                if connection_link:
-                    cs = html_escape.escape(connection_link)
-                    notify_text += f"\n🔗 Подписка:\n<pre><code>{cs}</code></pre>"
-                await message.bot.send_message(user_id, notify_text, parse_mode='HTML', disable_web_page_preview=True)
-            except Exception:
-                pass
+            await placeholder.edit_text(text_admin)
+            notify_text = (
+                f"🎁 Администратор выдал вам подарочный ключ #{key_id}\n"
+                f"Сервер: {host_name}\n"
+                f"Срок: {days} дн.\n"
+            )
+            if connection_link:
+                cs = connection_link.translate(_HTML_TRANS)
+                notify_text += f"\n🔗 Подписка:\n<pre><code>{cs}</code></pre>"
+            _notify(message.bot, user_id, notify_text, parse_mode='HTML', disable_web_page_preview=True)
         else:
-            await message.answer("❌ Не удалось сохранить ключ в базе данных.")
-        await state.clear()
+            await placeholder.edit_text(
+                f"❌ Ключ {generated_email} создан на сервере {host_name}, но не сохранён в базе данных."
+            )
         await show_admin_menu(message)
 
 
@@ -5816,78 +5423,27 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_add_balance")
     async def admin_add_balance_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        users = get_all_users()
         await callback.message.edit_text(
-            "➕ Начисление баланса\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=0, action="add_balance")
+            _USER_PICK_TITLES["add_balance"],
+            reply_markup=await _users_pick_markup(0, "add_balance")
         )
 
-    @admin_router.callback_query(F.data.startswith("admin_add_balance_"))
-    async def admin_add_balance_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
-            await callback.message.answer("❌ Неверный формат user_id")
-            return
-        await state.update_data(target_user_id=user_id)
-        await state.set_state(AdminMainRefill.waiting_for_amount)
+    async def _add_balance_user_picked(callback: types.CallbackQuery, state: FSMContext, user_id: int):
+        await _advance(state, AdminMainRefill.waiting_for_amount, target_user_id=user_id)
         await callback.message.edit_text(
             f"Пользователь {user_id}. Введите сумму начисления (в рублях):",
             reply_markup=keyboards.create_admin_cancel_keyboard()
         )
 
 
-    @admin_router.callback_query(F.data.startswith("admin_add_balance_pick_user_page_"))
-    async def admin_add_balance_pick_user_page(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            page = int(callback.data.split("_")[-1])
-        except Exception:
-            page = 0
-        users = get_all_users()
-        await callback.message.edit_text(
-            "➕ Начисление баланса\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=page, action="add_balance")
-        )
-
-
-    @admin_router.callback_query(F.data.startswith("admin_add_balance_pick_user_"))
-    async def admin_add_balance_pick_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
-            await callback.message.answer("❌ Неверный формат user_id")
-            return
-        await state.update_data(target_user_id=user_id)
-        await state.set_state(AdminMainRefill.waiting_for_amount)
-        await callback.message.edit_text(
-            f"Пользователь {user_id}. Введите сумму начисления (в рублях):",
-            reply_markup=keyboards.create_admin_cancel_keyboard()
-        )
 
-    @admin_router.message(AdminMainRefill.waiting_for_amount)
-    async def handle_main_amount(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        data = await state.get_data()
+    @admin_router.message(AdminMainRefill.waiting_for_amount, flags={"fsm_data": True})
+    async def handle_main_amount(message: types.Message, state: FSMContext, fsm_data: dict):
+        data = fsm_data
         user_id = int(data.get('target_user_id'))
         try:
-            amount = float(message.text.strip().replace(',', '.'))
+            amount = float(message.text.strip().translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число — сумму в рублях")
             return
@@ -5898,10 +5454,7 @@ def get_admin_router() -> Router:
             ok = add_to_balance(user_id, amount)
             if ok:
                 await message.answer(f"✅ Начислено {amount:.2f} RUB на баланс пользователю {user_id}")
-                try:
-                    await message.bot.send_message(user_id, f"💰 Вам начислено {amount:.2f} RUB на баланс администратором.")
-                except Exception:
-                    pass
+                _notify(message.bot, user_id, f"💰 Вам начислено {amount:.2f} RUB на баланс администратором.")
             else:
                 await message.answer("❌ Пользователь не найден или ошибка БД")
         except Exception as e:
@@ -5912,16 +5465,12 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("admin_key_back_"))
     async def admin_key_back(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            key_id = int(callback.data.split("_")[-1])
-        except Exception:
+        key_id = _tail_id(callback.data)
+        if key_id is None:
             await callback.message.answer("❌ Неверный формат key_id")
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             await callback.message.answer("❌ Ключ не найден")
             return
@@ -5935,14 +5484,13 @@ def get_admin_router() -> Router:
 
         if host_from_state:
             host_name = host_from_state
-            keys = get_keys_for_host(host_name)
             await callback.message.edit_text(
                 f"🔑 Ключи на хосте {host_name}:",
-                reply_markup=keyboards.create_admin_keys_for_host_keyboard(host_name, keys)
+                reply_markup=await _host_keys_markup(host_name)
             )
         else:
             user_id = int(key.get('user_id'))
-            keys = get_keys_for_user(user_id)
+            keys = await _db(get_keys_for_user, user_id)
             await callback.message.edit_text(
                 f"🔑 Ключи пользователя {user_id}:",
                 reply_markup=keyboards.create_admin_user_keys_keyboard(user_id, keys)
@@ -5956,6 +5504,9 @@ def get_admin_router() -> Router:
     @admin_router.callback_query(F.data == "admin_cancel")
     async def admin_cancel_handler(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("Отменено")
+        stale = _plan_prefetch.pop(callback.from_user.id, None)
+        if stale:
+            stale[2].cancel()
         await state.clear()
         await show_admin_menu(callback.message, edit_message=True)
 
@@ -5966,79 +5517,26 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_deduct_balance")
     async def admin_deduct_balance_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        users = get_all_users()
-        await callback.message.edit_text(
-            "➖ Списание баланса\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=0, action="deduct_balance")
-        )
-
-
-    @admin_router.callback_query(F.data.startswith("admin_deduct_balance_"))
-    async def admin_deduct_balance_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
-            await callback.message.answer("❌ Неверный формат user_id")
-            return
-        await state.update_data(target_user_id=user_id)
-        await state.set_state(AdminMainDeduct.waiting_for_amount)
-        await callback.message.edit_text(
-            f"Пользователь {user_id}. Введите сумму списания (в рублях):",
-            reply_markup=keyboards.create_admin_cancel_keyboard()
-        )
-
-
-    @admin_router.callback_query(F.data.startswith("admin_deduct_balance_pick_user_page_"))
-    async def admin_deduct_balance_pick_user_page(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            page = int(callback.data.split("_")[-1])
-        except Exception:
-            page = 0
-        users = get_all_users()
         await callback.message.edit_text(
-            "➖ Списание баланса\n\nВыберите пользователя:",
-            reply_markup=keyboards.create_admin_users_pick_keyboard(users, page=page, action="deduct_balance")
+            _USER_PICK_TITLES["deduct_balance"],
+            reply_markup=await _users_pick_markup(0, "deduct_balance")
         )
 
 
-    @admin_router.callback_query(F.data.startswith("admin_deduct_balance_pick_user_"))
-    async def admin_deduct_balance_pick_user(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
-        await callback.answer()
-        try:
-            user_id = int(callback.data.split("_")[-1])
-        except Exception:
-            await callback.message.answer("❌ Неверный формат user_id")
-            return
-        await state.update_data(target_user_id=user_id)
-        await state.set_state(AdminMainDeduct.waiting_for_amount)
+    async def _deduct_balance_user_picked(callback: types.CallbackQuery, state: FSMContext, user_id: int):
+        await _advance(state, AdminMainDeduct.waiting_for_amount, target_user_id=user_id)
         await callback.message.edit_text(
             f"Пользователь {user_id}. Введите сумму списания (в рублях):",
             reply_markup=keyboards.create_admin_cancel_keyboard()
         )
 
-    @admin_router.message(AdminMainDeduct.waiting_for_amount)
-    async def handle_deduct_amount(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
-        data = await state.get_data()
+    @admin_router.message(AdminMainDeduct.waiting_for_amount, flags={"fsm_data": True})
+    async def handle_deduct_amount(message: types.Message, state: FSMContext, fsm_data: dict):
+        data = fsm_data
         user_id = int(data.get('target_user_id'))
         try:
-            amount = float(message.text.strip().replace(',', '.'))
+            amount = float(message.text.strip().translate(_NUM_TRANS))
         except Exception:
             await message.answer("❌ Введите число — сумму в рублях")
             return
@@ -6049,14 +5547,12 @@ def get_admin_router() -> Router:
             ok = deduct_from_balance(user_id, amount)
             if ok:
                 await message.answer(f"✅ Списано {amount:.2f} RUB с баланса пользователя {user_id}")
-                try:
-                    await message.bot.send_message(
-                        user_id,
-                        f"➖ С вашего баланса списано {amount:.2f} RUB администратором.\nЕсли это ошибка — напишите в поддержку.",
-                        reply_markup=keyboards.create_support_keyboard()
-                    )
-                except Exception:
-                    pass
+                _notify(
+                    message.bot,
+                    user_id,
+                    f"➖ С вашего баланса списано {amount:.2f} RUB администратором.\nЕсли это ошибка — напишите в поддержку.",
+                    reply_markup=keyboards.create_support_keyboard(),
+                )
             else:
                 await message.answer("❌ Пользователь не найден или недостаточно средств")
         except Exception as e:
@@ -6065,18 +5561,37 @@ def get_admin_router() -> Router:
         await show_admin_menu(message)
 
 
+    _USER_PICKED = {
+        "gift": _gift_user_picked,
+        "add_balance": _add_balance_user_picked,
+        "deduct_balance": _deduct_balance_user_picked,
+    }
+
+    @admin_router.callback_query(F.data.regexp(_USER_PICK_RE).as_("match"))
+    async def admin_user_picker(callback: types.CallbackQuery, state: FSMContext, match: re.Match):
+        await callback.answer()
+        action, is_page, value = match.groups()
+        # Пикер подарка живёт только внутри мастера выдачи
+        if action == "gift" and await state.get_state() != AdminGiftKey.picking_user.state:
+            return
+        if is_page:
+            await callback.message.edit_text(
+                _USER_PICK_TITLES[action],
+                reply_markup=await _users_pick_markup(int(value), action)
+            )
+        else:
+            await _USER_PICKED[action](callback, state, int(value))
+
+
     class AdminHostKeys(StatesGroup):
         picking_host = State()
 
     @admin_router.callback_query(F.data == "admin_host_keys")
     async def admin_host_keys_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.clear()
         await state.set_state(AdminHostKeys.picking_host)
-        hosts = get_all_hosts()
+        hosts = await _cached_hosts()
         await callback.message.edit_text(
             "🌍 Выберите хост для просмотра ключей:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="hostkeys")
@@ -6084,9 +5599,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(AdminHostKeys.picking_host, F.data.startswith("admin_hostkeys_pick_host_"))
     async def admin_host_keys_pick_host(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         host_name = callback.data.split("admin_hostkeys_pick_host_")[-1]
 
@@ -6094,50 +5606,39 @@ def get_admin_router() -> Router:
             await state.update_data(hostkeys_host=host_name)
         except Exception:
             pass
-        keys = get_keys_for_host(host_name)
         await callback.message.edit_text(
             f"🔑 Ключи на хосте {host_name}:",
-            reply_markup=keyboards.create_admin_keys_for_host_keyboard(host_name, keys)
+            reply_markup=await _host_keys_markup(host_name)
         )
 
     @admin_router.callback_query(AdminHostKeys.picking_host, F.data.startswith("admin_hostkeys_page_"))
     async def admin_hostkeys_page(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
-        try:
-            page = int(callback.data.split("_")[-1])
-        except Exception:
-            page = 0
+        page = _tail_id(callback.data) or 0
         data = await state.get_data()
         host_name = data.get('hostkeys_host')
         if not host_name:
 
-            hosts = get_all_hosts()
+            hosts = await _cached_hosts()
             await callback.message.edit_text(
                 "🌍 Выберите хост для просмотра ключей:",
                 reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="hostkeys")
             )
             return
-        keys = get_keys_for_host(host_name)
         await callback.message.edit_text(
             f"🔑 Ключи на хосте {host_name}:",
-            reply_markup=keyboards.create_admin_keys_for_host_keyboard(host_name, keys, page=page)
+            reply_markup=await _host_keys_markup(host_name, page)
         )
 
     @admin_router.callback_query(AdminHostKeys.picking_host, F.data == "admin_hostkeys_back_to_hosts")
     async def admin_hostkeys_back_to_hosts(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
 
         try:
             await state.update_data(hostkeys_host=None)
         except Exception:
             pass
-        hosts = get_all_hosts()
+        hosts = await _cached_hosts()
         await callback.message.edit_text(
             "🌍 Выберите хост для просмотра ключей:",
             reply_markup=keyboards.create_admin_hosts_pick_keyboard(hosts, action="hostkeys")
@@ -6145,9 +5646,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_hostkeys_back_to_users")
     async def admin_hostkeys_back_to_users(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await show_admin_menu(callback.message, edit_message=True)
 
@@ -6157,9 +5655,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_delete_key")
     async def admin_delete_key_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminQuickDeleteKey.waiting_for_identifier)
         await callback.message.edit_text(
@@ -6169,17 +5664,15 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminQuickDeleteKey.waiting_for_identifier)
     async def admin_delete_key_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         text = (message.text or '').strip()
         key = None
 
         try:
             key_id = int(text)
-            key = rw_repo.get_key_by_id(key_id)
+            key = await _db(rw_repo.get_key_by_id, key_id)
         except Exception:
 
-            key = rw_repo.get_key_by_email(text)
+            key = await _db(rw_repo.get_key_by_email, text)
         if not key:
             await message.answer("❌ Ключ не найден. Пришлите корректный key_id или email.")
             return
@@ -6198,9 +5691,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_extend_key")
     async def admin_extend_key_entry(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await state.set_state(AdminExtendKey.waiting_for_pair)
         await callback.message.edit_text(
@@ -6210,8 +5700,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(AdminExtendKey.waiting_for_pair)
     async def admin_extend_key_process(message: types.Message, state: FSMContext):
-        if not is_admin(message.from_user.id):
-            return
         parts = (message.text or '').strip().split()
         if len(parts) != 2:
             await message.answer("❌ Формат: <code>key_id дни</code>")
@@ -6225,7 +5713,7 @@ def get_admin_router() -> Router:
         if days <= 0:
             await message.answer("❌ Количество дней должно быть положительным")
             return
-        key = rw_repo.get_key_by_id(key_id)
+        key = await _db(rw_repo.get_key_by_id, key_id)
         if not key:
             await message.answer("❌ Ключ не найден")
             return
@@ -6235,35 +5723,43 @@ def get_admin_router() -> Router:
             await message.answer("❌ У ключа отсутствуют данные о хосте или email")
             return
 
+        # Состояние сбрасываем до фоновой задачи: повторное сообщение не запустит
+        # второе продление, а задача не затрёт новый сценарий админа
+        await state.clear()
+        placeholder = await message.answer(f"⏳ Продлеваю ключ #{key_id}…")
+        _fire(_host_task(
+            _extend_key_on_host(message, placeholder, key, days),
+            placeholder,
+            f"❌ Ошибка при продлении ключа #{key_id}, подробности в логе.",
+        ))
+
+    async def _extend_key_on_host(message: types.Message, placeholder: types.Message, key: dict, days: int):
+        key_id = int(key['key_id'])
+        host = key.get('host_name')
+        email = key.get('key_email')
         resp = None
         try:
-            resp = await create_or_update_key_on_host(host, email, days_to_add=days)
+            async with _HOST_CALLS:
+                resp = await create_or_update_key_on_host(host, email, days_to_add=days)
         except Exception as e:
             logger.error(f"Поток продления: не удалось обновить клиента на хосте '{host}' для ключа #{key_id}: {e}")
         if not resp or not resp.get('client_uuid') or not resp.get('expiry_timestamp_ms'):
-            await message.answer("❌ Не удалось продлить ключ на сервере")
+            await placeholder.edit_text("❌ Не удалось продлить ключ на сервере")
             return
 
-        if not rw_repo.update_key(
+        if not await _db(
+            rw_repo.update_key,
             key_id,
             remnawave_user_uuid=resp['client_uuid'],
             expire_at_ms=int(resp['expiry_timestamp_ms']),
         ):
-            await message.answer("❌ Не удалось обновить информацию о ключе.")
+            await placeholder.edit_text("❌ Не удалось обновить информацию о ключе.")
             return
-        await state.clear()
-        await message.answer(f"✅ Ключ #{key_id} продлён на {days} дн.")
-
-        try:
-            await message.bot.send_message(int(key.get('user_id')), f"ℹ️ Администратор продлил ваш ключ #{key_id} на {days} дн.")
-        except Exception:
-            pass
+        await placeholder.edit_text(f"✅ Ключ #{key_id} продлён на {days} дн.")
+        _notify(message.bot, int(key.get('user_id')), f"ℹ️ Администратор продлил ваш ключ #{key_id} на {days} дн.")
 
     @admin_router.callback_query(F.data == "start_broadcast")
     async def start_broadcast_handler(callback: types.CallbackQuery, state: FSMContext):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("У вас нет прав.", show_alert=True)
-            return
         await callback.answer()
         await callback.message.edit_text(
             "Пришлите сообщение, которое вы хотите разослать всем пользователям.\n"
@@ -6401,7 +5897,7 @@ def get_admin_router() -> Router:
 
         await state.clear()
 
-        users = get_all_users()
+        users = await _db(get_all_users)
         logger.info(f"Рассылка: Начинаем итерацию по {len(users)} пользователям.")
 
         sent_count = 0
@@ -6443,11 +5939,9 @@ def get_admin_router() -> Router:
 
     @admin_router.message(Command(commands=["approve_withdraw"]))
     async def approve_withdraw_handler(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
         try:
             user_id = int(message.text.split("_")[-1])
-            user = get_user(user_id)
+            user = await _db(get_user, user_id)
             balance = user.get('referral_balance', 0)
             if balance < 100:
                 await message.answer("Баланс пользователя менее 100 руб.")
@@ -6464,8 +5958,6 @@ def get_admin_router() -> Router:
 
     @admin_router.message(Command(commands=["decline_withdraw"]))
     async def decline_withdraw_handler(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
         try:
             user_id = int(message.text.split("_")[-1])
             await message.answer(f"❌ Заявка пользователя {user_id} отклонена.")
@@ -6479,9 +5971,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_monitor")
     async def admin_monitor_menu(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Доступ только для админов", show_alert=True)
-            return
         try:
             hosts = get_all_hosts() or []
             targets = get_all_ssh_targets() or []
@@ -6513,10 +6002,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_monitor_local")
     async def admin_monitor_local(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Доступ только для админов", show_alert=True)
-            return
-        
         await callback.answer("🔄 Получение данных...")
         
 
@@ -6684,10 +6169,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("rmh:"))
     async def admin_monitor_host(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Доступ только для админов", show_alert=True)
-            return
-        
         host_name = (callback.data or '').split(':',1)[1]
         await callback.answer("🔄 Подключение к хосту...")
         data = resource_monitor.get_remote_metrics_for_host(host_name)
@@ -6792,29 +6273,7 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data.startswith("rmt:"))
     async def admin_monitor_target(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Доступ только для админов", show_alert=True)
-            return
-        
-
-        try:
-            digest = callback.data.split(':',1)[1]
-        except Exception:
-            digest = ''
-        tname = None
-        try:
-            for t in get_all_ssh_targets() or []:
-                name = t.get('target_name')
-                if not name:
-                    continue
-                try:
-                    h = hashlib.sha1((name or '').encode('utf-8','ignore')).hexdigest()
-                except Exception:
-                    h = hashlib.sha1(str(name).encode('utf-8','ignore')).hexdigest()
-                if h == digest:
-                    tname = name; break
-        except Exception:
-            tname = None
+        tname = _resolve_target_from_hash(callback.data or '')
         if not tname:
             await callback.answer("Цель не найдена", show_alert=True)
             return
@@ -6922,10 +6381,6 @@ def get_admin_router() -> Router:
 
     @admin_router.callback_query(F.data == "admin_monitor_detailed")
     async def admin_monitor_detailed(callback: types.CallbackQuery):
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Доступ только для админов", show_alert=True)
-            return
-        
         await callback.answer("🔄 Получение детальной статистики...")
         data = resource_monitor.get_local_metrics()
         
@@ -57,7 +57,6 @@ from shop_bot.data_manager.remnawave_repository import (
     get_referral_balance,
     get_referral_top_rich,
     get_referral_rank_and_count,
-    get_all_users,
     set_terms_agreed,
     set_referral_start_bonus_received,
     set_trial_used,
@@ -769,7 +768,6 @@ from shop_bot.data_manager.remnawave_repository import (
     get_referral_balance,
     get_referral_top_rich,
     get_referral_rank_and_count,
-    get_all_users,
     set_terms_agreed,
     set_referral_start_bonus_received,
     set_trial_used,
@@ -4899,14 +4897,16 @@ async def process_successful_payment(bot: Bot, metadata: dict):
             logger.error(f"Failed to send top-up notification to user {user_id}: {e}")
         
 
-        try:
-            admins = [u for u in (get_all_users() or []) if is_admin(u.get('telegram_id') or 0)]
-            for a in admins:
-                admin_id = a.get('telegram_id')
-                if admin_id:
-                    await bot.send_message(admin_id, f"📥 Пополнение: пользователь {user_id}, сумма {float(price):.2f} RUB")
-        except Exception:
-            pass
+        # ID админов берём из кэша, а не перебором всей таблицы users через is_admin();
+        # промах кэша читает БД в потоке, не в event loop
+        admin_ids = rw_repo.peek_admin_ids()
+        if admin_ids is None:
+            admin_ids = await asyncio.to_thread(rw_repo.reload_admin_ids)
+        for admin_id in admin_ids:
+            try:
+                await bot.send_message(admin_id, f"📥 Пополнение: пользователь {user_id}, сумма {float(price):.2f} RUB")
+            except Exception:
+                pass
         return
 
     processing_message = await bot.send_message(
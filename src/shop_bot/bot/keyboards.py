@@ -1,10 +1,12 @@
 import logging
 import hashlib
+import functools
 
 from datetime import datetime
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.filters.callback_data import CallbackData
 
 from shop_bot.data_manager.remnawave_repository import get_setting
 from shop_bot.data_manager.database import get_button_configs
@@ -13,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 SUPPORT_URL = "https://t.me/uprav_softmaster95vpn_bot"
 
+# Статичные клавиатуры собираются один раз (functools.lru_cache): возвращаемый
+# InlineKeyboardMarkup общий для всех вызовов, изменять его на месте нельзя.
+
 
 def _ru_days(n: int) -> str:
     """Русское склонение слова "день".
@@ -113,6 +118,7 @@ def create_admin_menu_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_system_menu_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="⚡ Тест скорости", callback_data="admin_speedtest")
@@ -125,6 +131,7 @@ def create_admin_system_menu_keyboard() -> InlineKeyboardMarkup:
 
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_settings_menu_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="👮 Администраторы", callback_data="admin_admins_menu")
@@ -209,6 +216,7 @@ def create_admin_payment_detail_keyboard(provider: str, *, flags: dict | None =
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=32)
 def create_admin_payments_cancel_keyboard(back_callback: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data=back_callback)
@@ -251,6 +259,7 @@ def create_admin_referral_settings_keyboard(
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=8)
 def create_admin_referral_type_keyboard(current_type: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     options = [
@@ -322,6 +331,7 @@ def create_admin_host_manage_keyboard(host_digest: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=32)
 def create_admin_hosts_cancel_keyboard(back_cb: str = "admin_hosts_menu") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data=back_cb)
@@ -385,19 +395,31 @@ def create_admin_plans_host_menu_keyboard(plans: list[dict] | None = None) -> In
 
     Если переданы планы — отображает их как inline-кнопки.
     """
+    rows = tuple(
+        (
+            p.get("plan_id"),
+            p.get("plan_name"),
+            p.get("months"),
+            p.get("duration_days"),
+            p.get("price"),
+            int(p.get("is_active", 1) or 0) == 1,
+        )
+        for p in (plans or ())
+    )
+    return _admin_plans_host_menu_markup(rows)
+
+
+@functools.lru_cache(maxsize=256)
+def _admin_plans_host_menu_markup(rows: tuple) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
-    if plans:
-        for p in plans:
+    if rows:
+        for plan_id, plan_name, months, duration_days, price, is_active in rows:
             try:
-                pid = int(p.get("plan_id"))
+                pid = int(plan_id)
             except Exception:
                 continue
-            name = str(p.get("plan_name") or "—")
-            months = p.get("months")
-            duration_days = p.get("duration_days")
-            price = p.get("price")
-            is_active = int(p.get("is_active", 1) or 0) == 1
+            name = str(plan_name or "—")
 
             # duration label
             dur_txt = "—"
@@ -431,25 +453,38 @@ def create_admin_plans_host_menu_keyboard(plans: list[dict] | None = None) -> In
     return builder.as_markup()
 
 
+class PlanAction(CallbackData, prefix="admpl"):
+    """Кнопки карточки тарифа и её подменю (срок, удаление, «Назад»).
+
+    plan_id = 0 — тариф берётся из FSM (current_plan_id).
+    """
+    action: str
+    plan_id: int = 0
+
+
 def create_admin_plan_manage_keyboard(plan: dict) -> InlineKeyboardMarkup:
-    plan_id = plan.get("plan_id")
-    is_active = int(plan.get("is_active", 1) or 0) == 1
+    return _admin_plan_manage_markup(int(plan.get("plan_id") or 0), int(plan.get("is_active", 1) or 0) == 1)
+
+
+@functools.lru_cache(maxsize=256)
+def _admin_plan_manage_markup(plan_id: int, is_active: bool) -> InlineKeyboardMarkup:
     toggle_text = "🚫 Скрыть" if is_active else "✅ Активировать"
 
     builder = InlineKeyboardBuilder()
-    builder.button(text="✏️ Название", callback_data="admin_plan_edit_name")
-    builder.button(text="⏳ Срок", callback_data="admin_plan_edit_duration")
-    builder.button(text="💰 Цена", callback_data="admin_plan_edit_price")
-    builder.button(text="📶 Трафик (ГБ)", callback_data="admin_plan_edit_traffic")
-    builder.button(text="📱 Устройства", callback_data="admin_plan_edit_devices")
-    builder.button(text=toggle_text, callback_data="admin_plan_toggle_active")
-    builder.button(text="🗑 Удалить", callback_data="admin_plan_delete")
+    builder.button(text="✏️ Название", callback_data=PlanAction(action="edit_name", plan_id=plan_id).pack())
+    builder.button(text="⏳ Срок", callback_data=PlanAction(action="duration", plan_id=plan_id).pack())
+    builder.button(text="💰 Цена", callback_data=PlanAction(action="edit_price", plan_id=plan_id).pack())
+    builder.button(text="📶 Трафик (ГБ)", callback_data=PlanAction(action="edit_traffic", plan_id=plan_id).pack())
+    builder.button(text="📱 Устройства", callback_data=PlanAction(action="edit_devices", plan_id=plan_id).pack())
+    builder.button(text=toggle_text, callback_data=PlanAction(action="toggle_active", plan_id=plan_id).pack())
+    builder.button(text="🗑 Удалить", callback_data=PlanAction(action="delete", plan_id=plan_id).pack())
     builder.button(text="⬅️ Назад", callback_data="admin_plans_back_to_host_menu")
     builder.adjust(2, 2, 2, 1, 1)
     return builder.as_markup()
 
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_plans_duration_type_keyboard() -> InlineKeyboardMarkup:
     """Выбор единиц срока тарифа при создании."""
     builder = InlineKeyboardBuilder()
@@ -461,33 +496,37 @@ def create_admin_plans_duration_type_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def create_admin_plan_duration_type_keyboard() -> InlineKeyboardMarkup:
+@functools.lru_cache(maxsize=256)
+def create_admin_plan_duration_type_keyboard(plan_id: int = 0) -> InlineKeyboardMarkup:
     """Выбор единиц срока тарифа при редактировании."""
     builder = InlineKeyboardBuilder()
-    builder.button(text="📅 В месяцах", callback_data="admin_plan_duration_months")
-    builder.button(text="📆 В днях", callback_data="admin_plan_duration_days")
-    builder.button(text="⬅️ Назад", callback_data="admin_plan_back")
+    builder.button(text="📅 В месяцах", callback_data=PlanAction(action="months", plan_id=plan_id).pack())
+    builder.button(text="📆 В днях", callback_data=PlanAction(action="days", plan_id=plan_id).pack())
+    builder.button(text="⬅️ Назад", callback_data=PlanAction(action="back", plan_id=plan_id).pack())
     builder.button(text="❌ Отмена", callback_data="admin_cancel")
     builder.adjust(2, 2)
     return builder.as_markup()
 
-def create_admin_plan_delete_confirm_keyboard() -> InlineKeyboardMarkup:
+@functools.lru_cache(maxsize=256)
+def create_admin_plan_delete_confirm_keyboard(plan_id: int = 0) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Да, удалить", callback_data="admin_plan_delete_confirm")
-    builder.button(text="❌ Отмена", callback_data="admin_plan_delete_cancel")
+    builder.button(text="✅ Да, удалить", callback_data=PlanAction(action="delete_confirm", plan_id=plan_id).pack())
+    builder.button(text="❌ Отмена", callback_data=PlanAction(action="back", plan_id=plan_id).pack())
     builder.adjust(2)
     return builder.as_markup()
 
 
 
-def create_admin_plan_edit_flow_keyboard() -> InlineKeyboardMarkup:
+@functools.lru_cache(maxsize=256)
+def create_admin_plan_edit_flow_keyboard(plan_id: int = 0) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    builder.button(text="⬅️ Назад", callback_data="admin_plan_back")
+    builder.button(text="⬅️ Назад", callback_data=PlanAction(action="back", plan_id=plan_id).pack())
     builder.button(text="❌ Отмена", callback_data="admin_cancel")
     builder.adjust(2)
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_plans_flow_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ Назад", callback_data="admin_plans_back_to_host_menu")
@@ -495,6 +534,7 @@ def create_admin_plans_flow_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admins_menu_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Добавить админа", callback_data="admin_add_admin")
@@ -504,11 +544,43 @@ def create_admins_menu_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 2)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
+def create_admin_view_admins_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⬅️ Назад", callback_data="admin_admins_menu")
+    builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
+    builder.adjust(1, 1)
+    return builder.as_markup()
+
+@functools.lru_cache(maxsize=512)
+def create_admin_user_referrals_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⬅️ К пользователю", callback_data=f"admin_view_user_{user_id}")
+    builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
+    builder.adjust(1, 1)
+    return builder.as_markup()
+
+@functools.lru_cache(maxsize=8)
+def create_ban_notice_keyboard(support_url: str | None) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    if support_url:
+        builder.button(text="🆘 Написать в поддержку", url=support_url)
+    else:
+        builder.button(text="🆘 Поддержка", callback_data="show_help")
+    return builder.as_markup()
+
+@functools.lru_cache(maxsize=None)
+def create_unban_notice_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(get_main_menu_button())
+    return builder.as_markup()
+
 def create_admin_users_keyboard(users: list[dict], page: int = 0, page_size: int = 10) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     start = page * page_size
     end = start + page_size
-    for u in users[start:end]:
+    page_users = users[start:end]
+    for u in page_users:
         user_id = u.get('telegram_id') or u.get('user_id') or u.get('id')
         username = u.get('username') or '—'
         title = f"{user_id} • @{username}" if username != '—' else f"{user_id}"
@@ -524,7 +596,7 @@ def create_admin_users_keyboard(users: list[dict], page: int = 0, page_size: int
     builder.button(text="🔍 Поиск", callback_data="admin_users_search")
     builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
 
-    rows = [1] * len(users[start:end])
+    rows = [1] * len(page_users)
     tail = []
     if have_prev or have_next:
         tail.append(2 if (have_prev and have_next) else 1)
@@ -584,16 +656,19 @@ def create_admin_delete_key_confirm_keyboard(key_id: int) -> InlineKeyboardMarku
     builder.adjust(1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_cancel_keyboard(callback: str = "admin_cancel") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data=callback)
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_cancel_keyboard() -> InlineKeyboardMarkup:
     return create_cancel_keyboard("admin_cancel")
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_menu_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Создать промокод", callback_data="admin_promo_create")
@@ -603,6 +678,7 @@ def create_admin_promo_menu_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_discount_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="% Процент", callback_data="admin_promo_discount_percent")
@@ -611,6 +687,7 @@ def create_admin_promo_discount_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_code_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="🔄 Сгенерировать автоматически", callback_data="admin_promo_code_auto")
@@ -619,6 +696,7 @@ def create_admin_promo_code_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(1, 1, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_limit_keyboard(kind: str) -> InlineKeyboardMarkup:
 
     prefix = "admin_promo_limit_total_" if kind == "total" else "admin_promo_limit_user_"
@@ -631,6 +709,7 @@ def create_admin_promo_limit_keyboard(kind: str) -> InlineKeyboardMarkup:
     builder.adjust(2, 3, 1, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_valid_from_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="⏱ Сейчас", callback_data="admin_promo_valid_from_now")
@@ -642,6 +721,7 @@ def create_admin_promo_valid_from_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 2, 2)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_valid_until_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="+1 день", callback_data="admin_promo_valid_until_plus1d")
@@ -653,6 +733,7 @@ def create_admin_promo_valid_until_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(3, 2, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_admin_promo_description_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➡️ Пропустить", callback_data="admin_promo_desc_skip")
@@ -661,6 +742,15 @@ def create_admin_promo_description_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
+def create_admin_promo_confirm_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✅ Создать", callback_data="admin_promo_confirm")
+    builder.button(text="❌ Отмена", callback_data="admin_cancel")
+    builder.adjust(1, 1)
+    return builder.as_markup()
+
+@functools.lru_cache(maxsize=None)
 def create_broadcast_options_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Добавить кнопку", callback_data="broadcast_add_button")
@@ -669,6 +759,7 @@ def create_broadcast_options_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_broadcast_confirmation_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Отправить всем", callback_data="confirm_broadcast")
@@ -676,6 +767,7 @@ def create_broadcast_confirmation_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_broadcast_cancel_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data="cancel_broadcast")
@@ -800,6 +892,7 @@ def create_plans_keyboard(plans: list[dict], action: str, host_name: str, key_id
     return builder.as_markup()
 
 
+@functools.lru_cache(maxsize=None)
 def create_skip_email_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➡️ Продолжить без почты", callback_data="skip_email")
@@ -1027,16 +1120,14 @@ def get_buy_button() -> InlineKeyboardButton:
     return InlineKeyboardButton(text="💳 Купить подписку", callback_data="buy_vpn")
 
 
-def create_admin_users_pick_keyboard(users: list[dict], page: int = 0, page_size: int = 10, action: str = "gift") -> InlineKeyboardMarkup:
+def create_admin_users_pick_keyboard(page_users: list[dict], total: int, page: int = 0, page_size: int = 10, action: str = "gift") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    start = page * page_size
-    end = start + page_size
-    for u in users[start:end]:
+    end = page * page_size + len(page_users)
+    for u in page_users:
         user_id = u.get('telegram_id') or u.get('user_id') or u.get('id')
         username = u.get('username') or '—'
         title = f"{user_id} • @{username}" if username != '—' else f"{user_id}"
         builder.button(text=title, callback_data=f"admin_{action}_pick_user_{user_id}")
-    total = len(users)
     have_prev = page > 0
     have_next = end < total
     if have_prev:
@@ -1044,7 +1135,7 @@ def create_admin_users_pick_keyboard(users: list[dict], page: int = 0, page_size
     if have_next:
         builder.button(text="Вперёд ➡️", callback_data=f"admin_{action}_pick_user_page_{page+1}")
     builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
-    rows = [1] * len(users[start:end])
+    rows = [1] * len(page_users)
     tail = []
     if have_prev or have_next:
         tail.append(2 if (have_prev and have_next) else 1)
@@ -1083,10 +1174,15 @@ def create_admin_hosts_pick_keyboard(hosts: list[dict], action: str = "gift") ->
 
 
 def create_admin_ssh_targets_keyboard(ssh_targets: list[dict]) -> InlineKeyboardMarkup:
+    # Кнопки зависят только от имён целей — по ним и кэшируем готовую разметку
+    return _admin_ssh_targets_markup(tuple(t.get('target_name') for t in ssh_targets or ()))
+
+
+@functools.lru_cache(maxsize=32)
+def _admin_ssh_targets_markup(names: tuple) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    if ssh_targets:
-        for t in ssh_targets:
-            name = t.get('target_name')
+    if names:
+        for name in names:
 
             try:
                 digest = hashlib.sha1((name or '').encode('utf-8', 'ignore')).hexdigest()
@@ -1101,20 +1197,20 @@ def create_admin_ssh_targets_keyboard(ssh_targets: list[dict]) -> InlineKeyboard
     builder.button(text="🚀 Запустить для всех", callback_data="admin_speedtest_run_all_targets")
     builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
 
-    rows = [2] * (len(ssh_targets) if ssh_targets else 1)
+    rows = [2] * (len(names) if names else 1)
     rows.extend([1, 1])
     builder.adjust(*rows)
     return builder.as_markup()
 
 def create_admin_keys_for_host_keyboard(
     host_name: str,
-    keys: list[dict],
+    page_keys: list[dict],
+    total: int,
     page: int = 0,
     page_size: int = 10,
 ) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    total = len(keys or [])
-    if not keys:
+    if not total:
         builder.button(text="Ключей на хосте нет", callback_data="noop")
         builder.button(text="⬅️ К выбору хоста", callback_data="admin_hostkeys_back_to_hosts")
         builder.button(text="⬅️ В админ-меню", callback_data="admin_menu")
@@ -1122,8 +1218,8 @@ def create_admin_keys_for_host_keyboard(
         return builder.as_markup()
 
     start = max(page, 0) * page_size
-    end = start + page_size
-    page_items = keys[start:end]
+    end = start + len(page_keys)
+    page_items = page_keys
 
     for k in page_items:
         kid = k.get('key_id')
@@ -1157,6 +1253,7 @@ def create_admin_keys_for_host_keyboard(
     builder.adjust(*(rows + tail if rows else tail))
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=8)
 def create_admin_months_pick_keyboard(action: str = "gift") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for m in (1, 3, 6, 12):
@@ -1413,6 +1510,7 @@ BROADCAST_ACTIONS_MAP = {
     "admin_menu": "🛠 Админ-панель",
 }
 
+@functools.lru_cache(maxsize=None)
 def create_broadcast_button_type_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="🔗 Кнопка-ссылка", callback_data="broadcast_btn_type_url")
@@ -1421,6 +1519,7 @@ def create_broadcast_button_type_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 1)
     return builder.as_markup()
 
+@functools.lru_cache(maxsize=None)
 def create_broadcast_actions_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for cb, title in BROADCAST_ACTIONS_MAP.items():
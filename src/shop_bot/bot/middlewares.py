@@ -1,8 +1,11 @@
+import asyncio
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message, CallbackQuery, Chat
+from aiogram.dispatcher.flags import get_flag
+from aiogram.filters import BaseFilter
+from aiogram.types import TelegramObject, Message, CallbackQuery, Chat, User
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from shop_bot.data_manager.remnawave_repository import get_user, get_setting
+from shop_bot.data_manager.remnawave_repository import get_user, get_setting, peek_admin_ids, reload_admin_ids
 
 class BanMiddleware(BaseMiddleware):
     async def __call__(
@@ -65,3 +68,39 @@ class BanMiddleware(BaseMiddleware):
             return
         
         return await handler(event, data)
+
+
+async def _current_admin_ids() -> frozenset:
+    # Обычно это проверка по frozenset в памяти; БД читается только
+    # после истечения TTL кэша и не в event loop.
+    admin_ids = peek_admin_ids()
+    if admin_ids is None:
+        admin_ids = await asyncio.to_thread(reload_admin_ids)
+    return admin_ids
+
+
+class AdminFilter(BaseFilter):
+    """Фильтр уровня роутера: апдейты не-админов отсекаются до разбора
+    состояний FSM и фильтров отдельных хендлеров."""
+
+    async def __call__(self, event: TelegramObject, event_from_user: User | None = None) -> bool:
+        return event_from_user is not None and event_from_user.id in await _current_admin_ids()
+
+
+class FsmDataMiddleware(BaseMiddleware):
+    """Передаёт хендлерам с флагом ``fsm_data`` данные FSM готовым аргументом.
+
+    Регистрируется как inner-middleware, т.е. срабатывает уже после фильтров
+    и видит флаги выбранного хендлера.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        state = data.get('state')
+        if state is not None and get_flag(data, "fsm_data"):
+            data['fsm_data'] = await state.get_data()
+        return await handler(event, data)
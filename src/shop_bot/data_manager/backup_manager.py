@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import shutil
 import sqlite3
@@ -86,13 +87,30 @@ async def send_backup_to_admins(bot: Bot, zip_path: Path) -> int:
             logger.warning("Бэкап: нет администраторов для отправки архива")
             return 0
         caption = f"🗄 Бэкап БД: {zip_path.name}"
-        file = FSInputFile(str(zip_path))
-        for uid in admin_ids:
+        # Файл загружается в Telegram один раз (первому доступному админу),
+        # остальным уходит уже загруженный документ по file_id — параллельно.
+        file_id: str | None = None
+        rest = list(admin_ids)
+        while rest and file_id is None:
+            uid = rest.pop(0)
             try:
-                await bot.send_document(chat_id=int(uid), document=file, caption=caption)
+                msg = await bot.send_document(chat_id=int(uid), document=FSInputFile(str(zip_path)), caption=caption)
+                file_id = msg.document.file_id
                 cnt += 1
             except Exception as e:
                 logger.error(f"Бэкап: не удалось отправить администратору {uid}: {e}")
+        if file_id is None:
+            return cnt
+
+        async def _send(uid) -> bool:
+            try:
+                await bot.send_document(chat_id=int(uid), document=file_id, caption=caption)
+                return True
+            except Exception as e:
+                logger.error(f"Бэкап: не удалось отправить администратору {uid}: {e}")
+                return False
+
+        cnt += sum(await asyncio.gather(*(_send(uid) for uid in rest)))
         return cnt
     except Exception as e:
         logger.error(f"Бэкап: ошибка при рассылке архива: {e}", exc_info=True)
@@ -174,12 +192,16 @@ def restore_from_file(uploaded_path: Path) -> bool:
         with sqlite3.connect(candidate_db) as src:
             with sqlite3.connect(DB_FILE) as dst:
                 src.backup(dst)
-        
+
 
         try:
             rw_repo.run_migration()
         except Exception:
             pass
+        # Кэши сбрасываем после миграции: до неё в старом бэкапе может не быть bot_admins
+        rw_repo.bump_plans_version()
+        rw_repo.invalidate_admin_ids_cache()
+        rw_repo.invalidate_key_cache()
 
         logger.info("Восстановление: база данных успешно заменена")
         return True
@@ -4,6 +4,7 @@ import logging
 from pathlib import Path
 import json
 import re
+import time
 from typing import Any
 
 logger = logging.getLogger(__name__)
@@ -11,6 +12,19 @@ logger = logging.getLogger(__name__)
 
 _UNSET = object()
 
+# Версия таблицы plans: увеличивается при любой записи, чтобы кэши тарифов
+# (админ-меню бота) понимали, что список устарел, без повторных SELECT.
+_plans_version = 0
+
+
+def bump_plans_version() -> None:
+    global _plans_version
+    _plans_version += 1
+
+
+def get_plans_version() -> int:
+    return _plans_version
+
 
 import os
 if os.path.exists("/app/project/users.db"):
@@ -460,6 +474,9 @@ def _ensure_users_columns(cursor: sqlite3.Cursor) -> None:
     }
     for column, definition in mapping.items():
         _ensure_table_column(cursor, "users", column, definition)
+    # Поиск по username без учёта регистра (get_user_by_username) идёт по индексу
+    _ensure_index(cursor, "idx_users_username_lower", "users", "LOWER(username)")
+    _ensure_index(cursor, "idx_users_registration_date", "users", "registration_date")
 
 
 def _ensure_hosts_columns(cursor: sqlite3.Cursor) -> None:
@@ -515,6 +532,8 @@ def _finalize_vpn_key_indexes(cursor: sqlite3.Cursor) -> None:
     _ensure_index(cursor, "idx_vpn_keys_user_id", "vpn_keys", "user_id")
     _ensure_index(cursor, "idx_vpn_keys_rem_uuid", "vpn_keys", "remnawave_user_uuid")
     _ensure_index(cursor, "idx_vpn_keys_expire_at", "vpn_keys", "expire_at")
+    # Выборки по хосту идут через TRIM(host_name) — индекс по тому же выражению
+    _ensure_index(cursor, "idx_vpn_keys_host_trim", "vpn_keys", "TRIM(host_name)")
 
 
 def _rebuild_vpn_keys_table(cursor: sqlite3.Cursor) -> None:
@@ -662,6 +681,7 @@ def run_migration():
             _ensure_ssh_targets_table(cursor)
             _ensure_gift_tokens_table(cursor)
             _ensure_promo_tables(cursor)
+            _ensure_admins_table(cursor)
 
             try:
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_tickets_thread ON support_tickets(forum_chat_id, message_thread_id)")
@@ -950,6 +970,8 @@ def update_host_name(old_name: str, new_name: str) -> bool:
                 (new_name_n, old_name_n)
             )
             conn.commit()
+            invalidate_key_cache()
+            bump_plans_version()
             return True
     except sqlite3.Error as e:
         logging.error(f"Не удалось переименовать хост с '{old_name}' на '{new_name}': {e}")
@@ -963,6 +985,7 @@ def delete_host(host_name: str):
             cursor.execute("DELETE FROM plans WHERE TRIM(host_name) = TRIM(?)", (host_name,))
             cursor.execute("DELETE FROM xui_hosts WHERE TRIM(host_name) = TRIM(?)", (host_name,))
             conn.commit()
+            bump_plans_version()
             logging.info(f"Хост '{host_name}' и его тарифы успешно удалены.")
     except sqlite3.Error as e:
         logging.error(f"Ошибка удаления хоста '{host_name}': {e}")
@@ -1028,6 +1051,7 @@ def delete_key_by_id(key_id: int) -> bool:
             cursor.execute("DELETE FROM vpn_keys WHERE key_id = ?", (key_id,))
             affected = cursor.rowcount
             conn.commit()
+            invalidate_key_cache(key_id)
             return affected > 0
     except sqlite3.Error as e:
         logging.error(f"Не удалось удалить ключ по id {key_id}: {e}")
@@ -1039,6 +1063,7 @@ def update_key_comment(key_id: int, comment: str) -> bool:
             cursor = conn.cursor()
             cursor.execute("UPDATE vpn_keys SET comment = ? WHERE key_id = ?", (comment, key_id))
             conn.commit()
+            invalidate_key_cache(key_id)
             return cursor.rowcount > 0
     except sqlite3.Error as e:
         logging.error(f"Не удалось обновить комментарий ключа для {key_id}: {e}")
@@ -1229,6 +1254,35 @@ def _ensure_gift_tokens_table(cursor: sqlite3.Cursor) -> None:
     _ensure_index(cursor, "idx_gift_token_claims_user", "gift_token_claims", "user_id")
 
 
+def _ensure_admins_table(cursor: sqlite3.Cursor) -> None:
+    """Миграция: админы в таблице bot_admins вместо CSV в настройке admin_telegram_ids.
+
+    Старое значение переносится один раз и затирается, чтобы удалённые позже
+    админы не вернулись при следующем запуске.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bot_admins (
+            telegram_id INTEGER PRIMARY KEY,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    try:
+        cursor.execute("SELECT value FROM bot_settings WHERE key = 'admin_telegram_ids'")
+        row = cursor.fetchone()
+    except sqlite3.Error:
+        return
+    legacy = _parse_admin_ids(row[0] if row else None)
+    if legacy:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO bot_admins (telegram_id) VALUES (?)",
+            [(i,) for i in legacy],
+        )
+    if row and row[0]:
+        cursor.execute("UPDATE bot_settings SET value = NULL WHERE key = 'admin_telegram_ids'")
+
+
 def _ensure_promo_tables(cursor: sqlite3.Cursor) -> None:
     """Создание таблиц промокодов и истории их использования."""
     cursor.execute(
@@ -1517,10 +1571,10 @@ def get_keys_for_user(user_id: int) -> list[dict]:
 
 def update_key_email(key_id: int, new_email: str) -> bool:
     normalized = _normalize_email(new_email) or new_email.strip()
-    return update_key_fields(key_id, email=normalized)
+    return update_key_fields(key_id, email=normalized) is not None
 
 def update_key_host(key_id: int, new_host_name: str) -> bool:
-    return update_key_fields(key_id, host_name=new_host_name)
+    return update_key_fields(key_id, host_name=new_host_name) is not None
 
 def create_gift_key(user_id: int, host_name: str, key_email: str, months: int, remnawave_user_uuid: str | None = None) -> int | None:
     """Создать подарочный ключ: expiry = now + months."""
@@ -1556,11 +1610,74 @@ def get_setting(key: str) -> str | None:
         logging.error(f"Failed to get setting '{key}': {e}")
         return None
 
+# Список админов читается на каждом апдейте админ-роутера, поэтому держим его
+# в памяти; update_setting() по админ-ключам (бот и панель), add_admin_id() и
+# remove_admin_id() сбрасывают кэш сразу, TTL нужен только для правок БД в
+# обход этого процесса.
+_ADMIN_IDS_TTL = 30.0
+_ADMIN_SETTING_KEYS = frozenset({"admin_telegram_id", "admin_telegram_ids"})
+_admin_ids_cache: tuple[float, frozenset[int]] | None = None
+
+
+def invalidate_admin_ids_cache() -> None:
+    global _admin_ids_cache
+    _admin_ids_cache = None
+
+
+def peek_admin_ids() -> frozenset[int] | None:
+    """Закэшированные ID админов или None, если кэш пуст/устарел (без чтения БД)."""
+    cached = _admin_ids_cache
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def reload_admin_ids() -> frozenset[int]:
+    """Перечитывает ID админов из настроек и обновляет кэш."""
+    global _admin_ids_cache
+    ids = frozenset(_load_admin_ids())
+    _admin_ids_cache = (time.monotonic() + _ADMIN_IDS_TTL, ids)
+    return ids
+
+
+def _cached_admin_ids() -> frozenset[int]:
+    ids = peek_admin_ids()
+    return ids if ids is not None else reload_admin_ids()
+
+
 def get_admin_ids() -> set[int]:
-    """Возвращает множество ID администраторов из настроек.
-    Поддерживает оба варианта: одиночный 'admin_telegram_id' и список 'admin_telegram_ids'
-    через запятую/пробелы или JSON-массив.
+    """Возвращает множество ID администраторов: одиночный 'admin_telegram_id'
+    из настроек плюс все строки таблицы bot_admins.
     """
+    return set(_cached_admin_ids())
+
+
+def _parse_admin_ids(raw: str | None) -> set[int]:
+    """Разбор старого формата admin_telegram_ids: через запятую/пробелы или JSON-массив."""
+    ids: set[int] = set()
+    s = (raw or "").strip()
+    if not s:
+        return ids
+    try:
+        arr = json.loads(s)
+        if isinstance(arr, list):
+            for v in arr:
+                try:
+                    ids.add(int(v))
+                except Exception:
+                    pass
+            return ids
+    except Exception:
+        pass
+    for p in re.split(r"[\s,]+", s):
+        try:
+            ids.add(int(p))
+        except Exception:
+            pass
+    return ids
+
+
+def _load_admin_ids() -> set[int]:
     ids: set[int] = set()
     try:
         single = get_setting("admin_telegram_id")
@@ -1569,36 +1686,37 @@ def get_admin_ids() -> set[int]:
                 ids.add(int(single))
             except Exception:
                 pass
-        multi_raw = get_setting("admin_telegram_ids")
-        if multi_raw:
-            s = (multi_raw or "").strip()
-
-            try:
-                arr = json.loads(s)
-                if isinstance(arr, list):
-                    for v in arr:
-                        try:
-                            ids.add(int(v))
-                        except Exception:
-                            pass
-                    return ids
-            except Exception:
-                pass
-
-            parts = [p for p in re.split(r"[\s,]+", s) if p]
-            for p in parts:
-                try:
-                    ids.add(int(p))
-                except Exception:
-                    pass
+        with sqlite3.connect(DB_FILE) as conn:
+            ids.update(row[0] for row in conn.execute("SELECT telegram_id FROM bot_admins"))
     except Exception as e:
         logging.warning(f"get_admin_ids failed: {e}")
     return ids
 
+
+def add_admin_id(telegram_id: int) -> bool:
+    """Добавить админа; False, если он уже был в bot_admins."""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO bot_admins (telegram_id) VALUES (?)",
+            (int(telegram_id),),
+        )
+        conn.commit()
+    invalidate_admin_ids_cache()
+    return cursor.rowcount > 0
+
+
+def remove_admin_id(telegram_id: int) -> bool:
+    """Снять админа; False, если его не было в bot_admins."""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.execute("DELETE FROM bot_admins WHERE telegram_id = ?", (int(telegram_id),))
+        conn.commit()
+    invalidate_admin_ids_cache()
+    return cursor.rowcount > 0
+
 def is_admin(user_id: int) -> bool:
     """Проверка прав администратора по списку ID из настроек."""
     try:
-        return int(user_id) in get_admin_ids()
+        return int(user_id) in _cached_admin_ids()
     except Exception:
         return False
 
@@ -1912,6 +2030,8 @@ def update_setting(key: str, value: str):
             cursor = conn.cursor()
             cursor.execute("INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)", (key, value))
             conn.commit()
+            if key in _ADMIN_SETTING_KEYS:
+                invalidate_admin_ids_cache()
             logging.info(f"Setting '{key}' updated.")
     except sqlite3.Error as e:
         logging.error(f"Failed to update setting '{key}': {e}")
@@ -2432,6 +2552,7 @@ def create_plan(host_name: str, plan_name: str, months: int | None, price: float
                 (host_name, plan_name, months, duration_days, price, traffic_limit_bytes, traffic_limit_strategy, hwid_device_limit)
             )
             conn.commit()
+            bump_plans_version()
             logging.info(f"Created new plan '{plan_name}' for host '{host_name}'.")
     except sqlite3.Error as e:
         logging.error(f"Failed to create plan for host '{host_name}': {e}")
@@ -2470,20 +2591,40 @@ def get_active_plans_for_host(host_name: str) -> list[dict]:
         return []
 
 
-def set_plan_active(plan_id: int, is_active: bool) -> bool:
-    """Включить/выключить тариф (скрыть/показать пользователям)."""
+# UPDATE ... RETURNING появился в SQLite 3.35; на старых сборках перечитываем строку SELECT'ом.
+_SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _update_plan_row(cursor: sqlite3.Cursor, set_clause: str, values: list, plan_id: int) -> dict | None:
+    """Выполняет UPDATE тарифа и возвращает обновлённую строку (или None, если тарифа нет)."""
+    if _SQLITE_HAS_RETURNING:
+        cursor.execute(f"UPDATE plans SET {set_clause} WHERE plan_id = ? RETURNING *", values + [plan_id])
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    cursor.execute(f"UPDATE plans SET {set_clause} WHERE plan_id = ?", values + [plan_id])
+    if cursor.rowcount == 0:
+        return None
+    cursor.execute("SELECT * FROM plans WHERE plan_id = ?", (plan_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def set_plan_active(plan_id: int, is_active: bool) -> dict | None:
+    """Включить/выключить тариф (скрыть/показать пользователям).
+
+    Возвращает обновлённую строку тарифа или None при ошибке.
+    """
     try:
         with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE plans SET is_active = ? WHERE plan_id = ?",
-                (1 if is_active else 0, int(plan_id))
-            )
+            plan = _update_plan_row(cursor, "is_active = ?", [1 if is_active else 0], int(plan_id))
             conn.commit()
-            return cursor.rowcount > 0
+            bump_plans_version()
+            return plan
     except sqlite3.Error as e:
         logging.error(f"Failed to set plan active status for id {plan_id}: {e}")
-        return False
+        return None
 
 def get_plan_by_id(plan_id: int) -> dict | None:
     try:
@@ -2497,17 +2638,25 @@ def get_plan_by_id(plan_id: int) -> dict | None:
         logging.error(f"Failed to get plan by id '{plan_id}': {e}")
         return None
 
-def delete_plan(plan_id: int):
+def delete_plan(plan_id: int) -> bool:
+    """Удаляет тариф; False — удаление не прошло (ограничения БД или ошибка)."""
     try:
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM plans WHERE plan_id = ?", (plan_id,))
             conn.commit()
+            bump_plans_version()
             logging.info(f"Deleted plan with id {plan_id}.")
+            return True
+    except sqlite3.IntegrityError as e:
+        logging.warning(f"Plan {plan_id} is still referenced, not deleted: {e}")
+        return False
     except sqlite3.Error as e:
         logging.error(f"Failed to delete plan with id {plan_id}: {e}")
+        return False
 
-def update_plan(plan_id: int, plan_name: str, months: int | None, price: float, *, duration_days: Any = _UNSET, traffic_limit_bytes: Any = _UNSET, hwid_device_limit: Any = _UNSET) -> bool:
+def update_plan(plan_id: int, plan_name: str, months: int | None, price: float, *, duration_days: Any = _UNSET, traffic_limit_bytes: Any = _UNSET, hwid_device_limit: Any = _UNSET) -> dict | None:
+    """Обновляет тариф и возвращает его новую строку (None — не найден или ошибка)."""
     try:
         fields: dict[str, Any] = {
             "plan_name": plan_name,
@@ -2522,20 +2671,21 @@ def update_plan(plan_id: int, plan_name: str, months: int | None, price: float,
             fields["hwid_device_limit"] = hwid_device_limit
 
         set_clause = ", ".join([f"{k} = ?" for k in fields.keys()])
-        values = list(fields.values()) + [plan_id]
 
         with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute(f"UPDATE plans SET {set_clause} WHERE plan_id = ?", values)
+            plan = _update_plan_row(cursor, set_clause, list(fields.values()), plan_id)
             conn.commit()
-            if cursor.rowcount == 0:
+            if plan is None:
                 logging.warning(f"No plan updated for id {plan_id} (not found).")
-                return False
+                return None
+            bump_plans_version()
             logging.info(f"Updated plan {plan_id}: {fields}.")
-            return True
+            return plan
     except sqlite3.Error as e:
         logging.error(f"Failed to update plan {plan_id}: {e}")
-        return False
+        return None
 
 
 def register_user_if_not_exists(telegram_id: int, username: str, referrer_id):
@@ -2756,6 +2906,23 @@ def get_user(telegram_id: int):
         return None
 
 
+def get_users_by_ids(ids) -> dict[int, dict]:
+    """Пользователи по списку telegram_id одним запросом: {telegram_id: row}."""
+    id_list = list({int(i) for i in ids or ()})
+    if not id_list:
+        return {}
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            placeholders = ",".join("?" * len(id_list))
+            cursor.execute(f"SELECT * FROM users WHERE telegram_id IN ({placeholders})", id_list)
+            return {row["telegram_id"]: dict(row) for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get users by ids: {e}")
+        return {}
+
+
 def get_user_by_username(username: str):
     """Возвращает пользователя по username (без @), регистр не важен."""
     try:
@@ -2772,6 +2939,32 @@ def get_user_by_username(username: str):
         logging.error("DB: get_user_by_username failed: %s", e)
         return None
 
+def search_users(query: str, limit: int = 50) -> list[dict]:
+    """Пользователи, у которых query входит в username (без учёта регистра),
+    а если таких нет — в текстовое представление telegram_id."""
+    q = (query or "").lstrip("@").strip().lower()
+    if not q:
+        return []
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM users WHERE instr(LOWER(username), ?) > 0 ORDER BY registration_date DESC LIMIT ?",
+                (q, limit),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                cur.execute(
+                    "SELECT * FROM users WHERE instr(CAST(telegram_id AS TEXT), ?) > 0 ORDER BY registration_date DESC LIMIT ?",
+                    (q, limit),
+                )
+                rows = cur.fetchall()
+            return [dict(row) for row in rows]
+    except sqlite3.Error as e:
+        logging.error("DB: search_users failed: %s", e)
+        return []
+
 def set_terms_agreed(telegram_id: int):
     try:
         with sqlite3.connect(DB_FILE) as conn:
@@ -3005,9 +3198,14 @@ def add_new_key(
         return None
 
 
-def _apply_key_updates(key_id: int, updates: dict[str, Any]) -> bool:
+def _apply_key_updates(key_id: int, updates: dict[str, Any]) -> dict | None:
+    """UPDATE ключа; возвращает обновлённую строку (как get_key_by_id) или None.
+
+    Строка перечитывается в той же транзакции, поэтому вызывающему не нужен
+    отдельный get_key_by_id (RETURNING не используем: нужен SQLite >= 3.35).
+    """
     if not updates:
-        return False
+        return None
     updates = dict(updates)
     updates["updated_at"] = _now_str()
     columns = ", ".join(f"{column} = ?" for column in updates)
@@ -3015,16 +3213,24 @@ def _apply_key_updates(key_id: int, updates: dict[str, Any]) -> bool:
     values.append(key_id)
     try:
         with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(
                 f"UPDATE vpn_keys SET {columns} WHERE key_id = ?",
                 tuple(values),
             )
+            if cursor.rowcount <= 0:
+                return None
+            cursor.execute("SELECT * FROM vpn_keys WHERE key_id = ?", (key_id,))
+            row = cursor.fetchone()
             conn.commit()
-            return cursor.rowcount > 0
     except sqlite3.Error as e:
         logging.error("Failed to update key %s: %s", key_id, e)
-        return False
+        return None
+    finally:
+        # Только после commit: см. поколения в get_key_by_id
+        invalidate_key_cache(key_id)
+    return _normalize_key_row(row)
 
 
 def update_key_fields(
@@ -3041,7 +3247,7 @@ def update_key_fields(
     traffic_limit_strategy: str | None = None,
     tag: str | None = None,
     description: str | None = None,
-) -> bool:
+) -> dict | None:
     updates: dict[str, Any] = {}
     if host_name is not None:
         updates["host_name"] = normalize_host_name(host_name)
@@ -3082,6 +3288,7 @@ def delete_key_by_email(email: str) -> bool:
             )
             affected = cursor.rowcount
             conn.commit()
+            invalidate_key_cache()
             logger.debug("delete_key_by_email('%s') affected=%s", email, affected)
             return affected > 0
     except sqlite3.Error as e:
@@ -3105,17 +3312,69 @@ def get_user_keys(user_id: int) -> list[dict]:
         return []
 
 
+# Карточку ключа в админке обычно открывают и сразу закрывают/подтверждают —
+# держим строку несколько секунд. Все записи в vpn_keys из этого модуля
+# сбрасывают кэш после commit; отсутствующие ключи не кэшируются.
+# Сброс увеличивает поколение ключа (или общее при полном сбросе): чтение,
+# начатое до записи, не кладёт в кэш строку, прочитанную до commit.
+_KEY_ROW_TTL = 5.0
+_key_row_cache: dict[int, tuple[float, dict]] = {}
+_key_row_gen: dict[int, int] = {}
+_key_cache_epoch = 0
+
+
+def invalidate_key_cache(key_id: int | None = None) -> None:
+    global _key_cache_epoch
+    if key_id is None:
+        _key_cache_epoch += 1
+        _key_row_cache.clear()
+    else:
+        key_id = int(key_id)
+        _key_row_gen[key_id] = _key_row_gen.get(key_id, 0) + 1
+        _key_row_cache.pop(key_id, None)
+
+
 def get_key_by_id(key_id: int) -> dict | None:
+    cached = _key_row_cache.get(int(key_id))
+    if cached is not None and cached[0] > time.monotonic():
+        return dict(cached[1])
+    stamp = (_key_cache_epoch, _key_row_gen.get(int(key_id), 0))
     try:
         with sqlite3.connect(DB_FILE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM vpn_keys WHERE key_id = ?", (key_id,))
             row = cursor.fetchone()
-            return _normalize_key_row(row)
+            data = _normalize_key_row(row)
     except sqlite3.Error as e:
         logging.error("Failed to get key by ID %s: %s", key_id, e)
         return None
+    if data is None:
+        return None
+    if stamp == (_key_cache_epoch, _key_row_gen.get(int(key_id), 0)):
+        _key_row_cache[int(key_id)] = (time.monotonic() + _KEY_ROW_TTL, data)
+    return dict(data)
+
+
+def get_key_emails_with_prefix(prefix: str) -> set[str]:
+    """Все email ключей, начинающиеся с prefix, одним запросом.
+
+    Диапазон [prefix, prefix + U+FFFF) идёт по уникальным индексам email/key_email,
+    без LIKE (в нём '_' — спецсимвол).
+    """
+    lo = _normalize_email(prefix) or ""
+    hi = lo + "\uffff"
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            rows = conn.execute(
+                "SELECT email, key_email FROM vpn_keys"
+                " WHERE (email >= ? AND email < ?) OR (key_email >= ? AND key_email < ?)",
+                (lo, hi, lo, hi),
+            ).fetchall()
+    except sqlite3.Error as e:
+        logging.error("Failed to get key emails with prefix %s: %s", prefix, e)
+        return set()
+    return {value for row in rows for value in row if value and value.startswith(lo)}
 
 
 def get_key_by_email(key_email: str) -> dict | None:
@@ -3160,7 +3419,7 @@ def update_key_info(key_id: int, new_remnawave_uuid: str, new_expiry_ms: int, **
         remnawave_user_uuid=new_remnawave_uuid,
         expire_at_ms=new_expiry_ms,
         **kwargs,
-    )
+    ) is not None
 
 
 def update_key_host_and_info(
@@ -3176,7 +3435,31 @@ def update_key_host_and_info(
         remnawave_user_uuid=new_remnawave_uuid,
         expire_at_ms=new_expiry_ms,
         **kwargs,
-    )
+    ) is not None
+
+
+def get_keys_for_host_page(host_name: str, page: int = 0, page_size: int = 10) -> tuple[list[dict], int]:
+    """Страница ключей хоста (LIMIT/OFFSET) и общее число ключей на нём."""
+    page = max(0, int(page or 0))
+    page_size = max(1, int(page_size or 10))
+    try:
+        host_name_normalized = normalize_host_name(host_name)
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM vpn_keys WHERE TRIM(host_name) = TRIM(?)",
+                (host_name_normalized,),
+            )
+            total = cursor.fetchone()[0] or 0
+            cursor.execute(
+                "SELECT * FROM vpn_keys WHERE TRIM(host_name) = TRIM(?) ORDER BY key_id LIMIT ? OFFSET ?",
+                (host_name_normalized, page_size, page * page_size),
+            )
+            return [_normalize_key_row(row) for row in cursor.fetchall()], total
+    except sqlite3.Error as e:
+        logging.error("Failed to get keys page for host '%s': %s", host_name, e)
+        return [], 0
 
 
 def get_next_key_number(user_id: int) -> int:
@@ -3240,7 +3523,7 @@ def update_key_status_from_server(key_email: str, client_data) -> bool:
                 remnawave_user_uuid=remote_uuid,
                 expire_at_ms=expiry_ms,
                 subscription_url=subscription_url,
-            )
+            ) is not None
         if existing:
             return delete_key_by_email(normalized_email)
         return True
@@ -3401,6 +3684,16 @@ def get_keys_counts_for_users(user_ids: list[int]) -> dict[int, int]:
         logging.error("Failed to get keys counts for users: %s", e)
     return result
 
+def count_keys_for_user(user_id: int) -> int:
+    """Число ключей пользователя (COUNT по индексу idx_vpn_keys_user_id, без выборки строк)."""
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            row = conn.execute("SELECT COUNT(*) FROM vpn_keys WHERE user_id = ?", (int(user_id),)).fetchone()
+            return int(row[0] or 0) if row else 0
+    except sqlite3.Error as e:
+        logging.error("Failed to count keys for user %s: %s", user_id, e)
+        return 0
+
 def ban_user(telegram_id: int):
     try:
         with sqlite3.connect(DB_FILE) as conn:
@@ -3425,6 +3718,7 @@ def delete_user_keys(user_id: int):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM vpn_keys WHERE user_id = ?", (user_id,))
             conn.commit()
+            invalidate_key_cache()
     except sqlite3.Error as e:
         logging.error(f"Failed to delete keys for user {user_id}: {e}")
 
@@ -3495,6 +3789,7 @@ def delete_user_completely(user_id: int) -> bool:
             )
 
             conn.commit()
+            invalidate_key_cache()
             logger.info("User %s fully deleted with all related data", user_id)
             return True
     except sqlite3.Error as e:
@@ -225,7 +225,7 @@ def update_key(
     traffic_limit_strategy: str | None = None,
     tag: str | None = None,
     description: str | None = None,
-) -> bool:
+) -> dict | None:
     return database.update_key_fields(
         key_id,
         host_name=host_name,
@@ -274,17 +274,26 @@ _LEGACY_FORWARDERS = (
     "get_pending_status",
     "get_pending_metadata",
     "get_admin_ids",
+    "invalidate_admin_ids_cache",
+    "peek_admin_ids",
+    "reload_admin_ids",
+    "add_admin_id",
+    "remove_admin_id",
     "get_admin_stats",
     "get_all_hosts",
     "get_all_keys",
     "get_all_settings",
     "get_all_tickets_count",
     "get_all_users",
+    "get_user_by_username",
+    "get_users_by_ids",
+    "search_users",
     "get_balance",
     "get_closed_tickets_count",
     "get_daily_stats_for_charts",
     "get_host",
     "get_keys_for_host",
+    "get_keys_for_host_page",
     "get_keys_for_user",
     "get_latest_speedtest",
     "get_next_key_number",
@@ -292,6 +301,8 @@ _LEGACY_FORWARDERS = (
     "get_paginated_transactions",
     "get_plan_by_id",
     "get_plans_for_host",
+    "get_plans_version",
+    "bump_plans_version",
     "get_active_plans_for_host",
     "get_recent_transactions",
     "get_referral_balance",
@@ -313,6 +324,9 @@ _LEGACY_FORWARDERS = (
 
     "get_users_paginated",
     "get_keys_counts_for_users",
+    "get_key_emails_with_prefix",
+    "invalidate_key_cache",
+    "count_keys_for_user",
     "get_user_tickets",
     "insert_host_speedtest",
     "initialize_db",
@@ -508,7 +522,16 @@ def claim_gift_token(token: str, user_id: int, key_id: int | None = None) -> dic
 
 
 
-def create_promo_code(
+_PROMO_INSERT_SQL = """
+    INSERT INTO promo_codes (
+        code, discount_percent, discount_amount,
+        usage_limit_total, usage_limit_per_user,
+        valid_from, valid_until, created_by, description
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def prepare_promo_code_row(
     code: str,
     *,
     discount_percent: float | None = None,
@@ -519,7 +542,8 @@ def create_promo_code(
     valid_until: datetime | None = None,
     created_by: int | None = None,
     description: str | None = None,
-) -> bool:
+) -> tuple:
+    """Проверяет параметры промокода и возвращает строку для _PROMO_INSERT_SQL (ValueError — некорректно)."""
     code_s = (code or "").strip().upper()
     if not code_s:
         raise ValueError("code is required")
@@ -550,33 +574,61 @@ def create_promo_code(
     if valid_from and valid_until:
         if valid_until <= valid_from:
             raise ValueError("valid_until must be after valid_from")
-    try:
-        with _connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO promo_codes (
-                    code, discount_percent, discount_amount,
-                    usage_limit_total, usage_limit_per_user,
-                    valid_from, valid_until, created_by, description
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    code_s,
-                    float(discount_percent) if discount_percent is not None else None,
-                    float(discount_amount) if discount_amount is not None else None,
-                    usage_limit_total,
-                    usage_limit_per_user,
-                    valid_from.isoformat() if isinstance(valid_from, datetime) else valid_from,
-                    valid_until.isoformat() if isinstance(valid_until, datetime) else valid_until,
-                    created_by,
-                    description,
-                ),
-            )
-            conn.commit()
-            return True
-    except sqlite3.IntegrityError:
-        return False
+    return (
+        code_s,
+        float(discount_percent) if discount_percent is not None else None,
+        float(discount_amount) if discount_amount is not None else None,
+        usage_limit_total,
+        usage_limit_per_user,
+        valid_from.isoformat() if isinstance(valid_from, datetime) else valid_from,
+        valid_until.isoformat() if isinstance(valid_until, datetime) else valid_until,
+        created_by,
+        description,
+    )
+
+
+def insert_promo_code_rows(rows: list[tuple]) -> list[bool]:
+    """Вставляет подготовленные промокоды одной транзакцией.
+
+    False для строки — такой код уже есть; остальные строки это не затрагивает.
+    """
+    results: list[bool] = []
+    with _connect() as conn:
+        cursor = conn.cursor()
+        for row in rows:
+            try:
+                cursor.execute(_PROMO_INSERT_SQL, row)
+                results.append(True)
+            except sqlite3.IntegrityError:
+                results.append(False)
+        conn.commit()
+    return results
+
+
+def create_promo_code(
+    code: str,
+    *,
+    discount_percent: float | None = None,
+    discount_amount: float | None = None,
+    usage_limit_total: int | None = None,
+    usage_limit_per_user: int | None = None,
+    valid_from: datetime | None = None,
+    valid_until: datetime | None = None,
+    created_by: int | None = None,
+    description: str | None = None,
+) -> bool:
+    row = prepare_promo_code_row(
+        code,
+        discount_percent=discount_percent,
+        discount_amount=discount_amount,
+        usage_limit_total=usage_limit_total,
+        usage_limit_per_user=usage_limit_per_user,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        created_by=created_by,
+        description=description,
+    )
+    return insert_promo_code_rows([row])[0]
 
 
 def get_promo_code(code: str) -> dict | None:
@@ -601,6 +653,24 @@ def list_promo_codes(include_inactive: bool = True) -> list[dict]:
         return [dict(row) for row in cursor.fetchall()]
 
 
+def list_promo_codes_page(
+    include_inactive: bool = True,
+    limit: int = 10,
+    offset: int = 0,
+) -> tuple[list[dict], int]:
+    """Страница промокодов (свежие сверху) и общее их число."""
+    where = "" if include_inactive else " WHERE is_active = 1"
+    with _connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM promo_codes{where}")
+        total = int(cursor.fetchone()[0] or 0)
+        cursor.execute(
+            f"SELECT * FROM promo_codes{where} ORDER BY created_at DESC, code LIMIT ? OFFSET ?",
+            (int(limit), int(offset)),
+        )
+        return [dict(row) for row in cursor.fetchall()], total
+
+
 def check_promo_code_available(code: str, user_id: int) -> tuple[dict | None, str | None]:
     """Проверить возможность использования промокода, не изменяя лимиты."""
     code_s = (code or "").strip().upper()
@@ -679,6 +749,21 @@ def update_promo_code_status(code: str, *, is_active: bool | None = None) -> boo
         return cursor.rowcount > 0
 
 
+def toggle_promo_code_status(code: str) -> bool:
+    """Инвертирует is_active одним UPDATE, без предварительного чтения строки."""
+    code_s = (code or "").strip().upper()
+    if not code_s:
+        return False
+    with _connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE promo_codes SET is_active = CASE WHEN is_active THEN 0 ELSE 1 END WHERE code = ?",
+            (code_s,),
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+
 def delete_promo_code(code: str) -> bool:
     code_s = (code or "").strip().upper()
     if not code_s:
@@ -113,14 +113,15 @@ def get_support_router() -> Router:
         return types.InlineKeyboardMarkup(inline_keyboard=inline_kb)
 
     async def _is_admin(bot: Bot, chat_id: int, user_id: int) -> bool:
-        is_admin_by_setting = is_admin(user_id)
-        is_admin_in_chat = False
+        # Список админов из настроек — проверка по множеству в памяти;
+        # get_chat_member (запрос к Bot API) нужен только для остальных.
+        if is_admin(user_id):
+            return True
         try:
             member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-            is_admin_in_chat = member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR]
+            return member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR]
         except Exception:
-            pass
-        return bool(is_admin_by_setting or is_admin_in_chat)
+            return False
 
     @router.message(CommandStart(), F.chat.type == "private")
     async def start_handler(message: types.Message, state: FSMContext, bot: Bot):
@@ -509,14 +510,7 @@ def get_support_router() -> Router:
             if message.from_user and message.from_user.id == me.id:
                 return
 
-            is_admin_by_setting = is_admin(message.from_user.id)
-            is_admin_in_chat = False
-            try:
-                member = await bot.get_chat_member(chat_id=forum_chat_id, user_id=message.from_user.id)
-                is_admin_in_chat = member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR]
-            except Exception:
-                pass
-            if not (is_admin_by_setting or is_admin_in_chat):
+            if not await _is_admin(bot, forum_chat_id, message.from_user.id):
                 return
             content = (message.text or message.caption or "").strip()
             if content: